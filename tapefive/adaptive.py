@@ -0,0 +1,140 @@
+import numpy as np
+import xarray as xr
+from . import lab
+from . import windows
+
+
+def interpolation_error(wavenumber: np.ndarray, transmittance: np.ndarray) -> np.ndarray:
+    """
+    Estimate of the error of linear interpolation between the samples, from the curvature.
+
+    Between two samples, linear interpolation is off by about |second difference| / 8. A line
+    narrower than the sample spacing shows up as a single sample with a large second difference,
+    where the error of the coarse grid is much larger, so |second difference| / 2 is returned.
+    """
+    err = np.zeros_like(transmittance)
+    if transmittance.size > 2:
+        err[1:-1] = np.abs(transmittance[2:] - 2 * transmittance[1:-1] + transmittance[:-2]) / 2
+        err[0], err[-1] = err[1], err[-2]
+    return err
+
+
+def plan_refinement(wavenumber: np.ndarray, error: np.ndarray, tolerance: float, block: float = 1.0,
+                    merge_gap: float = 2 * windows.LBLRTM_BUFFER) -> list:
+    """
+    Sub-bands that need the fine grid: blocks of width block (cm^-1) whose estimated error
+    exceeds tolerance, widened by one block on each side and merged when closer than merge_gap
+    (every fine run computes the 25 cm^-1 LBLRTM buffers on both sides).
+
+    Returns
+    -------
+    list of windows.Window
+    """
+    edges = np.arange(wavenumber[0], wavenumber[-1] + block, block)
+    idx = np.clip(np.searchsorted(edges, wavenumber, side='right') - 1, 0, edges.size - 1)
+    worst = np.zeros(edges.size)
+    np.maximum.at(worst, idx, error)
+    flagged = worst > tolerance
+    flagged[1:] |= flagged[:-1].copy()
+    flagged[:-1] |= flagged[1:].copy()
+    out = []
+    for i in np.flatnonzero(flagged):
+        lo = float(max(edges[i], wavenumber[0]))
+        hi = float(min(edges[i] + block, wavenumber[-1]))
+        if out and lo - out[-1].fmax <= merge_gap:
+            out[-1] = windows.Window(fmin=out[-1].fmin, fmax=hi, filters=())
+        else:
+            out.append(windows.Window(fmin=lo, fmax=hi, filters=()))
+    return out
+
+
+def run_adaptive(lblrtm: 'lab.Lblrtm', df_coarse: float, df_fine: float | None = None, tolerance: float = 1e-3,
+                 block: float = 1.0, grid: str = 'nonuniform', max_workers: int | None = None,
+                 var_name: str = 'optical_depth', verbose: bool = False) -> xr.Dataset:
+    """
+    Run coarse first and rerun only the sub-bands with line structure on the fine grid.
+
+    The whole band runs with df_coarse (child run_name/adaptive/coarse). Where the curvature of
+    its transmittance says that the coarse sampling is off by more than tolerance (see
+    interpolation_error and plan_refinement), the sub-bands run again with df_fine, as
+    concurrent children run_name/adaptive/fine/<i> with the TAPE3 of lblrtm.
+
+    Parameters
+    ----------
+    df_coarse : float
+        df of the first pass.
+    df_fine : float, optional
+        df of the refined sub-bands, defaults to spectral_grid.df of lblrtm.
+    tolerance : float
+        Accepted absolute transmittance error of the coarse grid.
+    block : float
+        Size (cm^-1) of the sub-bands the error is evaluated on.
+    grid : str
+        'nonuniform': coarse samples outside and fine samples inside the refined sub-bands.
+        'uniform': everything on a grid with the fine spacing, linearly interpolated from the
+        coarse samples outside the refined sub-bands.
+
+    Returns
+    -------
+    xr.Dataset
+        var_name and refined (True where the fine run was used) along wavenumber, attrs with
+        the refined sub-bands (window_fmin, window_fmax) and the refined fraction of the band.
+    """
+    if grid not in ('nonuniform', 'uniform'):
+        raise ValueError("grid must be one of {'nonuniform', 'uniform'}")
+    spectral_grid = lblrtm.configuration.spectral_grid
+    df_fine = spectral_grid.df if isinstance(df_fine, type(None)) else df_fine
+    if df_coarse <= df_fine:
+        raise ValueError("df_coarse must be larger than df_fine")
+    fmin, fmax = spectral_grid.fmin, spectral_grid.fmax
+    lblrtm.prepare_tape3()
+
+    coarse = lblrtm.spawn('adaptive/coarse')
+    coarse.configuration.spectral_grid.df = df_coarse
+    ds = lab.run_concurrently([coarse])[0].data.sel(wavenumber=slice(fmin, fmax))
+    wn = ds.wavenumber.values
+    od = ds[var_name].values
+    plan = plan_refinement(wn, interpolation_error(wn, np.exp(-od)), tolerance, block=block)
+    width = sum(w.width for w in plan)
+    if verbose:
+        print(f"Refining {len(plan)} sub-band(s), {width:.1f} of {fmax - fmin:.1f} cm^-1")
+
+    runs = []
+    for i, w in enumerate(plan):
+        child = lblrtm.spawn(f'adaptive/fine/{i}')
+        child.configuration.spectral_grid.df = df_fine
+        child.configuration.spectral_grid.fmin = w.fmin
+        child.configuration.spectral_grid.fmax = w.fmax
+        runs.append(child)
+    fine = [r.data.sel(wavenumber=slice(w.fmin, w.fmax)) for r, w in zip(lab.run_concurrently(runs, max_workers=max_workers), plan)]
+
+    inside = np.zeros(wn.shape, dtype=bool)
+    for w in plan:
+        inside |= (wn >= w.fmin) & (wn <= w.fmax)
+    if grid == 'nonuniform':
+        parts_wn = [wn[~inside]] + [f.wavenumber.values for f in fine]
+        parts_od = [od[~inside]] + [f[var_name].values for f in fine]
+        parts_ref = [np.zeros((~inside).sum(), dtype=bool)] + [np.ones(f.sizes['wavenumber'], dtype=bool) for f in fine]
+        out_wn = np.concatenate(parts_wn)
+        order = np.argsort(out_wn, kind='stable')
+        out_wn, out_od, refined = out_wn[order], np.concatenate(parts_od)[order], np.concatenate(parts_ref)[order]
+    else:
+        dv = float(np.median(np.diff(fine[0].wavenumber.values))) if fine else df_fine
+        out_wn = np.arange(wn[0], wn[-1] + dv / 2, dv)
+        out_od = np.interp(out_wn, wn, od)
+        refined = np.zeros(out_wn.shape, dtype=bool)
+        for f, w in zip(fine, plan):
+            sel = (out_wn >= w.fmin) & (out_wn <= w.fmax)
+            out_od[sel] = np.interp(out_wn[sel], f.wavenumber.values, f[var_name].values)
+            refined |= sel
+
+    out = xr.Dataset({var_name: ('wavenumber', out_od.astype(od.dtype)),
+                      'refined': ('wavenumber', refined)},
+                     coords={'wavenumber': out_wn})
+    out[var_name].attrs = dict(ds[var_name].attrs)
+    out.attrs = {'source': 'tapefive adaptive resolution',
+                 'df_coarse': df_coarse, 'df_fine': df_fine, 'tolerance': tolerance,
+                 'refined_fraction': width / (fmax - fmin),
+                 'window_fmin': np.array([w.fmin for w in plan]),
+                 'window_fmax': np.array([w.fmax for w in plan])}
+    return out
@@ -0,0 +1,150 @@
+import os
+import json
+import importlib.util
+import pathlib as pl
+from datetime import datetime, timezone
+import numpy as np
+import xarray as xr
+
+# default archive names inside a run directory
+ARCHIVE_NAMES = {'netcdf': 'output.nc', 'zarr': 'output.zarr'}
+# raw output tapes that can be deleted once they are archived
+RAW_OUTPUT_PATTERNS = ('TAPE10', 'TAPE11', 'TAPE12', 'TAPE13', 'TAPE27', 'OD*_[0-9][0-9][0-9]')
+
+
+def _format_from_path(path: pl.Path) -> str:
+    return 'zarr' if path.suffix == '.zarr' else 'netcdf'
+
+
+def _netcdf_engine() -> str:
+    for engine, module in (('netcdf4', 'netCDF4'), ('h5netcdf', 'h5netcdf')):
+        if importlib.util.find_spec(module):
+            return engine
+    raise ImportError("Writing NetCDF4 archives requires netCDF4 or h5netcdf, install one of them (or use format='zarr').")
+
+
+def find_archive(path2result_dir: str | pl.Path) -> pl.Path | None:
+    """Path of the archive in a run directory, None if there is none."""
+    for name in ARCHIVE_NAMES.values():
+        p2f = pl.Path(path2result_dir).joinpath(name)
+        if p2f.exists():
+            return p2f
+    return None
+
+
+def write_archive(results, path: str | pl.Path | None = None, format: str | None = None, dtype: str = 'float32',
+                  chunk_size: int = 65536, complevel: int = 4, delete_raw: bool = False) -> pl.Path:
+    """
+    Write lab.Results to a compressed, chunked NetCDF4 or Zarr store.
+
+    The spectra are packed as dtype (float32 by default) while the wavenumber coordinate is kept
+    in float64. Both are chunked along wavenumber, so sub-ranges can be read without decompressing
+    the whole spectrum (see open_archive). Provenance is written to the attributes:
+    tapefive_tape5 (TAPE5 text), tapefive_configuration (JSON snapshot of LblrtmConfig),
+    tapefive_timings (JSON) and tapefive_archived (UTC timestamp).
+
+    Parameters
+    ----------
+    results : lab.Results
+    path : str or Path, optional
+        Target path; defaults to output.nc (or output.zarr) in the run directory.
+    format : str, optional
+        'netcdf' or 'zarr'; inferred from the suffix of path if not given.
+    dtype : str
+        Storage type of the data variables.
+    chunk_size : int
+        Number of wavenumbers per chunk.
+    complevel : int
+        zlib compression level (NetCDF4 only, Zarr uses its default compressor).
+    delete_raw : bool
+        Delete the raw output tapes (TAPE10-13, TAPE27, layer files) after the archive was
+        written and read back successfully.
+
+    Returns
+    -------
+    pathlib.Path
+        Path of the archive.
+    """
+    if isinstance(path, type(None)):
+        path = pl.Path(results.path2result_dir).joinpath(ARCHIVE_NAMES[format or 'netcdf'])
+    path = pl.Path(path)
+    format = format or _format_from_path(path)
+    if format not in ARCHIVE_NAMES:
+        raise ValueError(f"format must be one of {set(ARCHIVE_NAMES)}")
+
+    ds = results.data.copy()
+    ds.attrs['tapefive_tape5'] = results.tape5 or ''
+    ds.attrs['tapefive_configuration'] = json.dumps(results.configuration or {}, sort_keys=True)
+    ds.attrs['tapefive_timings'] = json.dumps(results.timings or {}, sort_keys=True)
+    ds.attrs['tapefive_archived'] = datetime.now(timezone.utc).isoformat()
+
+    chunk = int(min(chunk_size, ds.sizes['wavenumber']))
+    encoding = {}
+    for name, da in ds.variables.items():
+        if 'wavenumber' not in da.dims:
+            continue
+        if format == 'netcdf':
+            enc = {'zlib': True, 'complevel': complevel, 'shuffle': True, 'chunksizes': (chunk,)}
+        else:
+            enc = {'chunks': (chunk,)}
+        if name not in ds.coords and np.issubdtype(da.dtype, np.floating):
+            enc['dtype'] = dtype
+        encoding[name] = enc
+
+    # write next to the target and move in place, so an interrupted write never leaves a broken archive
+    tmp = path.with_name(f'.{path.name}.tmp{os.getpid()}')
+    _remove(tmp)
+    if format == 'netcdf':
+        ds.to_netcdf(tmp, engine=_netcdf_engine(), encoding=encoding)
+    else:
+        ds.to_zarr(tmp, encoding=encoding, mode='w')
+    _remove(path)
+    os.replace(tmp, path)
+
+    if delete_raw:
+        with open_archive(path, lazy=True) as check:
+            if check.sizes['wavenumber'] != results.data.sizes['wavenumber']:
+                raise ValueError(f"Archive {path} does not match the results, raw tapes are kept.")
+        for pattern in RAW_OUTPUT_PATTERNS:
+            for p2f in pl.Path(results.path2result_dir).glob(pattern):
+                p2f.unlink()
+    return path
+
+
+def _remove(path: pl.Path) -> None:
+    if path.is_dir():
+        import shutil
+        shutil.rmtree(path)
+    elif path.exists():
+        path.unlink()
+
+
+def open_archive(path: str | pl.Path, fmin: float | None = None, fmax: float | None = None,
+                 lazy: bool = False) -> xr.Dataset:
+    """
+    Open an archive written by write_archive, optionally only the wavenumbers fmin - fmax.
+
+    Only the chunks overlapping the requested range are read and decompressed. Data are returned
+    as float64. The provenance is available in the attributes; the configuration can be restored
+    with lab.LblrtmConfig.from_dict(json.loads(ds.attrs['tapefive_configuration'])).
+
+    Parameters
+    ----------
+    lazy : bool
+        Return the lazily indexed dataset instead of loading the selection into memory.
+    """
+    path = pl.Path(path)
+    if _format_from_path(path) == 'zarr':
+        ds = xr.open_zarr(path, chunks=None)
+    else:
+        ds = xr.open_dataset(path, engine=_netcdf_engine())
+    if not (isinstance(fmin, type(None)) and isinstance(fmax, type(None))):
+        ds = ds.sel(wavenumber=slice(fmin, fmax))
+    if lazy:
+        return ds
+    with ds:
+        out = ds.load()
+    for name in out.data_vars:
+        if np.issubdtype(out[name].dtype, np.floating):
+            out[name] = out[name].astype(np.float64)
+    return out
@@ -0,0 +1,200 @@
+import sys
+import json
+import time
+import hashlib
+import threading
+import traceback
+import concurrent.futures
+import pathlib as pl
+from . import lab
+from . import fileio
+from . import reductions
+
+# reducers that can be requested by name in a job, see _reducer
+REDUCERS = {'integral': reductions.Integral,
+            'equivalent_width': reductions.EquivalentWidth,
+            'mean': reductions.Mean,
+            'weighted_mean': reductions.WeightedMean,
+            }
+
+
+def _reducer(spec: dict) -> 'reductions.Reducer':
+    """Reducer from a dict like {"type": "mean", "fmin": 10300, "transform": "transmittance"}.
+    weighted_mean takes "response": [wavenumbers, weights]."""
+    spec = dict(spec)
+    kind = spec.pop('type', None)
+    if kind not in REDUCERS:
+        raise ValueError(f"Unknown reduction type {kind!r}, options are {set(REDUCERS)}")
+    return REDUCERS[kind](**spec)
+
+
+def default_reducers(configuration: 'lab.LblrtmConfig') -> dict:
+    """Band mean optical depth, mean transmittance and equivalent width over fmin - fmax."""
+    fmin, fmax = configuration.spectral_grid.fmin, configuration.spectral_grid.fmax
+    return {'mean_optical_depth': reductions.Mean(fmin=fmin, fmax=fmax),
+            'mean_transmittance': reductions.Mean(fmin=fmin, fmax=fmax, transform='transmittance'),
+            'equivalent_width': reductions.EquivalentWidth(fmin=fmin, fmax=fmax),
+            }
+
+
+class Tape3Cache():
+    """
+    TAPE3s made so far, by the hash of the LNFL TAPE5 and the linefile.
+
+    The first job that needs a TAPE3 runs LNFL, jobs with the same LNFL input (same spectral
+    range and molecules) wait for it and link the same TAPE3 instead of running LNFL again.
+    """
+    def __init__(self):
+        self._paths = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(run: 'lab.Lblrtm') -> str:
+        h = hashlib.sha256(run.tape5_lnfl.tape5.encode())
+        h.update(str(run.configuration.environment.linefile).encode())
+        return h.hexdigest()
+
+    def prepare(self, run: 'lab.Lblrtm') -> None:
+        """Set environment.tape3 of run to a cached TAPE3, making it first if needed."""
+        if not isinstance(run.configuration.environment.tape3, type(None)):
+            return
+        key = self.key(run)
+        with self._lock:
+            lock = self._locks.setdefault(key, threading.Lock())
+        with lock:
+            path = self._paths.get(key)
+            if isinstance(path, type(None)) or not path.exists():
+                path = run.prepare_tape3()
+                self._paths[key] = path
+                return      # the TAPE3 is in the run's own lnfl directory
+        run.configuration.environment.tape3 = path
+
+
+def _parse_job(line: str, number: int) -> dict:
+    spec = json.loads(line)
+    if 'configuration' not in spec:
+        spec = {'configuration': spec}     # a bare configuration dict
+    spec.setdefault('id', str(number))
+    return spec
+
+
+def job_configuration(spec: dict) -> 'lab.LblrtmConfig':
+    """The configuration of a job spec, with run_name/<id> (batch/<id> without a run_name) as run_name."""
+    snapshot = dict(spec['configuration'])
+    env = dict(snapshot.get('environment', {}))
+    env['run_name'] = f"{env.get('run_name') or 'batch'}/{spec.get('id')}"
+    snapshot['environment'] = env
+    return lab.LblrtmConfig.from_dict(snapshot)
+
+
+def run_job(spec: dict, tape3_cache: Tape3Cache | None = None, verbose: bool = False) -> dict:
+    """
+    Run one job specification and return its result record.
+
+    spec holds 'configuration' (a dict as from LblrtmConfig.to_dict) and optionally 'id' and
+    'reductions' ({name: {"type": ..., ...}}, see REDUCERS; default_reducers if missing). The job
+    runs in run_name/<id> (batch/<id> without a run_name), so jobs never share a run directory.
+    """
+    t0 = time.perf_counter()
+    record = {'id': spec.get('id')}
+    try:
+        # Lblrtm stays quiet, its messages would end up between the records on stdout
+        run = lab.Lblrtm()
+        run.configuration = job_configuration(spec)
+        run.lnfl = lab.lnfl.Lnfl(run)
+        if not isinstance(tape3_cache, type(None)):
+            tape3_cache.prepare(run)
+        p2fld = run.execute()
+        p2f_tape12 = p2fld.joinpath('TAPE12')
+        if not p2f_tape12.exists():
+            raise FileNotFoundError(f"LBLRTM did not write {p2f_tape12}")
+        if 'reductions' in spec:
+            reducers = {name: _reducer(r) for name, r in spec['reductions'].items()}
+        else:
+            reducers = default_reducers(run.configuration)
+        t1 = time.perf_counter()
+        values = fileio.reduce_tape12(p2f_tape12, reducers)
+        timings = dict(run.timings)
+        timings['reduce'] = time.perf_counter() - t1
+        timings['total'] = time.perf_counter() - t0
+        record.update(status='done', path=str(p2fld), reductions=values, timings=timings)
+    except Exception as e:
+        if verbose:
+            traceback.print_exc(file=sys.stderr)
+        record.update(status='failed', error=f'{type(e).__name__}: {e}', timings={'total': time.perf_counter() - t0})
+    return record
+
+
+def run_stream(lines, out=None, max_workers: int | None = None, max_in_flight: int | None = None,
+               verbose: bool = False) -> dict:
+    """
+    Run the jobs of a JSONL stream and write one JSONL result record per job as it finishes.
+
+    Jobs run on max_workers threads of this process (LBLRTM and LNFL are subprocesses), so the
+    package is imported once and TAPE3s are shared between jobs with the same LNFL input (see
+    Tape3Cache). Lines are only read while fewer than max_in_flight jobs are queued or running,
+    so a long or endless input stream does not pile up in memory. Records come out in completion
+    order; the 'id' of a record matches the job (its line number if the job has none).
+
+    Parameters
+    ----------
+    lines : iterable of str
+        Job specifications, one JSON object per line, see run_job. Blank lines are skipped.
+    out : file, optional
+        Where records are written, defaults to sys.stdout; flushed after every record.
+    max_in_flight : int, optional
+        Defaults to 2 x max_workers.
+
+    Returns
+    -------
+    dict
+        Number of jobs done and failed.
+    """
+    out = out or sys.stdout
+    max_workers = max_workers or 1
+    max_in_flight = max(max_in_flight or 2 * max_workers, max_workers)
+    cache = Tape3Cache()
+    counts = {'done': 0, 'failed': 0}
+    lock = threading.Lock()
+    slots = threading.BoundedSemaphore(max_in_flight)
+
+    def emit(record):
+        with lock:
+            counts[record['status']] += 1
+            out.write(json.dumps(record, default=float) + '\n')
+            out.flush()
+
+    def finished(future):
+        slots.release()
+        emit(future.result())
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for number, line in enumerate(lines):
+            if not line.strip():
+                continue
+            try:
+                spec = _parse_job(line, number)
+            except json.JSONDecodeError as e:
+                emit({'id': str(number), 'status': 'failed', 'error': f'invalid JSON: {e}'})
+                continue
+            slots.acquire()     # blocks reading while max_in_flight jobs are pending
+            pool.submit(run_job, spec, cache, verbose).add_done_callback(finished)
+    return counts
+
+
+def main(path: str | pl.Path | None = None, output: str | pl.Path | None = None, max_workers: int | None = None,
+         max_in_flight: int | None = None, verbose: bool = False) -> int:
+    """run_stream from a file (or stdin for None or '-') to a file (or stdout); 1 if a job failed."""
+    src = sys.stdin if path in (None, '-') else open(path)
+    dst = sys.stdout if output in (None, '-') else open(output, 'a')
+    try:
+        counts = run_stream(src, dst, max_workers=max_workers, max_in_flight=max_in_flight, verbose=verbose)
+    finally:
+        if src is not sys.stdin:
+            src.close()
+        if dst is not sys.stdout:
+            dst.close()
+    if verbose:
+        print(f"{counts['done']} job(s) done, {counts['failed']} failed", file=sys.stderr)
+    return int(counts['failed'] > 0)
@@ -0,0 +1,100 @@
+import sys
+import argparse
+
+
+def _worker(args) -> int:
+    from . import workqueue
+    worker = workqueue.Worker(args.queue, name=args.name, heartbeat=args.heartbeat, verbose=args.verbose)
+    count = worker.run(max_jobs=args.max_jobs, idle_timeout=args.idle_timeout, poll=args.poll)
+    print(f"{worker.name}: processed {count} job(s)")
+    return 0
+
+
+def _queue(args) -> int:
+    from . import workqueue
+    queue = workqueue.WorkQueue(args.queue)
+    if args.requeue_stale is not None:
+        for job_id in queue.requeue_stale(args.requeue_stale):
+            print(f"requeued {job_id}")
+    for state, n in queue.status().items():
+        print(f"{state:8s} {n}")
+    return 0
+
+
+def _workspace(args) -> int:
+    from . import workspace
+    ws = workspace.Workspace(args.project_directory, budget=args.budget)
+    if not isinstance(ws.budget, type(None)):
+        ws.enforce(dry_run=args.dry_run, verbose=True)
+    print(ws.report())
+    return 0
+
+
+def _index(args) -> int:
+    from . import index
+    idx = index.RunIndex(args.database)
+    if args.prune:
+        print(f"Removed {idx.prune()} entries without output")
+    for root in args.scan:
+        idx.scan(root, max_workers=args.workers, verbose=True)
+    return 0
+
+
+def _batch(args) -> int:
+    from . import batch
+    return batch.main(args.jobs, output=args.output, max_workers=args.workers, max_in_flight=args.max_in_flight,
+                      verbose=args.verbose)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='tapefive', description='Command line tools of tapefive.')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('worker', help='Run jobs from a work queue directory.')
+    p.add_argument('--queue', required=True, help='Queue directory, see tapefive.workqueue.WorkQueue.')
+    p.add_argument('--name', default=None, help='Worker name, defaults to host:pid.')
+    p.add_argument('--heartbeat', type=float, default=10.0, help='Seconds between heartbeats.')
+    p.add_argument('--max-jobs', type=int, default=None, help='Stop after this many jobs.')
+    p.add_argument('--idle-timeout', type=float, default=None,
+                   help='Stop when the queue was empty for this many seconds (default: wait forever).')
+    p.add_argument('--poll', type=float, default=1.0, help='Seconds between looks into an empty queue.')
+    p.add_argument('-v', '--verbose', action='store_true')
+    p.set_defaults(func=_worker)
+
+    p = sub.add_parser('queue', help='Show the state of a work queue.')
+    p.add_argument('--queue', required=True, help='Queue directory.')
+    p.add_argument('--requeue-stale', type=float, default=None, metavar='SECONDS',
+                   help='Put running jobs without a heartbeat for SECONDS back to pending.')
+    p.set_defaults(func=_queue)
+
+    p = sub.add_parser('workspace', help='Report the disk usage of a project directory and enforce a budget.')
+    p.add_argument('project_directory')
+    p.add_argument('--budget', default=None, help='Evict least recently used entries until the usage is below, e.g. 50G.')
+    p.add_argument('--dry-run', action='store_true', help='Only show what would be evicted.')
+    p.set_defaults(func=_workspace)
+
+    p = sub.add_parser('index', help='Index existing run directories for reuse, see tapefive.index.RunIndex.')
+    p.add_argument('database', help='SQLite file of the index.')
+    p.add_argument('--scan', nargs='*', default=[], metavar='DIR', help='Directory trees to scan.')
+    p.add_argument('--workers', type=int, default=None, help='Number of parallel readers.')
+    p.add_argument('--prune', action='store_true', help='Drop entries whose output is gone.')
+    p.set_defaults(func=_index)
+
+    p = sub.add_parser('batch', help='Run JSONL job specifications and stream JSONL results, see tapefive.batch.')
+    p.add_argument('jobs', nargs='?', default='-', help='JSONL file of jobs, - (default) reads stdin.')
+    p.add_argument('-o', '--output', default='-', help='File the result records are appended to, - (default) is stdout.')
+    p.add_argument('--workers', type=int, default=None, help='Number of concurrent jobs (default 1).')
+    p.add_argument('--max-in-flight', type=int, default=None,
+                   help='Jobs read ahead, queued or running (default 2 x workers).')
+    p.add_argument('-v', '--verbose', action='store_true', help='Tracebacks and a summary on stderr.')
+    p.set_defaults(func=_batch)
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,10 +1,125 @@
+import os
 import re
+import threading
+import collections
 import pathlib as pl
 from datetime import datetime
+from dataclasses import dataclass
 import numpy as np
 import xarray as xr
 
-def read_tape27(path):
+
+class _DatasetCache():
+    """
+    LRU cache of parsed datasets, bounded by their total size in bytes.
+
+    Entries are keyed by the file identity (resolved path, inode, size and mtime) and the read
+    options, so a file that changes is read again; the outdated entry of the file is dropped.
+    The cached arrays are read-only and every hit returns a shallow copy, so callers can change
+    attrs or assign new variables without affecting the cache.
+    """
+    def __init__(self, max_bytes: int = 512 * 1024 ** 2):
+        self.max_bytes = max_bytes
+        self._entries = collections.OrderedDict()   # key: (dataset, nbytes)
+        self._keys_by_path = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _key(path, reader: str, options: tuple) -> tuple:
+        path = os.path.realpath(path)
+        st = os.stat(path)
+        return (path, st.st_ino, st.st_size, st.st_mtime_ns, reader, options)
+
+    @staticmethod
+    def _freeze(ds: xr.Dataset) -> int:
+        nbytes = 0
+        for v in ds.variables.values():
+            if isinstance(v.data, np.ndarray):
+                v.data.flags.writeable = False
+            nbytes += v.nbytes
+        for a in ds.attrs.values():
+            if isinstance(a, np.ndarray):
+                a.flags.writeable = False
+                nbytes += a.nbytes
+        return nbytes
+
+    def get(self, path, reader, options: tuple, read):
+        key = self._key(path, reader.__name__, options)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0].copy(deep=False)
+            self.misses += 1
+        ds = read()
+        nbytes = self._freeze(ds)
+        with self._lock:
+            keys = self._keys_by_path.setdefault(key[0], set())
+            for k in [k for k in keys if k[1:4] != key[1:4]]:    # the file changed
+                self._entries.pop(k, None)
+                keys.discard(k)
+            if nbytes <= self.max_bytes:
+                self._entries[key] = (ds, nbytes)
+                keys.add(key)
+                self._shrink()
+        return ds.copy(deep=False)
+
+    def _shrink(self) -> None:
+        total = sum(n for _, n in self._entries.values())
+        while total > self.max_bytes and self._entries:
+            key, (_, n) = self._entries.popitem(last=False)
+            self._keys_by_path.get(key[0], set()).discard(key)
+            total -= n
+            self.evictions += 1
+
+    def info(self) -> dict:
+        with self._lock:
+            return dict(hits=self.hits, misses=self.misses, evictions=self.evictions, entries=len(self._entries),
+                        bytes=sum(n for _, n in self._entries.values()), max_bytes=self.max_bytes)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_path.clear()
+            self.hits = self.misses = self.evictions = 0
+
+
+_cache = _DatasetCache()
+
+
+def cache_info() -> dict:
+    """Hits, misses, evictions, number of entries and bytes of the reader cache (read_tape12, read_tape27)."""
+    return _cache.info()
+
+
+def cache_clear() -> None:
+    """Drop all cached datasets and reset the statistics."""
+    _cache.clear()
+
+
+def set_cache_limit(max_bytes: int | str) -> None:
+    """Size of the reader cache, e.g. 2 ** 30 or '1G'; 0 disables caching."""
+    from . import workspace
+    with _cache._lock:
+        _cache.max_bytes = workspace.parse_size(max_bytes)
+        _cache._shrink()
+
+
+def read_tape27(path, cache: bool = True) -> xr.Dataset:
+    """
+    Read an LBLRTM TAPE27 (ASCII transmittance) file.
+
+    Unchanged files are served from the in-memory cache (read-only arrays), see cache_info.
+    """
+    if not cache:
+        return _read_tape27(path)
+    return _cache.get(path, _read_tape27, (), lambda: _read_tape27(path))
+
+
+def _read_tape27(path):
     lines = pl.Path(path).read_text(errors="replace").splitlines()
 
     # header
@@ -61,10 +176,14 @@ def read_tape27(path):
 
 
 
-def read_tape12(path: str, var_name: str = "optical_depth", units: str = '1') -> xr.Dataset:
+def read_tape12(path: str, var_name: str = "optical_depth", units: str = '1', cache: bool = True) -> xr.Dataset:
     """
     Read an LBLRTM TAPE12 (Fortran unformatted) binary file and return an xarray.Dataset.
 
+    Unchanged files are served from an in-memory LRU cache (keyed by path, inode, size, mtime
+    and the options). The arrays of the dataset are read-only; use .copy() before changing
+    values in place. See cache_info, cache_clear and set_cache_limit; cache=False bypasses it.
+
     Returns
     -------
     xarray.Dataset
@@ -74,109 +193,463 @@ def read_tape12(path: str, var_name: str = "optical_depth", units: str = '1') ->
             - value (float64): spectrum values (e.g., transmittance, radiance, OD)
         Attributes:
             - source, endianness, record_marker_bytes, panel_count, v1_first, v2_last
+            - panel_v1, panel_dv, panel_n: first wavenumber, spacing and sample count of each 
+              panel after removing duplicate boundary samples
     """
-    import io
-    import os
-    import struct
-    import numpy as np
-    import xarray as xr
-
-    def _detect_and_read_records(f: io.BufferedReader):
-        """Auto-detect record-marker size (4/8 bytes) and endianness (< or >), then return list of record payloads."""
-        file_bytes = f.read()
-        for marker_bytes, endian in ((4, "<"), (4, ">"), (8, "<"), (8, ">")):
-            try:
-                recs = []
-                pos = 0
-                total = len(file_bytes)
-                fmt_char = "I" if marker_bytes == 4 else "Q"
-                while pos + marker_bytes <= total:
-                    size = struct.unpack_from(endian + fmt_char, file_bytes, pos)[0]
-                    pos += marker_bytes
-                    if size < 0 or pos + size > total:
-                        raise ValueError
-                    payload = memoryview(file_bytes)[pos:pos + size].tobytes()
-                    pos += size
-                    if pos + marker_bytes > total:
-                        raise ValueError
-                    size2 = struct.unpack_from(endian + fmt_char, file_bytes, pos)[0]
-                    pos += marker_bytes
-                    if size2 != size:
-                        raise ValueError
-                    recs.append(payload)
-                return recs, marker_bytes, endian
-            except Exception:
-                continue
-        raise ValueError("Unable to detect Fortran record markers / endianness.")
+    if not cache:
+        return _read_tape12(path, var_name=var_name, units=units)
+    return _cache.get(path, _read_tape12, (var_name, units), lambda: _read_tape12(path, var_name=var_name, units=units))
 
-    with open(path, "rb") as f:
-        records, marker_bytes, endian = _detect_and_read_records(f)
 
-    wn_blocks = []
-    val_blocks = []
-    v1_list = []
-    v2_list = []
-    i = 0
-    nrec = len(records)
-
-    # Each panel is: header record (v1, v2, dv, n) followed by a data record of length n*(4 or 8) bytes
-    while i < nrec - 1:
-        hdr = records[i]
-        dat = records[i + 1]
-
-        matched = False
-        for fmt, _ in (("ddfi", np.float32), ("dddi", np.float64), ("dddq", np.float64)):
-            fmt_full = endian + fmt
-            need = struct.calcsize(fmt_full)
-            if len(hdr) >= need:
-                try:
-                    vals = struct.unpack_from(fmt_full, hdr, 0)
-                    if fmt.endswith("q"):
-                        v1, v2, dv, n = float(vals[0]), float(vals[1]), float(vals[2]), int(vals[3])
-                    else:
-                        v1, v2, dv, n = float(vals[0]), float(vals[1]), float(vals[2]), int(vals[3])
-
-                    if n > 0 and (len(dat) == n * 4 or len(dat) == n * 8):
-                        wn = v1 + np.arange(n, dtype=np.float64) * dv
-                        if len(dat) == n * 4:
-                            vec = np.frombuffer(dat, dtype=np.dtype(endian + "f4")).astype(np.float64)
-                        else:
-                            vec = np.frombuffer(dat, dtype=np.dtype(endian + "f8"))
-
-                        # Avoid duplicate boundary sample between panels
-                        if wn_blocks and abs(wn[0] - wn_blocks[-1][-1]) <= max(1e-6, 1e-6 * abs(dv)):
-                            wn = wn[1:]
-                            vec = vec[1:]
-
-                        if wn.size:
-                            wn_blocks.append(wn)
-                            val_blocks.append(vec)
-                            v1_list.append(v1)
-                            v2_list.append(v2)
-                        i += 2
-                        matched = True
-                        break
-                except Exception:
-                    pass
-
-        if not matched:
-            i += 1
-
-    if not wn_blocks:
+def _read_tape12(path, var_name: str = "optical_depth", units: str = '1') -> xr.Dataset:
+    panels = list(iter_tape12_panels(path))
+    if not panels:
         raise ValueError("No recognizable panels found in TAPE12 file.")
 
-    wn = np.concatenate(wn_blocks)
-    val = np.concatenate(val_blocks)
+    wn = np.concatenate([p.wavenumber for p in panels])
+    val = np.concatenate([p.values for p in panels])
 
     return xr.Dataset(
         data_vars={var_name: ("wavenumber", val,  {"long_name": var_name, "units": units}),},
         coords={"wavenumber": ("wavenumber", wn)},
         attrs={
             "source": os.path.basename(path),
-            "endianness": "little" if endian == "<" else "big",
-            "record_marker_bytes": marker_bytes,
-            "panel_count": len(val_blocks),
-            "v1_first": v1_list[0],
-            "v2_last": v2_list[-1],
+            "endianness": "little" if panels[0].endian == "<" else "big",
+            "record_marker_bytes": panels[0].marker_bytes,
+            "panel_count": len(panels),
+            "v1_first": panels[0].v1,
+            "v2_last": panels[-1].v2,
+            # piecewise uniform layout of the wavenumber coordinate, used by regrid.PanelGrid
+            "panel_v1": np.array([p.start for p in panels]),
+            "panel_dv": np.array([p.dv for p in panels], dtype=np.float64),
+            "panel_n": np.array([p.n for p in panels], dtype=np.int64),
         },
-    )
\ No newline at end of file
+    )
+
+
+@dataclass
+class Panel:
+    """One panel of a TAPE12-like file, see iter_tape12_panels."""
+    v1: float
+    v2: float
+    dv: float
+    n: int                  # number of samples after removing a duplicate boundary sample
+    start: float            # wavenumber of the first kept sample
+    skip: int               # 1 if the first sample of the panel was dropped as a duplicate
+    values: np.ndarray | None
+    data_offset: int        # file offset of the first kept sample
+    itemsize: int           # 4 (single) or 8 (double precision)
+    endian: str
+    marker_bytes: int
+
+    @property
+    def wavenumber(self) -> np.ndarray:
+        return (self.v1 + np.arange(self.n + self.skip, dtype=np.float64) * self.dv)[self.skip:]
+
+
+def _parse_panel_header(hdr: bytes, data_size: int, endian: str):
+    """(v1, v2, dv, n, itemsize) if hdr is a panel header followed by a data record of data_size bytes."""
+    import struct
+    # Each panel is: header record (v1, v2, dv, n) followed by a data record of length n*(4 or 8) bytes
+    for fmt in ("ddfi", "dddi", "dddq"):
+        fmt_full = endian + fmt
+        if len(hdr) >= struct.calcsize(fmt_full):
+            v1, v2, dv, n = struct.unpack_from(fmt_full, hdr, 0)
+            n = int(n)
+            if n > 0 and data_size in (n * 4, n * 8):
+                return float(v1), float(v2), float(dv), n, data_size // n
+    return None
+
+
+def iter_tape12_panels(path, headers_only: bool = False, dtype=np.float64):
+    """
+    Stream the panels of an LBLRTM TAPE12 (or TAPE10/11/13, layer OD files) one at a time from disk.
+
+    Only one panel is held in memory at a time. A sample at the start of a panel that repeats
+    the last sample of the previous panel is dropped, as in read_tape12.
+
+    Parameters
+    ----------
+    headers_only : bool
+        Only read the panel headers; the data records are skipped (values is None).
+    dtype : numpy dtype
+        Type the values are converted to.
+
+    Yields
+    ------
+    Panel
+    """
+    with open(path, "rb") as f:
+        marker_bytes, endian = _detect_record_format(f)
+        pending = None      # payload of the previous record, a header candidate
+        last_wn = None
+        for offset, size in _iter_record_spans(f, marker_bytes, endian):
+            if not isinstance(pending, type(None)):
+                hdr = _parse_panel_header(pending, size, endian)
+                if hdr:
+                    pending = None
+                    v1, v2, dv, n, itemsize = hdr
+                    skip = int(not isinstance(last_wn, type(None)) and abs(v1 - last_wn) <= max(1e-6, 1e-6 * abs(dv)))
+                    last_wn = v1 + (n - 1) * dv
+                    if n - skip <= 0:
+                        continue
+                    values = None
+                    if not headers_only:
+                        f.seek(offset + skip * itemsize)
+                        raw = f.read((n - skip) * itemsize)
+                        values = np.frombuffer(raw, dtype=np.dtype(f"{endian}f{itemsize}")).astype(dtype)
+                    yield Panel(v1=v1, v2=v2, dv=dv, n=n - skip, start=v1 + skip * dv, skip=skip, values=values,
+                                data_offset=offset + skip * itemsize, itemsize=itemsize, endian=endian,
+                                marker_bytes=marker_bytes)
+                    continue
+            if size <= 64:
+                f.seek(offset)
+                pending = f.read(size)
+            else:
+                pending = None
+
+
+def validate_tape12(path, fmin: float | None = None, fmax: float | None = None) -> bool:
+    """
+    Check from the panel headers that a TAPE12 is complete: all records are intact and, if
+    given, the panels cover fmin - fmax. False for missing, truncated or partially written files.
+    """
+    try:
+        panels = list(iter_tape12_panels(path, headers_only=True))
+        with open(path, "rb") as f:
+            f.seek(0, 2)
+            end = f.tell()
+    except (OSError, ValueError):
+        return False
+    if not panels:
+        return False
+    last = panels[-1]
+    if last.data_offset + last.n * last.itemsize + last.marker_bytes > end:
+        return False
+    if not isinstance(fmin, type(None)) and panels[0].start > fmin:
+        return False
+    if not isinstance(fmax, type(None)) and last.start + (last.n - 1) * last.dv < fmax:
+        return False
+    return True
+
+
+def reduce_tape12(path, reducers):
+    """
+    Compute reductions of a TAPE12 spectrum while streaming its panels from disk.
+
+    The full spectrum is never held in memory, so memory use is constant and the time is bound
+    by I/O. See the reductions module for reducers (filter-weighted mean, band integral,
+    equivalent width, ...).
+
+    Parameters
+    ----------
+    reducers : dict or sequence
+        reductions.Reducer instances, as {name: reducer} or a list.
+
+    Returns
+    -------
+    dict or list
+        The result of each reducer, in the same structure as reducers.
+    """
+    items = list(reducers.items()) if isinstance(reducers, dict) else list(enumerate(reducers))
+    for _, r in items:
+        r.reset()
+    for panel in iter_tape12_panels(path):
+        wn = panel.wavenumber
+        for _, r in items:
+            r.update(wn, panel.values, panel.dv)
+    if isinstance(reducers, dict):
+        return {k: r.result() for k, r in items}
+    return [r.result() for _, r in items]
+
+
+def _read_window(path, fmin=None, fmax=None, dtype=np.float64):
+    """(wavenumber, values) of a TAPE12 within fmin - fmax; only the panels overlapping the window are read."""
+    lo = -np.inf if isinstance(fmin, type(None)) else fmin
+    hi = np.inf if isinstance(fmax, type(None)) else fmax
+    wns, vals = [], []
+    panels = [p for p in iter_tape12_panels(path, headers_only=True)
+              if p.start <= hi and p.start + (p.n - 1) * p.dv >= lo]
+    with open(path, "rb") as f:
+        for p in panels:
+            wn = p.wavenumber
+            keep = np.flatnonzero((wn >= lo) & (wn <= hi))
+            if keep.size == 0:
+                continue
+            f.seek(p.data_offset + int(keep[0]) * p.itemsize)
+            raw = f.read(keep.size * p.itemsize)
+            vals.append(np.frombuffer(raw, dtype=np.dtype(f"{p.endian}f{p.itemsize}")).astype(dtype))
+            wns.append(wn[keep[0]:keep[-1] + 1])
+    if not wns:
+        return np.empty(0), np.empty(0, dtype=dtype)
+    return np.concatenate(wns), np.concatenate(vals)
+
+
+def _fill_row(row, path, fmin, fmax, target):
+    wn, values = _read_window(path, fmin, fmax, dtype=row.dtype)
+    if wn.size == target.size and np.allclose(wn, target, rtol=0, atol=1e-6):
+        row[:] = values
+    else:
+        # different grid than the first file
+        row[:] = np.interp(target, wn, values, left=np.nan, right=np.nan) if wn.size else np.nan
+
+
+def _shared_block_dir() -> str:
+    # RAM backed on Linux, like multiprocessing.shared_memory
+    import tempfile
+    return '/dev/shm' if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK) else tempfile.gettempdir()
+
+
+def _fill_shared_row(args):
+    path, block, shape, dtype, i, fmin, fmax, target_panels = args
+    out = np.memmap(block, dtype=dtype, mode='r+', shape=shape)
+    target = np.concatenate([v1 + np.arange(n) * dv for v1, dv, n in target_panels]) if target_panels else np.empty(0)
+    _fill_row(out[i], path, fmin, fmax, target)
+    out.flush()
+    del out
+
+
+def read_many(paths, fmin: float | None = None, fmax: float | None = None, dtype=np.float32,
+              executor: str = 'thread', max_workers: int | None = None,
+              var_name: str = "optical_depth", units: str = '1') -> xr.Dataset:
+    """
+    Read many TAPE12 files concurrently into one stacked array.
+
+    The panel headers of the first file define the wavenumber grid (within fmin - fmax), the
+    output array is allocated once and every file is written into its row; only the panels
+    overlapping the window are read. Files on a different grid are interpolated linearly
+    (NaN outside their coverage).
+
+    Parameters
+    ----------
+    paths : sequence
+        TAPE12 files.
+    fmin, fmax : float, optional
+        Wavenumber window.
+    dtype : numpy dtype
+        Type of the stacked array (float32 halves the memory of float64).
+    executor : str
+        'thread' (default, the reading is I/O bound) or 'process'. Process workers write
+        into a shared memory mapping that becomes the returned array, so no arrays are pickled
+        or copied.
+    max_workers : int, optional
+        Size of the pool.
+
+    Returns
+    -------
+    xarray.Dataset
+        var_name with dimensions (run, wavenumber) and the coordinate path along run.
+    """
+    import concurrent.futures
+    paths = [str(p) for p in paths]
+    if executor not in ('thread', 'process'):
+        raise ValueError("executor must be one of {'thread', 'process'}")
+    if not paths:
+        raise ValueError("No files given.")
+    dtype = np.dtype(dtype)
+    lo = -np.inf if isinstance(fmin, type(None)) else fmin
+    hi = np.inf if isinstance(fmax, type(None)) else fmax
+    target_panels = []
+    for p in iter_tape12_panels(paths[0], headers_only=True):
+        wn = p.wavenumber
+        keep = np.flatnonzero((wn >= lo) & (wn <= hi))
+        if keep.size:
+            target_panels.append((float(wn[keep[0]]), p.dv, int(keep.size)))
+    if not target_panels:
+        raise ValueError(f"{paths[0]} has no samples between {fmin} and {fmax}.")
+    target = np.concatenate([v1 + np.arange(n) * dv for v1, dv, n in target_panels])
+    shape = (len(paths), target.size)
+
+    if executor == 'thread':
+        out = np.empty(shape, dtype=dtype)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as pool:
+            list(pool.map(lambda i: _fill_row(out[i], paths[i], fmin, fmax, target), range(len(paths))))
+    else:
+        import tempfile
+        # the workers write into a shared mapping of a (RAM backed) file. The parent maps it too
+        # and removes the name right away: the returned array owns the mapping, no copy is made
+        # and the memory is freed with the array.
+        fd, block = tempfile.mkstemp(prefix='tapefive_read_many_', dir=_shared_block_dir())
+        try:
+            with open(fd, 'wb') as f:
+                f.truncate(max(int(np.prod(shape)) * dtype.itemsize, 1))
+            out = np.memmap(block, dtype=dtype, mode='r+', shape=shape)
+            tasks = [(p, block, shape, dtype.str, i, fmin, fmax, target_panels) for i, p in enumerate(paths)]
+            with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as pool:
+                list(pool.map(_fill_shared_row, tasks, chunksize=max(1, len(tasks) // (4 * (max_workers or 8)))))
+            out = out.view(np.ndarray)
+        finally:
+            os.unlink(block)
+
+    return xr.Dataset(
+        data_vars={var_name: (("run", "wavenumber"), out, {"long_name": var_name, "units": units})},
+        coords={"run": np.arange(len(paths)), "path": ("run", paths), "wavenumber": ("wavenumber", target)},
+        attrs={"panel_v1": np.array([t[0] for t in target_panels]),
+               "panel_dv": np.array([t[1] for t in target_panels], dtype=np.float64),
+               "panel_n": np.array([t[2] for t in target_panels], dtype=np.int64)},
+    )
+
+
+def _detect_record_format(f):
+    """Detect record-marker size (4/8 bytes) and endianness (< or >) from the first record of an open file."""
+    import struct
+    start = f.tell()
+    end = os.fstat(f.fileno()).st_size
+    head = f.read(8)
+    for marker_bytes, endian in ((4, "<"), (4, ">"), (8, "<"), (8, ">")):
+        if len(head) < marker_bytes:
+            continue
+        fmt = endian + ("I" if marker_bytes == 4 else "Q")
+        f.seek(start)
+        ok = False
+        for _ in range(3):   # the first records have to be consistent
+            m = f.read(marker_bytes)
+            if len(m) < marker_bytes:
+                break
+            size = struct.unpack(fmt, m)[0]
+            if size > end - f.tell() - marker_bytes:
+                # e.g. the high bytes of an 8 byte marker read with the wrong byte order
+                ok = False
+                break
+            f.seek(size, 1)
+            tail = f.read(marker_bytes)
+            ok = len(tail) == marker_bytes and struct.unpack(fmt, tail)[0] == size
+            if not ok:
+                break
+        if ok:
+            f.seek(start)
+            return marker_bytes, endian
+    f.seek(start)
+    raise ValueError("Unable to detect Fortran record markers / endianness.")
+
+
+def _iter_record_spans(f, marker_bytes, endian):
+    """Yield (offset, size) of each Fortran record payload without reading it."""
+    import struct
+    fmt = endian + ("I" if marker_bytes == 4 else "Q")
+    while True:
+        m = f.read(marker_bytes)
+        if len(m) < marker_bytes:
+            return
+        size = struct.unpack(fmt, m)[0]
+        offset = f.tell()
+        yield offset, size
+        f.seek(offset + size)
+        m2 = f.read(marker_bytes)
+        if len(m2) < marker_bytes or struct.unpack(fmt, m2)[0] != size:
+            raise ValueError(f"Corrupt Fortran record at byte {offset - marker_bytes}.")
+
+
+@dataclass
+class Tape3Header:
+    """Content of the LNFL TAPE3 header record and block directory (see read_tape3_header)."""
+    path: pl.Path
+    line_file_id: str
+    flinlo: float
+    flinhi: float
+    n_lines: int
+    molecule_names: tuple
+    molecule_line_counts: tuple
+    block_v1: np.ndarray
+    block_v2: np.ndarray
+    block_n_lines: np.ndarray
+
+    @property
+    def molecules(self) -> dict:
+        """Molecules with at least one line in the TAPE3, {LBLRTM molecule index: (name, line count)}."""
+        return {i + 1: (name, n) for i, (name, n) in enumerate(zip(self.molecule_names, self.molecule_line_counts)) if n > 0}
+
+    @property
+    def block_count(self) -> int:
+        return len(self.block_v1)
+
+    def covers(self, v1: float, v2: float, molecule_indices, selected_indices=None) -> bool:
+        """
+        Check whether this TAPE3 can be used for a run over [v1, v2] with the given molecules.
+
+        molecule_indices are the 1-based LBLRTM indices of the requested molecules. A TAPE3
+        holding lines of additional molecules does not cover the request, because LBLRTM would
+        include their absorption. Requested molecules without lines in the TAPE3 are only accepted
+        if they are in selected_indices, i.e. LNFL was asked for them but found no lines.
+        """
+        if self.flinlo > v1 or self.flinhi < v2:
+            return False
+        requested = set(molecule_indices)
+        present = set(self.molecules.keys())
+        if present - requested:
+            return False
+        missing = requested - present
+        if missing and not missing.issubset(set(selected_indices or ())):
+            return False
+        return True
+
+
+def read_tape3_header(path) -> Tape3Header:
+    """
+    Read the header and the block directory of an LNFL TAPE3 without reading the line records.
+
+    The line records are skipped using the Fortran record markers, so this is fast even for
+    TAPE3 files of several GB. Single and double precision LNFL builds are supported.
+
+    Returns
+    -------
+    Tape3Header
+        spectral coverage (flinlo, flinhi and per-block v1/v2), molecules with their line counts
+        and the total line count.
+    """
+    import struct
+
+    path = pl.Path(path)
+    with open(path, "rb") as f:
+        marker_bytes, endian = _detect_record_format(f)
+        spans = _iter_record_spans(f, marker_bytes, endian)
+        offset, size = next(spans)
+        f.seek(offset)
+        hdr = f.read(size)
+
+        # HLINID(10), BMOLID(64) [A8], MOLCNT(64), MCNTLC(64), MCNTNL(64) [int], SUMSTR(64) [real],
+        # NMOL [int], FLINLO, FLINHI [real*8], ILIN, ILINLC, ILINNL, IREC, IRECTL [int], HID1(2) [A8]
+        for isz, rsz in ((4, 4), (8, 8), (4, 8), (8, 4)):
+            ic = "i" if isz == 4 else "q"
+            rc = "f" if rsz == 4 else "d"
+            fmt = endian + "80s512s" + f"64{ic}" * 3 + f"64{rc}" + f"{ic}dd{ic}{ic}{ic}{ic}{ic}16s"
+            if struct.calcsize(fmt) == size:
+                break
+        else:
+            raise ValueError(f"Unrecognized TAPE3 header record of {size} bytes in {path}.")
+        vals = struct.unpack(fmt, hdr)
+        hlinid, bmolid = vals[0], vals[1]
+        molcnt = vals[2:66]
+        flinlo, flinhi, ilin = vals[259], vals[260], vals[261]
+        names = tuple(bmolid[i:i + 8].decode("ascii", errors="replace").strip("\x00 ") for i in range(0, 512, 8))
+
+        # block directory: panel header (VMIN, VMAX, NREC, NWDS) followed by the line record
+        pfmt = endian + f"dd{ic}{ic}"
+        psize = struct.calcsize(pfmt)
+        v1s, v2s, nrecs = [], [], []
+        expect_header = True
+        for offset, size in spans:
+            if not expect_header:
+                expect_header = True
+                continue
+            if size != psize:
+                continue
+            f.seek(offset)
+            vmin, vmax, nrec, nwds = struct.unpack(pfmt, f.read(psize))
+            if nrec <= 0 or vmin < 0:
+                break   # LNFL terminates the file with an empty panel
+            v1s.append(vmin)
+            v2s.append(vmax)
+            nrecs.append(nrec)
+            expect_header = False
+
+    return Tape3Header(path=path,
+                       line_file_id=hlinid.decode("ascii", errors="replace").strip("\x00 "),
+                       flinlo=float(flinlo),
+                       flinhi=float(flinhi),
+                       n_lines=int(ilin),
+                       molecule_names=names,
+                       molecule_line_counts=tuple(int(n) for n in molcnt),
+                       block_v1=np.asarray(v1s, dtype=float),
+                       block_v2=np.asarray(v2s, dtype=float),
+                       block_n_lines=np.asarray(nrecs, dtype=int))
@@ -0,0 +1,268 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+import concurrent.futures
+import pathlib as pl
+from . import lab
+from . import fileio
+from . import tape5parser
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    path TEXT PRIMARY KEY,
+    tape5_hash TEXT NOT NULL,
+    tape5_mtime REAL,
+    tape12_mtime REAL,
+    tape12_size INTEGER,
+    tape3_id TEXT,
+    lnfl_tape5_hash TEXT,
+    linefile_id TEXT,
+    v1 REAL, v2 REAL, sample REAL, dvout REAL, iod INTEGER, ihirac INTEGER, icntnm INTEGER,
+    imrg INTEGER, model INTEGER, itype INTEGER, angle REAL, h1 REAL, h2 REAL, nlayers INTEGER,
+    molecules TEXT,
+    wn_first REAL, wn_last REAL, panels INTEGER, samples INTEGER, dv_min REAL, dv_max REAL,
+    valid INTEGER,
+    parameters TEXT,
+    indexed REAL
+);
+CREATE INDEX IF NOT EXISTS runs_tape5_hash ON runs (tape5_hash);
+CREATE INDEX IF NOT EXISTS runs_range ON runs (wn_first, wn_last);
+CREATE INDEX IF NOT EXISTS runs_angle ON runs (angle);
+"""
+COLUMNS = ('path', 'tape5_hash', 'tape5_mtime', 'tape12_mtime', 'tape12_size', 'tape3_id', 'lnfl_tape5_hash',
+           'linefile_id', 'v1', 'v2', 'sample', 'dvout', 'iod', 'ihirac', 'icntnm', 'imrg', 'model', 'itype', 'angle',
+           'h1', 'h2', 'nlayers', 'molecules', 'wn_first', 'wn_last', 'panels', 'samples', 'dv_min', 'dv_max', 'valid',
+           'parameters', 'indexed')
+# columns added after the first version, for databases created before
+ADDED_COLUMNS = {'lnfl_tape5_hash': 'TEXT', 'linefile_id': 'TEXT'}
+
+
+def tape5_hash(text: str) -> str:
+    """Hash of a TAPE5 that ignores comments and trailing blanks."""
+    return hashlib.sha256(tape5parser.normalize_tape5(text).encode()).hexdigest()
+
+
+def tape3_id(path: str | pl.Path) -> str | None:
+    """Identity of a TAPE3: size and hash of its first MB (the header and directory)."""
+    path = pl.Path(path)
+    if not path.exists():
+        return None
+    with open(path, 'rb') as f:
+        head = f.read(1 << 20)
+    return f'{path.stat().st_size}:{hashlib.sha256(head).hexdigest()[:32]}'
+
+
+def linefile_id(path: str | pl.Path | None) -> str | None:
+    """Identity of a linefile: resolved path, size and modification time (as in Lblrtm.fingerprint)."""
+    if isinstance(path, type(None)):
+        return None
+    path = pl.Path(path)
+    if not path.exists():
+        return None
+    st = path.stat()
+    return f'{path.resolve()}:{st.st_size}:{st.st_mtime_ns}'
+
+
+def _lnfl_inputs(p2fld: pl.Path) -> tuple:
+    # the LNFL directory the TAPE3 of a run directory links to (run_name/lnfl by default)
+    p2f_tape3 = p2fld.joinpath('TAPE3')
+    p2fld_lnfl = p2f_tape3.resolve().parent if p2f_tape3.exists() else p2fld.parent.joinpath('lnfl')
+    p2f_tape5 = p2fld_lnfl.joinpath('TAPE5')
+    lnfl_hash = tape5_hash(p2f_tape5.read_text(errors='replace')) if p2f_tape5.exists() else None
+    return lnfl_hash, linefile_id(p2fld_lnfl.joinpath('TAPE1'))
+
+
+def _scan_directory(p2fld: pl.Path) -> dict | None:
+    p2f_tape5 = p2fld.joinpath('TAPE5')
+    p2f_tape12 = p2fld.joinpath('TAPE12')
+    text = p2f_tape5.read_text(errors='replace')
+    try:
+        params = tape5parser.parse_tape5(text)
+    except (ValueError, StopIteration, IndexError):
+        return None     # e.g. an LNFL TAPE5 or a TAPE5 that does not follow the fixed format
+    panels = list(fileio.iter_tape12_panels(p2f_tape12, headers_only=True)) if p2f_tape12.exists() else []
+    grid = fileio.validate_tape12(p2f_tape12) if panels else False
+    dvs = [p.dv for p in panels]
+    st12 = p2f_tape12.stat() if p2f_tape12.exists() else None
+    params['molecule_scales'] = {str(k): v for k, v in params.get('molecule_scales', {}).items()}
+    lnfl_hash, line_id = _lnfl_inputs(p2fld)
+    return dict(path=str(p2fld.resolve()),
+                tape5_hash=tape5_hash(text),
+                tape5_mtime=p2f_tape5.stat().st_mtime,
+                tape12_mtime=st12.st_mtime if st12 else None,
+                tape12_size=st12.st_size if st12 else None,
+                tape3_id=tape3_id(p2fld.joinpath('TAPE3')),
+                lnfl_tape5_hash=lnfl_hash, linefile_id=line_id,
+                v1=params.get('v1'), v2=params.get('v2'), sample=params.get('sample'), dvout=params.get('dvout'),
+                iod=params.get('iod'), ihirac=params.get('ihirac'), icntnm=params.get('icntnm'), imrg=params.get('imrg'),
+                model=params.get('model'), itype=params.get('itype'), angle=params.get('angle'),
+                h1=params.get('h1'), h2=params.get('h2'),
+                nlayers=len(params['layer_boundaries']) - 1 if 'layer_boundaries' in params else None,
+                molecules=','.join(sorted(params['molecule_scales'], key=int)),
+                wn_first=panels[0].start if panels else None,
+                wn_last=panels[-1].start + (panels[-1].n - 1) * panels[-1].dv if panels else None,
+                panels=len(panels), samples=sum(p.n for p in panels),
+                dv_min=min(dvs) if dvs else None, dv_max=max(dvs) if dvs else None,
+                valid=int(grid), parameters=json.dumps(params), indexed=time.time())
+
+
+class RunIndex():
+    """
+    SQLite index of run directories (directories with a TAPE5 and a TAPE12), for finding and
+    reusing existing outputs.
+
+    scan walks a directory tree in parallel. Every TAPE5 is parsed back into parameters
+    (tape5parser.parse_tape5) and only the panel headers of the TAPE12 are read for its
+    coverage. Directories whose TAPE5 and TAPE12 did not change since the last scan are skipped.
+
+    Examples
+    --------
+    >>> idx = RunIndex('~/lblrtm_runs.sqlite')
+    >>> idx.scan('/data/lblrtm')
+    >>> idx.query(angle=60, covers=(10300, 10500))
+    >>> run.run(reuse=idx)       # use a matching existing output instead of running LBLRTM
+    """
+    def __init__(self, path: str | pl.Path):
+        self.path = pl.Path(path).expanduser()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        with self._connect() as con:
+            con.executescript(SCHEMA)
+            have = {r['name'] for r in con.execute('PRAGMA table_info(runs)')}
+            for name, kind in ADDED_COLUMNS.items():
+                if name not in have:
+                    con.execute(f'ALTER TABLE runs ADD COLUMN {name} {kind}')
+
+    def _connect(self) -> sqlite3.Connection:
+        con = sqlite3.connect(self.path, timeout=60)
+        con.row_factory = sqlite3.Row
+        return con
+
+    def _known(self) -> dict:
+        with self._connect() as con:
+            return {r['path']: (r['tape5_mtime'], r['tape12_mtime']) for r in con.execute('SELECT path, tape5_mtime, tape12_mtime FROM runs')}
+
+    def scan(self, root: str | pl.Path, max_workers: int | None = None, verbose: bool = False) -> int:
+        """Index all run directories below root; returns the number of (re)indexed directories."""
+        known = self._known()
+        todo = []
+        for dirpath, dirnames, filenames in os.walk(pl.Path(root).expanduser()):
+            if 'TAPE5' not in filenames or 'TAPE12' not in filenames:
+                continue
+            p2fld = pl.Path(dirpath)
+            try:
+                stamp = (p2fld.joinpath('TAPE5').stat().st_mtime, p2fld.joinpath('TAPE12').stat().st_mtime)
+            except FileNotFoundError:
+                continue
+            if known.get(str(p2fld.resolve())) == stamp:
+                continue
+            todo.append(p2fld)
+
+        rows = []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers or min(32, (os.cpu_count() or 1) * 4)) as pool:
+            for p2fld, row in zip(todo, pool.map(self._safe_scan, todo)):
+                if row:
+                    rows.append(row)
+                elif verbose:
+                    print(f"Skipping {p2fld}: no LBLRTM TAPE5")
+        with self._lock, self._connect() as con:
+            con.executemany(f"INSERT OR REPLACE INTO runs ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+                            [tuple(r[c] for c in COLUMNS) for r in rows])
+        if verbose:
+            print(f"Indexed {len(rows)} run directories, {len(known)} were already known")
+        return len(rows)
+
+    @staticmethod
+    def _safe_scan(p2fld):
+        try:
+            return _scan_directory(p2fld)
+        except (OSError, ValueError):
+            return None
+
+    def add(self, path2result_dir: str | pl.Path) -> None:
+        """Index one run directory, e.g. right after a run."""
+        row = _scan_directory(pl.Path(path2result_dir))
+        if row:
+            with self._lock, self._connect() as con:
+                con.execute(f"INSERT OR REPLACE INTO runs ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+                            tuple(row[c] for c in COLUMNS))
+
+    def prune(self) -> int:
+        """Drop entries whose directory or TAPE12 no longer exists; returns how many."""
+        with self._connect() as con:
+            gone = [r['path'] for r in con.execute('SELECT path FROM runs') if not pl.Path(r['path']).joinpath('TAPE12').exists()]
+            con.executemany('DELETE FROM runs WHERE path = ?', [(p,) for p in gone])
+        return len(gone)
+
+    def query(self, covers: tuple | None = None, valid: bool = True, limit: int | None = None, **conditions) -> list:
+        """
+        Find indexed runs.
+
+        Parameters
+        ----------
+        covers : tuple, optional
+            (fmin, fmax) the TAPE12 has to cover.
+        valid : bool
+            Only runs whose TAPE12 was complete when indexed.
+        conditions
+            Column = value, e.g. angle=60, iod=1, tape5_hash=...; see COLUMNS.
+
+        Returns
+        -------
+        list of dict
+        """
+        where, args = [], []
+        for k, v in conditions.items():
+            if k not in COLUMNS:
+                raise ValueError(f"Unknown column {k}, options are {COLUMNS}")
+            where.append(f'{k} = ?')
+            args.append(v)
+        if not isinstance(covers, type(None)):
+            where.append('wn_first <= ? AND wn_last >= ?')
+            args += [covers[0], covers[1]]
+        if valid:
+            where.append('valid = 1')
+        sql = 'SELECT * FROM runs' + (' WHERE ' + ' AND '.join(where) if where else '') + ' ORDER BY indexed DESC'
+        if limit:
+            sql += f' LIMIT {int(limit)}'
+        with self._connect() as con:
+            return [dict(r) for r in con.execute(sql, args)]
+
+    def lookup(self, lblrtm: 'lab.Lblrtm') -> pl.Path | None:
+        """
+        Directory of an existing output for the configuration of lblrtm, None if there is none.
+
+        A match has the same TAPE5 (ignoring comments), a complete TAPE12 that did not change since
+        it was indexed and the same line data: if the TAPE3 of lblrtm already exists, the same TAPE3,
+        otherwise the same LNFL TAPE5 and linefile (path, size and modification time). Entries
+        without the identity of their line data never match a run that needs line data.
+        """
+        env = lblrtm.configuration.environment
+        own_tape3 = own_lnfl = own_linefile = None
+        if lblrtm._line_by_line:
+            if not isinstance(env.tape3, type(None)):
+                own_tape3 = tape3_id(env.tape3)
+            elif not isinstance(env.project_directory, type(None)):
+                own_tape3 = tape3_id(env.project_directory.joinpath(env.run_name, 'lnfl', 'TAPE3'))
+            if isinstance(own_tape3, type(None)):
+                own_lnfl = tape5_hash(lblrtm.tape5_lnfl.tape5)
+                own_linefile = linefile_id(env.linefile)
+                if isinstance(own_linefile, type(None)):
+                    return None     # neither TAPE3 nor linefile to compare with
+        for row in self.query(tape5_hash=tape5_hash(lblrtm.tape5.tape5)):
+            if own_tape3 and row['tape3_id'] != own_tape3:
+                continue
+            if own_lnfl and (row['lnfl_tape5_hash'] != own_lnfl or row['linefile_id'] != own_linefile):
+                continue
+            p2f_tape12 = pl.Path(row['path']).joinpath('TAPE12')
+            try:
+                st = p2f_tape12.stat()
+            except FileNotFoundError:
+                continue
+            if st.st_mtime != row['tape12_mtime'] or st.st_size != row['tape12_size']:
+                continue
+            return pl.Path(row['path'])
+        return None
@@ -1,19 +1,33 @@
 import inspect
+import copy
+import json
+import time
+import concurrent.futures
 from . import tools
 import pathlib as pl
-import subprocess as sp
+import numpy as np
 import xarray as xr
 from . import fileio
 from . import tape5parser
 import textwrap
 from . import lnfl
+from . import process
+from . import archive
+from . import regrid
+
+
+# per-layer optical depth files written by LBLRTM for IMRG=1, e.g. ODdeflt_001 or ODexact_001
+LAYER_OD_FILE_PATTERN = 'OD*_[0-9][0-9][0-9]'
 
 
 class Lblrtm():
-    def __init__(self, verbose = False):
+    def __init__(self, verbose = False, progress_callback = None, cancel = None):
         self.configuration = LblrtmConfig()
         self._verbose = verbose
+        self.progress_callback = progress_callback
+        self.cancel = cancel    # threading.Event, a running LNFL/LBLRTM is killed when it is set
         self.lnfl = lnfl.Lnfl(self, verbose=verbose)
+        self.stage = None   # stages executed by the last execute, see stages.plan
 
 
     @property
@@ -23,9 +37,29 @@ class Lblrtm():
 
     @property
     def tape5_lnfl(self):
-        tg = tape5parser.Tape5GeneratorLnfl(self)
+        tg = tape5parser.Tape5GeneratorLnfl(self.lnfl)
         return tg
 
+    @property
+    def fingerprint(self) -> str:
+        """SHA-256 of everything that determines the output: the LBLRTM and LNFL TAPE5s and the line
+        data (path, size and modification time of the shared TAPE3, or else of the linefile)."""
+        import hashlib
+        env = self.configuration.environment
+        line_data = env.tape3 if not isinstance(env.tape3, type(None)) else env.linefile
+        if isinstance(line_data, type(None)):
+            line_id = ''
+        elif line_data.exists():
+            st = line_data.stat()
+            line_id = f'{line_data.resolve()}:{st.st_size}:{st.st_mtime_ns}'
+        else:
+            line_id = str(line_data)
+        h = hashlib.sha256()
+        for part in (self.tape5.tape5, self.tape5_lnfl.tape5, line_id):
+            h.update(part.encode())
+            h.update(b'\0')
+        return h.hexdigest()
+
     def _create_filesystem(self):
         if self._verbose:
             print(f"Creating LBLRTM filesystem at {self.configuration.environment.project_directory}")
@@ -48,7 +82,10 @@ class Lblrtm():
 
         ##  check/create TAPE3
         self.p2f_lblrtm_tape3_link = p2fld_run_lblrtm.joinpath('TAPE3') # this is the link to the actual file within lblrtm folder
-        self.p2f_lblrtm_tape3_orig = p2fld_run_lnfl.joinpath('TAPE3') # this is the actual file within lnfl folder
+        if isinstance(self.configuration.environment.tape3, type(None)):
+            self.p2f_lblrtm_tape3_orig = p2fld_run_lnfl.joinpath('TAPE3') # this is the actual file within lnfl folder
+        else:
+            self.p2f_lblrtm_tape3_orig = self.configuration.environment.tape3 # shared TAPE3, e.g. from a parent run
         
         ## check continuum file exists # TODO make dynamic
         p2f_continuum_orig = pl.Path('/home/hagen/prog/LBLRTM/data/absco-ref_wv-mt-ckd.nc')
@@ -56,65 +93,313 @@ class Lblrtm():
         if not p2f_continuum_link.exists():
             p2f_continuum_link.symlink_to(p2f_continuum_orig)
 
-        assert self.p2f_lblrtm_tape3_orig.exists(), f"TAPE3 file not found at expected location: {self.p2f_lblrtm_tape3_orig}"
-        if not self.p2f_lblrtm_tape3_link.exists():
-            self.p2f_lblrtm_tape3_link.symlink_to(self.p2f_lblrtm_tape3_orig)
         self._filesystem = dict(
             project_directory = self.configuration.environment.project_directory,
             p2fld_run_lblrtm = p2fld_run_lblrtm,
             p2f_lblrtm_tape5 = p2f_lblrtm_tape5,)
         
+    def _link_tape3(self):
+        assert self.p2f_lblrtm_tape3_orig.exists(), f"TAPE3 file not found at expected location: {self.p2f_lblrtm_tape3_orig}"
+        if self.p2f_lblrtm_tape3_link.is_symlink() and self.p2f_lblrtm_tape3_link.readlink() != self.p2f_lblrtm_tape3_orig:
+            self.p2f_lblrtm_tape3_link.unlink()
+        if not self.p2f_lblrtm_tape3_link.exists():
+            self.p2f_lblrtm_tape3_link.symlink_to(self.p2f_lblrtm_tape3_orig)
+
+    def prepare_tape3(self) -> pl.Path:
+        """Make sure the TAPE3 for this configuration exists (running LNFL if needed) and return its path."""
+        self._create_filesystem()
+        if self._line_by_line and isinstance(self.configuration.environment.tape3, type(None)):
+            self.lnfl.run(force_run = False)
+        return pl.Path(self.p2f_lblrtm_tape3_orig)
+
+    @property
+    def _line_by_line(self) -> bool:
+        """False for lineshape 'None' (IHIRAC=0): LBLRTM skips the line-by-line calculation and needs no TAPE3."""
+        return self.configuration.molecular_spectral_lines._lineshape_no > 0
+
+    def spawn(self, name: str) -> 'Lblrtm':
+        """
+        Create a child run with a copy of this configuration.
+
+        The child lives in the sub-directory name of this run (run_name/name) and uses this 
+        run's TAPE3, so the configuration of the child must not change the spectral range or the 
+        molecule selection. Call prepare_tape3 before running the child.
+        """
+        child = Lblrtm(verbose=self._verbose, progress_callback=self.progress_callback, cancel=self.cancel)
+        child.configuration = copy.deepcopy(self.configuration)
+        child.lnfl = lnfl.Lnfl(child, verbose=self._verbose)
+        env = child.configuration.environment
+        env.run_name = f"{self.configuration.environment.run_name}/{name}"
+        if isinstance(env.tape3, type(None)):
+            env.tape3 = self.configuration.environment.project_directory.joinpath(self.configuration.environment.run_name, 'lnfl', 'TAPE3')
+        return child
+
+    def jacobian(self, parameters, step: float | dict = 0.01, method: str = 'forward', relative: bool = True,
+                 base: 'Results | None' = None, max_workers: int | None = None) -> xr.Dataset:
+        """
+        Finite-difference Jacobian of the output spectrum with respect to molecule scales.
+
+        The base and perturbed configurations are spawned as child runs (run_name/jacobian/...) 
+        and executed concurrently against this run's TAPE3.
+
+        Parameters
+        ----------
+        parameters : str or list of str
+            Names of enabled molecules, e.g. ['H2O', 'O2']. The derivative is taken with respect to 
+            Molecule.scale in its scale_unit, e.g. dOD/dPWV for H2O with scale_unit 'pwv'.
+        step : float or dict
+            Perturbation of the scale, relative to the scale if relative is True (absolute if the 
+            scale is 0). A dict gives the step per parameter.
+        method : str
+            'forward': (f(x+h) - f(x)) / h; 'central': (f(x+h) - f(x-h)) / 2h.
+        relative : bool
+            Interpret step relative to the current scale.
+        base : Results, optional
+            Already computed base run. If not given, base runs are cached per TAPE5 and only
+            computed once.
+        max_workers : int, optional
+            Number of concurrent LBLRTM runs.
+
+        Returns
+        -------
+        xr.Dataset
+            For each output variable the Jacobian with dimensions (parameter, wavenumber), plus the
+            base spectrum as base_<variable> and the scales and steps as coordinates.
+        """
+        if isinstance(parameters, str):
+            parameters = [parameters]
+        if method not in ('forward', 'central'):
+            raise ValueError("method must be one of {'forward', 'central'}")
+        molecules = self.configuration.molecular_spectral_lines.molecules
+
+        signs = (1,) if method == 'forward' else (1, -1)
+        scales, steps, runs = {}, {}, {}
+        for p in parameters:
+            mol = molecules[p]
+            if not mol.enable:
+                raise ValueError(f"Molecule {p} is not enabled, its scale has no effect.")
+            h = step[p] if isinstance(step, dict) else step
+            if relative and mol.scale != 0:
+                h = h * abs(mol.scale)
+            if h <= 0:
+                raise ValueError(f"step for {p} must be > 0")
+            if method == 'central' and mol.scale - h < 0:
+                raise ValueError(f"Central difference for {p} would require a negative scale ({mol.scale} - {h}), use method='forward'.")
+            scales[p] = mol.scale
+            steps[p] = h
+            for sign in signs:
+                child = self.spawn(f"jacobian/{p}_{'plus' if sign > 0 else 'minus'}")
+                child.configuration.molecular_spectral_lines.molecules[p].scale = mol.scale + sign * h
+                runs[(p, sign)] = child
+
+        if not hasattr(self, '_base_results'):
+            self._base_results = {}
+        base_key = self.tape5.tape5
+        if isinstance(base, type(None)) and method == 'forward':
+            base = self._base_results.get(base_key)
+        compute_base = isinstance(base, type(None)) and method == 'forward'
+        if compute_base:
+            runs[('base', 0)] = self.spawn('jacobian/base')
+
+        self.prepare_tape3()
+        keys = list(runs.keys())
+        results = dict(zip(keys, run_concurrently([runs[k] for k in keys], max_workers=max_workers)))
+        if compute_base:
+            base = results.pop(('base', 0))
+            self._base_results[base_key] = base
+
+        if isinstance(base, type(None)):
+            grid = results[(parameters[0], 1)].data
+        else:
+            grid = base.data
+        wn = grid.wavenumber.values
+
+        out = xr.Dataset(coords={'parameter': ('parameter', list(parameters)),
+                                 'wavenumber': grid.wavenumber,
+                                 'scale': ('parameter', [scales[p] for p in parameters]),
+                                 'step': ('parameter', [steps[p] for p in parameters]),
+                                 'scale_unit': ('parameter', [molecules[p].scale_unit for p in parameters]),
+                                 },
+                         attrs={'method': method, 'relative_step': int(relative)})
+        for var, da in grid.data_vars.items():
+            rows = []
+            for p in parameters:
+                plus = regrid.values_on_grid(results[(p, 1)].data, var, wn)
+                if method == 'forward':
+                    rows.append((plus - regrid.values_on_grid(base.data, var, wn)) / steps[p])
+                else:
+                    rows.append((plus - regrid.values_on_grid(results[(p, -1)].data, var, wn)) / (2 * steps[p]))
+            out[var] = (('parameter', 'wavenumber'), np.vstack(rows),
+                        {'long_name': f'd({var})/d(scale)', 'units': f"{da.attrs.get('units', '1')} per scale_unit"})
+            if not isinstance(base, type(None)):
+                out[f'base_{var}'] = ('wavenumber', regrid.values_on_grid(base.data, var, wn), da.attrs)
+        return out
+
     def _execute_lblrtm(self):
         if self._verbose:
             print("Executing LBLRTM") 
-        result = sp.run(
+        p2fld_run_lblrtm = self._filesystem['p2fld_run_lblrtm']
+        result = process.run_streamed(
             ["lblrtm"],
-            cwd=self._filesystem['p2fld_run_lblrtm'],
-            check=True,
-            capture_output=True,
-            text=True,            # str instead of bytes
+            cwd=p2fld_run_lblrtm,
+            log_path=p2fld_run_lblrtm.joinpath('lblrtm.log'),
+            progress_callback=self.progress_callback,
+            timeout=self.configuration.environment.timeout,
+            cpu_timeout=self.configuration.environment.cpu_timeout,
+            cancel=self.cancel,
+            verbose=self._verbose,
         )
-        if self._verbose:
-            print(result.stdout+result.stderr)
         self.tp_result = result
-        if result.stderr.strip() == "STOP  LBLRTM EXIT":
+        if result.success:
             out = 0
         else:
             out = 1
         return out
         
-    def _write_tape5(self):
+    def _write_tape5(self, tape5: str | None = None):
         if self._verbose:
             print("Writing TAPE5 file")
         p2f_lblrtm_tape5 = self._filesystem['p2f_lblrtm_tape5']
         with open(p2f_lblrtm_tape5, 'w') as f:
-            f.write(self.tape5.tape5)
+            f.write(self.tape5.tape5 if isinstance(tape5, type(None)) else tape5)
 
     def _remove_old_results(self):
-        for f in ['TAPE10','TAPE11','TAPE12', 'TAPE13','TAPE27']:
-            p2f = self._filesystem['p2fld_run_lblrtm'].joinpath(f)
+        p2fld_run_lblrtm = self._filesystem['p2fld_run_lblrtm']
+        layer_files = [p.name for p in p2fld_run_lblrtm.glob(LAYER_OD_FILE_PATTERN)]
+        for f in ['TAPE10','TAPE11','TAPE12', 'TAPE13','TAPE27'] + layer_files:
+            p2f = p2fld_run_lblrtm.joinpath(f)
             if p2f.exists():
                 if self._verbose:
                     print(f"Removing old result file {p2f}")
                 p2f.unlink()
 
-    def run(self):
+    def _pinned(self):
+        """Pin (and mark as used) the run directory and the TAPE3 directory, see workspace.pin."""
+        from . import workspace
+        paths = [self._filesystem['p2fld_run_lblrtm'], pl.Path(self.p2f_lblrtm_tape3_orig).parent]
+        for p in paths:
+            workspace.touch(p)
+        return workspace.pin(*paths)
+
+    def _enforce_disk_budget(self):
+        from . import workspace
+        budget = self.configuration.environment.disk_budget
+        if not isinstance(budget, type(None)):
+            workspace.Workspace(self.configuration.environment.project_directory).enforce(budget, verbose=self._verbose)
+
+    def execute(self, force_run: bool = False) -> pl.Path:
+        """Run LNFL (if needed) and LBLRTM without reading the results. Returns the LBLRTM run directory.
+        The wall-clock time of each step is kept in self.timings.
+
+        Only the stages whose inputs changed since the last run in the run directory are executed 
+        (see stages.plan, the executed stages are kept in self.stage); force_run executes all."""
+        from . import stages
+        self.timings = {}
+        t0 = time.perf_counter()
         self._create_filesystem()
-        self.lnfl.run(force_run = False)
-        self._remove_old_results()
-        self._write_tape5()
-        out = self._execute_lblrtm()
+        with self._pinned():
+            if self._line_by_line:
+                if isinstance(self.configuration.environment.tape3, type(None)):
+                    self.lnfl.run(force_run = False)
+                self._link_tape3()
+            t1 = time.perf_counter()
+            self.timings['lnfl'] = t1 - t0
+            out = stages.execute(self, force_run=force_run)
+            self.timings['lblrtm'] = time.perf_counter() - t1
         if self._verbose:
             if out == 0:
                 print("LBLRTM run completed successfully")
             else:
                 print("LBLRTM run failed, i think")
-        result = Results(self._filesystem['p2fld_run_lblrtm'])
+        return self._filesystem['p2fld_run_lblrtm']
+
+    def run(self, archive: bool | str | pl.Path = False, delete_raw: bool = False, deduplicate: bool = False,
+            reuse=None):
+        """
+        Run LNFL (if needed) and LBLRTM and read the results.
+
+        Parameters
+        ----------
+        archive : bool, str or Path
+            Write the results to a compressed archive (see Results.archive). True uses the default
+            location inside the run directory, a path ending in .zarr writes a Zarr store.
+        delete_raw : bool
+            Delete the raw output tapes after archiving.
+        deduplicate : bool
+            Wait for an identical run (same fingerprint) that is executing in this or another 
+            process and share its Results instead of running LBLRTM again, see singleflight.run.
+        reuse : index.RunIndex, str or Path, optional
+            Index (or path of its database) of existing run directories. If it has an output for 
+            this TAPE5 and line data, those Results are returned without running anything; otherwise 
+            the new run is added to the index.
+        """
+        if not isinstance(reuse, type(None)):
+            from . import index
+            reuse = reuse if isinstance(reuse, index.RunIndex) else index.RunIndex(reuse)
+            match = reuse.lookup(self)
+            if not isinstance(match, type(None)):
+                if self._verbose:
+                    print(f"Reusing the existing output in {match}")
+                return Results(match, configuration=self.configuration.to_dict())
+            result = self.run(archive=archive, delete_raw=delete_raw, deduplicate=deduplicate)
+            if not delete_raw:
+                reuse.add(result.path2result_dir)
+            return result
+        if deduplicate:
+            from . import singleflight
+            return singleflight.run(self, archive=archive, delete_raw=delete_raw)
+        p2fld_run_lblrtm = self.execute()
+        with self._pinned():
+            t0 = time.perf_counter()
+            result = Results(p2fld_run_lblrtm, tape5=self.tape5.tape5, configuration=self.configuration.to_dict())
+            self.timings['read'] = time.perf_counter() - t0
+            result.timings = dict(self.timings)
+            if archive:
+                result.archive(None if archive is True else archive, delete_raw=delete_raw)
+            self._enforce_disk_budget()
         return result
     
+def run_concurrently(lblrtms, max_workers: int | None = None, deduplicate: bool = False) -> list:
+    """Run several Lblrtm instances on a thread pool and return their Results in input order.
+
+    Every instance needs its own run directory; spawn children from one parent to share its TAPE3.
+    With deduplicate, identical configurations are executed once and share their Results."""
+    lblrtms = list(lblrtms)
+    if not lblrtms:
+        return []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = [pool.submit(r.run, deduplicate=deduplicate) for r in lblrtms]
+        return [f.result() for f in futures]
+
+def read_layer_optical_depths(path2result_dir: str | pl.Path, var_name: str = 'optical_depth') -> xr.Dataset:
+    """
+    Read the per-layer optical depth files of a run with output.merge_mode 'layers'.
+
+    Returns
+    -------
+    xr.Dataset
+        var_name with dimensions (layer, wavenumber); layer counts from 1 at the bottom. All layers 
+        are put on the grid of the first layer.
+    """
+    files = sorted(pl.Path(path2result_dir).glob(LAYER_OD_FILE_PATTERN))
+    if not files:
+        raise FileNotFoundError(f"No layer optical depth files ({LAYER_OD_FILE_PATTERN}) in {path2result_dir}")
+    layers = [fileio.read_tape12(p, var_name=var_name) for p in files]
+    wn = layers[0].wavenumber.values
+    values = np.vstack([regrid.values_on_grid(ds, var_name, wn) for ds in layers])
+    return xr.Dataset({var_name: (('layer', 'wavenumber'), values, {'long_name': f'layer {var_name}', 'units': '1'})},
+                      coords={'layer': np.arange(1, len(files) + 1), 'wavenumber': layers[0].wavenumber},
+                      attrs={'source': ', '.join(p.name for p in files)})
+
 class Results():
-    def __init__(self, path2result_dir : str | pl.Path):
+    def __init__(self, path2result_dir : str | pl.Path, tape5: str | None = None, configuration: dict | None = None,
+                 timings: dict | None = None):
         self.path2result_dir = pl.Path(path2result_dir)
+        if isinstance(tape5, type(None)) and self.path2result_dir.joinpath('TAPE5').exists():
+            tape5 = self.path2result_dir.joinpath('TAPE5').read_text()
+        self.tape5 = tape5
+        self.configuration = configuration
+        self.timings = timings or {}
         self._data = None
         self.data  # this is necessary to trigger data loading, otherwise it might be overwritten by a later run
         pass
@@ -122,10 +407,20 @@ class Results():
     @property
     def data(self) -> xr.Dataset:
         if isinstance(self._data, type(None)):
+            from . import workspace
+            workspace.touch(self.path2result_dir)
             p2f_tape12 = pl.Path(self.path2result_dir).joinpath('TAPE12')
-            self._data = fileio.read_tape12(p2f_tape12)
+            if not p2f_tape12.exists() and not isinstance(archive.find_archive(self.path2result_dir), type(None)):
+                # raw tapes were deleted after archiving
+                self._data = archive.open_archive(archive.find_archive(self.path2result_dir))
+            else:
+                self._data = fileio.read_tape12(p2f_tape12)
         return self._data
 
+    def archive(self, path: str | pl.Path | None = None, delete_raw: bool = False, **kwargs) -> pl.Path:
+        """Write the results with provenance to a compressed, chunked NetCDF4 or Zarr store, see archive.write_archive."""
+        return archive.write_archive(self, path, delete_raw=delete_raw, **kwargs)
+
 class LblrtmConfig():
     # __slots__ = ("_fmin", "_fmax", "_df")
 
@@ -137,20 +432,79 @@ class LblrtmConfig():
         self.rayleigh = RayleighScattering()
         self.surface = Surface()
         self.atmospheric_layers = AtmosphericLayers()
+        self.atmospheric_profile = AtmosphericProfile()
         self.environment = Environment()
         self.geometry = Geometry()
+        self.output = Output()
     
     def __str__(self) -> str:
         txt = 'doit'
         return txt
 
+    def to_dict(self) -> dict:
+        """Snapshot of the configuration as plain python types (JSON serializable)."""
+        out = {}
+        for section, obj in vars(self).items():
+            if section == 'molecular_spectral_lines':
+                out[section] = dict(lineshape=obj.lineshape,
+                                    molecules={m.name: dict(enable=m.enable,
+                                                            enable_continuum=m.enable_continuum,
+                                                            scale_unit=m.scale_unit,
+                                                            scale=m.scale) for m in obj.molecules})
+            else:
+                out[section] = _properties_to_dict(obj)
+        return out
+
+    @classmethod
+    def from_dict(cls, d: dict) -> 'LblrtmConfig':
+        """Create a configuration from a (partial) snapshot written by to_dict."""
+        config = cls()
+        for section, values in d.items():
+            obj = getattr(config, section)
+            if section == 'molecular_spectral_lines':
+                if 'lineshape' in values:
+                    obj.lineshape = values['lineshape']
+                for name, mol_values in values.get('molecules', {}).items():
+                    for k, v in mol_values.items():
+                        setattr(obj.molecules[name], k, v)
+            else:
+                if section == 'spectral_grid' and 'fmin' in values:
+                    # fmax is validated against fmin, but sorted snapshots (to_json) list fmax first
+                    values = {'fmin': values['fmin'], **values}
+                for k, v in values.items():
+                    setattr(obj, k, v)
+        return config
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), sort_keys=True)
+
+def _properties_to_dict(obj) -> dict:
+    props = {}
+    for cls in reversed(type(obj).__mro__):
+        props.update({k: p for k, p in vars(cls).items() if isinstance(p, property) and p.fset is not None})
+    out = {}
+    for k in props:
+        v = getattr(obj, k)
+        if isinstance(v, pl.Path):
+            v = str(v)
+        elif isinstance(v, np.ndarray):
+            v = v.tolist()
+        elif isinstance(v, dict):
+            v = {kk: vv.tolist() if isinstance(vv, np.ndarray) else vv for kk, vv in v.items()}
+        out[k] = v
+    return out
+
 class Environment():
-    __slots__ = ('_project_directory','_run_name','_linefile')
+    __slots__ = ('_project_directory','_run_name','_linefile','_timeout','_cpu_timeout','_tape3','_disk_budget')
 
     def __init__(self):
         self.project_directory = None
         self.run_name = None
         self.linefile = None
+        self.tape3 = None
+        self.timeout = None
+        self.cpu_timeout = None
+        self.disk_budget = None
         pass
 
     @property
@@ -188,6 +542,57 @@ class Environment():
             v = '/home/hagen/prog/AER_Line_File/AER_Line_File/line_file/aer_v_3.8.1'
         self._linefile = pl.Path(v).expanduser()
 
+    @property
+    def tape3(self) -> pl.Path | None:
+        """Path to an existing TAPE3 that is used instead of running LNFL in the lnfl folder of this run. 
+        None (default) means LNFL is run as needed. Used to share one TAPE3 between many runs."""
+        return self._tape3
+
+    @tape3.setter
+    def tape3(self, v: str | pl.Path | None = None) -> None:
+        if not isinstance(v, type(None)):
+            v = pl.Path(v).expanduser()
+        self._tape3 = v
+
+    @property
+    def timeout(self) -> float | None:
+        """Wall-clock limit in seconds for each LNFL/LBLRTM execution. None (default) means no limit.
+        A run exceeding it is killed and a process.ProcessError is raised."""
+        return self._timeout
+
+    @timeout.setter
+    def timeout(self, v: float | None = None) -> None:
+        if not isinstance(v, type(None)) and v <= 0:
+            raise ValueError("timeout must be > 0 or None")
+        self._timeout = v
+
+    @property
+    def cpu_timeout(self) -> float | None:
+        """CPU time limit in seconds for each LNFL/LBLRTM execution, enforced by the kernel (RLIMIT_CPU). 
+        None (default) means no limit."""
+        return self._cpu_timeout
+
+    @cpu_timeout.setter
+    def cpu_timeout(self, v: float | None = None) -> None:
+        if not isinstance(v, type(None)) and v <= 0:
+            raise ValueError("cpu_timeout must be > 0 or None")
+        self._cpu_timeout = v
+
+    @property
+    def disk_budget(self) -> int | None:
+        """Disk budget of the project directory in bytes. After each run the least recently used run 
+        directories and TAPE3s are evicted until the project fits, see workspace.Workspace. None 
+        (default) means no limit."""
+        return self._disk_budget
+
+    @disk_budget.setter
+    def disk_budget(self, v: int | str | None = None) -> None:
+        from . import workspace
+        v = workspace.parse_size(v)
+        if not isinstance(v, type(None)) and v <= 0:
+            raise ValueError("disk_budget must be > 0 or None")
+        self._disk_budget = v
+
         
 
     
@@ -386,10 +791,150 @@ class Surface():
 
 
 class AtmosphericLayers():
-    __slots__ = ()
+    __slots__ = ('_boundaries',)
+
+    def __init__(self, boundaries=None):
+        self.boundaries = boundaries
+
+    def __repr__(self) -> str:
+        return f"AtmosphericLayers(boundaries={self.boundaries.tolist()})"
+
+    @property
+    def boundaries(self) -> np.ndarray:
+        """Layer boundaries in km (RECORD 3.3b), increasing. The path goes from the first to the last 
+        boundary (H1, H2 in RECORD 3.2). Default: tape5parser.STANDARD_LAYER_BOUNDARIES, 18 layers 
+        from 0 to 100 km. Fewer layers make LBLRTM faster, see layering.optimize_layers."""
+        return self._boundaries.copy()
+
+    @boundaries.setter
+    def boundaries(self, v=None) -> None:
+        if isinstance(v, type(None)):
+            v = tape5parser.STANDARD_LAYER_BOUNDARIES
+        v = np.asarray(v, dtype=float)
+        if v.ndim != 1 or v.size < 2:
+            raise ValueError("boundaries need at least two levels")
+        if np.any(np.diff(v) <= 0):
+            raise ValueError("boundaries must be strictly increasing")
+        if v[0] < 0:
+            raise ValueError("boundaries must be >= 0 km")
+        self._boundaries = v.copy()
+
+class AtmosphericProfile():
+    """User defined atmospheric profile (MODEL = 0, RECORD 3.4 - 3.6). Without an altitude, the
+    standard atmosphere is used. For many profiles see profiles.run_profiles."""
+    __slots__ = ('_altitude', '_pressure', '_temperature', '_amounts', '_units', '_fill_model', '_records')
 
     def __init__(self):
-        pass
+        self._records = None
+        self.altitude = None
+        self.pressure = None
+        self.temperature = None
+        self.amounts = None
+        self.units = None
+        self.fill_model = 2
+
+    def __repr__(self) -> str:
+        return self.__str__()
+
+    def __str__(self):
+        if not self.enabled:
+            return "Atmospheric profile\n-----------------\nstandard atmosphere"
+        txt = f"""Atmospheric profile
+-----------------
+levels: {self.altitude.size} ({self.altitude[0]:g} - {self.altitude[-1]:g} km)
+molecules: {', '.join(self.amounts)} (others from standard atmosphere {self.fill_model})"""
+        return txt
+
+    @staticmethod
+    def _level_array(v):
+        return None if isinstance(v, type(None)) else np.asarray(v, dtype=float).ravel()
+
+    @property
+    def altitude(self) -> np.ndarray | None:
+        """Altitude of the levels in km, increasing. None (default) uses the standard atmosphere."""
+        return self._altitude
+
+    @altitude.setter
+    def altitude(self, v) -> None:
+        self._altitude = self._level_array(v)
+        self._records = None
+
+    @property
+    def pressure(self) -> np.ndarray | None:
+        """Pressure of the levels in mb."""
+        return self._pressure
+
+    @pressure.setter
+    def pressure(self, v) -> None:
+        self._pressure = self._level_array(v)
+        self._records = None
+
+    @property
+    def temperature(self) -> np.ndarray | None:
+        """Temperature of the levels in K."""
+        return self._temperature
+
+    @temperature.setter
+    def temperature(self, v) -> None:
+        self._temperature = self._level_array(v)
+        self._records = None
+
+    @property
+    def amounts(self) -> dict:
+        """Amount of each molecule on the levels, e.g. {'H2O': [...], 'O3': [...]}, in units."""
+        return self._amounts
+
+    @amounts.setter
+    def amounts(self, v: dict | None) -> None:
+        v = dict(v or {})
+        for name in v:
+            if name not in MOLECULE_NAMES:
+                raise ValueError(f"Unknown molecule {name}, options are {MOLECULE_NAMES}")
+        self._amounts = {name: self._level_array(a) for name, a in v.items()}
+        self._records = None
+
+    @property
+    def units(self) -> dict:
+        """Unit of each molecule in amounts, default 'ppmv'. Options: the keys of 
+        tape5parser.PROFILE_UNIT_CODES or the JCHAR codes of the LBLRTM instructions (A - H)."""
+        return dict(self._units)
+
+    @units.setter
+    def units(self, v: dict | None) -> None:
+        from . import profiles
+        self._units = {name: profiles.unit_code(u) for name, u in (v or {}).items()}
+        self._records = None
+
+    @property
+    def fill_model(self) -> int:
+        """Standard atmosphere (1 - 6) for the molecules not in amounts. Default 2 (midlatitude summer)."""
+        return self._fill_model
+
+    @fill_model.setter
+    def fill_model(self, v: int) -> None:
+        if int(v) not in range(1, 7):
+            raise ValueError("fill_model must be one of 1 - 6")
+        self._fill_model = int(v)
+        self._records = None
+
+    @property
+    def enabled(self) -> bool:
+        return not isinstance(self.altitude, type(None))
+
+    @property
+    def nmol(self) -> int:
+        """NMOL of RECORD 3.1: the 7 main molecules and all up to the last one in amounts."""
+        return max([7] + [MOLECULE_NAMES.index(name) + 1 for name in self.amounts])
+
+    @property
+    def records(self) -> str:
+        """RECORD 3.4 - 3.6."""
+        if isinstance(self._records, type(None)):
+            from . import profiles
+            stack = profiles.ProfileStack.from_arrays(self.altitude, self.pressure, self.temperature,
+                                                      units=self._units, **self.amounts)
+            self._records = stack.render(fill_model=self.fill_model)[0]
+        return self._records
 
 class Geometry():
     __slots__ = ('_slant_angle')
@@ -406,6 +951,51 @@ class Geometry():
         assert(0<=v<=90), f'zenith angle needs to be between 0 and 90 degree, {v} given.'
         self._slant_angle = v
 
+class Output():
+    __slots__ = ('_merge_mode', '_keep_layers')
+    _merge_mode_options = {'total': 0, 'layers': 1}
+
+    def __init__(self, merge_mode: str = 'total', keep_layers: bool = False):
+        self.merge_mode = merge_mode
+        self.keep_layers = keep_layers
+
+    def __repr__(self) -> str:
+        return self.__str__()
+
+    def __str__(self):
+        txt = f"""Output
+-----------------
+merge_mode: {self.merge_mode}
+keep_layers: {self.keep_layers}"""
+        return txt
+
+    @property
+    def merge_mode(self) -> str:
+        """What LBLRTM writes (IMRG in RECORD 1.2). Options:
+        total: (default, IMRG=0) optical depth of the whole path merged into TAPE12
+        layers: (IMRG=1) optical depth of each layer written to separate files (ODdeflt_001, ...),
+                see lab.read_layer_optical_depths
+        """
+        return self._merge_mode
+
+    @merge_mode.setter
+    def merge_mode(self, v: str) -> None:
+        v = v.lower()
+        if v not in self._merge_mode_options:
+            raise ValueError(f"merge_mode must be one of {set(self._merge_mode_options)}")
+        self._merge_mode = v
+
+    @property
+    def keep_layers(self) -> bool:
+        """Always write the layer optical depth files and sum them into TAPE12 for merge_mode 'total',
+        so a later run that only changes merge_mode skips the line-by-line calculation (see stages). 
+        Only with spectral_grid.layering_control 'exact', where all layers share one grid."""
+        return self._keep_layers
+
+    @keep_layers.setter
+    def keep_layers(self, v: bool) -> None:
+        self._keep_layers = bool(v)
+
 from dataclasses import dataclass, field
 
 # all molecules available in LBLRTM
@@ -0,0 +1,156 @@
+import os
+import copy
+import json
+import types
+import hashlib
+import threading
+import pathlib as pl
+from dataclasses import dataclass, field
+import numpy as np
+from . import lab
+from . import regrid
+from . import tape5parser
+
+CACHE_NAME = '.layering_cache.json'
+_cache_lock = threading.Lock()
+
+
+@dataclass
+class LayeringResult:
+    boundaries: np.ndarray
+    max_error: float             # max. abs. transmittance difference to the reference
+    reference: np.ndarray
+    runs: int = 0                # LBLRTM runs done by the optimization (0 if cached)
+    cached: bool = False
+    history: list = field(default_factory=list)   # (removed boundary, max_error) per accepted step
+
+
+def _atmosphere(lblrtm, reference) -> str:
+    """SHA-256 of the TAPE5 records of the path: molecule scaling (1.3a/b), profile (3.1, 3.4 - 3.6)
+    and geometry (3.2)."""
+    config = copy.deepcopy(lblrtm.configuration)
+    config.atmospheric_layers.boundaries = reference
+    tg = tape5parser.Tape5Generator(types.SimpleNamespace(configuration=config))
+    records = tg.record_13a + tg.record_13b + '\n' + tg.record_31 + '\n' + tg.record_32
+    if config.atmospheric_profile.enabled:
+        records += tg.record_34
+    return hashlib.sha256(tape5parser.normalize_tape5(records).encode()).hexdigest()
+
+
+def _key(lblrtm, reference, tolerance):
+    config = lblrtm.configuration
+    grid = config.spectral_grid
+    molecules = sorted(m.name for m in config.molecular_spectral_lines.molecules if m.enable)
+    return json.dumps(dict(band=[grid.fmin, grid.fmax], molecules=molecules, tolerance=tolerance,
+                           reference=np.round(reference, 6).tolist(), atmosphere=_atmosphere(lblrtm, reference)),
+                      sort_keys=True)
+
+
+def _cache_path(lblrtm, cache):
+    if isinstance(cache, (str, pl.Path)):
+        return pl.Path(cache)
+    return lblrtm.configuration.environment.project_directory.joinpath(CACHE_NAME)
+
+
+def _read_cache(path):
+    try:
+        return json.loads(path.read_text())
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def _write_cache(path, key, entry):
+    with _cache_lock:
+        data = _read_cache(path)
+        data[key] = entry
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f'.{path.name}.tmp{os.getpid()}')
+        tmp.write_text(json.dumps(data, indent=1))
+        os.replace(tmp, path)
+
+
+def optimize_layers(lblrtm: 'lab.Lblrtm', tolerance: float = 1e-3, reference=None, min_layers: int = 1,
+                    max_workers: int | None = None, cache: bool | str | pl.Path = True, apply: bool = True,
+                    var_name: str = 'optical_depth', verbose: bool = False) -> LayeringResult:
+    """
+    Find the coarsest layering whose transmittance stays within tolerance of a fine reference.
+
+    Starting from the reference boundaries, boundaries are removed greedily: in each step every
+    remaining boundary (except the lowest one, where the path starts) is tried as a candidate, all
+    candidates are run concurrently, and the removal with the smallest error is accepted as long
+    as max |T - T_reference| <= tolerance. Removing the top boundary lowers the top of the
+    atmosphere, which is what usually happens first in water vapor bands.
+
+    The result is cached per (band, enabled molecules, tolerance, reference, atmosphere), so later
+    runs with the same band, molecules and atmosphere get the layering without any LBLRTM run. The
+    atmosphere is the profile, the molecule scaling and the slant angle as written to the TAPE5; a
+    layering found for one profile or angle is not reused for another.
+
+    Parameters
+    ----------
+    tolerance : float
+        Maximum absolute transmittance error.
+    reference : array-like, optional
+        Fine layering, defaults to the current atmospheric_layers.boundaries.
+    min_layers : int
+        Stop at this many layers.
+    cache : bool, str or Path
+        Use the cache in project_directory/.layering_cache.json, or in the given file.
+    apply : bool
+        Set atmospheric_layers.boundaries of lblrtm to the result.
+
+    Returns
+    -------
+    LayeringResult
+    """
+    reference = np.asarray(lblrtm.configuration.atmospheric_layers.boundaries if isinstance(reference, type(None)) else reference,
+                           dtype=float)
+    key = _key(lblrtm, reference, tolerance)
+    path = _cache_path(lblrtm, cache) if cache else None
+    if path:
+        entry = _read_cache(path).get(key)
+        if entry:
+            result = LayeringResult(boundaries=np.array(entry['boundaries']), max_error=entry['max_error'],
+                                    reference=reference, cached=True, history=entry.get('history', []))
+            if apply:
+                lblrtm.configuration.atmospheric_layers.boundaries = result.boundaries
+            return result
+
+    def spawn(name, boundaries):
+        child = lblrtm.spawn(f'layering/{name}')
+        child.configuration.atmospheric_layers.boundaries = boundaries
+        child.configuration.output.merge_mode = 'total'
+        return child
+
+    lblrtm.prepare_tape3()
+    ref = lab.run_concurrently([spawn('reference', reference)])[0].data
+    wn = ref.wavenumber.values
+    t_ref = np.exp(-ref[var_name].values)
+    runs = 1
+
+    current = reference
+    error = 0.0
+    history = []
+    step = 0
+    while current.size - 1 > min_layers:
+        candidates = [np.delete(current, i) for i in range(1, current.size)]
+        results = lab.run_concurrently([spawn(f'step{step}_{i}', c) for i, c in enumerate(candidates)],
+                                       max_workers=max_workers)
+        runs += len(candidates)
+        errors = [float(np.nanmax(np.abs(np.exp(-regrid.values_on_grid(r.data, var_name, wn)) - t_ref))) for r in results]
+        best = int(np.argmin(errors))
+        if verbose:
+            print(f"{current.size - 1} layers: removing {current[best + 1]} km gives a max. error of {errors[best]:.2e}")
+        if errors[best] > tolerance:
+            break
+        history.append((float(current[best + 1]), errors[best]))
+        current = candidates[best]
+        error = errors[best]
+        step += 1
+
+    result = LayeringResult(boundaries=current, max_error=error, reference=reference, runs=runs, history=history)
+    if path:
+        _write_cache(path, key, dict(boundaries=current.tolist(), max_error=error, history=history))
+    if apply:
+        lblrtm.configuration.atmospheric_layers.boundaries = current
+    return result
@@ -0,0 +1,152 @@
+import os
+import json
+import bisect
+import pathlib as pl
+
+# sidecar of a window TAPE1 written by prepare_runs, with the source and the selection it was made from
+SPLIT_INFO = '.TAPE1.json'
+
+
+def record_line(record: bytes):
+    """
+    (molecule, wavenumber) of a 100 character AER line record (I2, I1, F12.6, ...), or None for
+    records that are not a transition, e.g. continuation records, which belong to the line before.
+    """
+    try:
+        return abs(int(record[0:2])), float(record[3:15])
+    except ValueError:
+        return None
+
+
+def _source_id(p2f: pl.Path) -> str:
+    st = p2f.stat()
+    return f'{p2f.resolve()}:{st.st_size}:{st.st_mtime_ns}'
+
+
+def split(linefile: str | pl.Path, ranges, outputs, molecules=None, verbose: bool = False) -> list:
+    """
+    Write the lines of several wavenumber ranges of a linefile to separate files in one scan.
+
+    Records that are not a transition are written with the transition before them (and records
+    before the first transition to all outputs). Since LNFL needs the linefile sorted by
+    wavenumber, the scan stops after the last range.
+
+    Parameters
+    ----------
+    ranges : sequence of (float, float)
+        (v1, v2) in cm^-1 per output, inclusive; they may overlap.
+    outputs : sequence of str or Path
+        Files to write, one per range. They are replaced atomically (also a symlink in their place).
+    molecules : sequence of int, optional
+        Keep only these (1-based HITRAN) molecules; all by default.
+
+    Returns
+    -------
+    list of int
+        Number of transitions written to each output.
+    """
+    ranges = [(float(lo), float(hi)) for lo, hi in ranges]
+    outputs = [pl.Path(p) for p in outputs]
+    if len(ranges) != len(outputs):
+        raise ValueError("ranges and outputs must have the same length")
+    if any(lo > hi for lo, hi in ranges):
+        raise ValueError("Every range needs v1 <= v2")
+    molecules = None if isinstance(molecules, type(None)) else set(molecules)
+
+    # the edges of all ranges cut the wavenumber axis into segments covered by the same ranges
+    edges = sorted({e for r in ranges for e in r})
+    at_edge = {e: [i for i, (lo, hi) in enumerate(ranges) if lo <= e <= hi] for e in edges}
+    segments = [[i for i, (lo, hi) in enumerate(ranges) if lo <= e and e < hi] for e in edges]
+    top = edges[-1]
+
+    tmps = [p.with_name(f'.{p.name}.tmp{os.getpid()}') for p in outputs]
+    files = [open(t, 'wb') for t in tmps]
+    counts = [0] * len(ranges)
+    try:
+        with open(linefile, 'rb') as f:
+            targets = range(len(files))     # header records go everywhere
+            previous = -1.0
+            for record in f:
+                line = record_line(record)
+                if not isinstance(line, type(None)):
+                    mol, wn = line
+                    if wn > top and wn >= previous:
+                        break
+                    previous = wn
+                    if not isinstance(molecules, type(None)) and mol not in molecules:
+                        targets = ()
+                    elif wn in at_edge:
+                        targets = at_edge[wn]
+                    else:
+                        k = bisect.bisect_right(edges, wn) - 1
+                        targets = segments[k] if k >= 0 else ()
+                    for i in targets:
+                        counts[i] += 1
+                for i in targets:
+                    files[i].write(record)
+    finally:
+        for fo in files:
+            fo.close()
+    for tmp, p2f in zip(tmps, outputs):
+        os.replace(tmp, p2f)
+    if verbose:
+        for (lo, hi), n, p2f in zip(ranges, counts, outputs):
+            print(f"{n} lines between {lo} and {hi} cm^-1 written to {p2f}")
+    return counts
+
+
+def prepare_runs(runs, verbose: bool = False) -> list:
+    """
+    Give every run its own linefile with only the lines of its LNFL range, made in one scan.
+
+    For each run without a shared TAPE3 (environment.tape3 is None), the lines of
+    Lnfl.requested_range (the run's range plus the 25 cm^-1 buffer) and of the enabled molecules
+    are written to run_name/lnfl/TAPE1, and environment.linefile is set to it. LNFL then makes a
+    compact TAPE3 per run from a small file instead of scanning the whole linefile every time.
+    The files are only rewritten (and the old TAPE3 removed) when the linefile, range or
+    molecules changed, see SPLIT_INFO.
+
+    Returns
+    -------
+    list of Path
+        The TAPE1 of each run that was prepared.
+    """
+    runs = [r for r in runs if isinstance(r.configuration.environment.tape3, type(None))]
+    if not runs:
+        return []
+    sources = {r.configuration.environment.linefile for r in runs}
+    if len(sources) != 1 or isinstance(next(iter(sources)), type(None)):
+        raise ValueError("All runs need the same linefile")
+    source = sources.pop()
+    if not source.exists():
+        raise FileNotFoundError(f'No linefile found at {source}.')
+    source_id = _source_id(source)
+
+    todo, outputs = [], []
+    for r in runs:
+        env = r.configuration.environment
+        p2fld = env.project_directory.joinpath(env.run_name, 'lnfl')
+        p2fld.mkdir(parents=True, exist_ok=True)
+        p2f = p2fld.joinpath('TAPE1')
+        info = {'source': source_id, 'range': list(r.lnfl.requested_range), 'molecules': r.lnfl.requested_molecules}
+        try:
+            current = json.loads(p2fld.joinpath(SPLIT_INFO).read_text()) == info and p2f.is_file() and not p2f.is_symlink()
+        except (FileNotFoundError, json.JSONDecodeError):
+            current = False
+        if not current:
+            todo.append((r, p2fld, info))
+        outputs.append(p2f)
+        env.linefile = p2f
+
+    if todo:
+        if verbose:
+            print(f"Splitting {source} into {len(todo)} window linefile(s)")
+        # one scan for all runs; the molecule selection of the runs is the same apart from
+        # runs of other configurations, so the union is kept and LNFL selects from it
+        molecules = sorted({m for _, _, info in todo for m in info['molecules']})
+        split(source, [info['range'] for _, _, info in todo], [p.joinpath('TAPE1') for _, p, _ in todo],
+              molecules=molecules, verbose=verbose)
+        for r, p2fld, info in todo:
+            p2fld.joinpath('TAPE3').unlink(missing_ok=True)     # made from the old TAPE1
+            p2fld.joinpath(SPLIT_INFO).write_text(json.dumps(info))
+    return outputs
@@ -1,10 +1,13 @@
 from . import tape5parser
-import subprocess as sp
+from . import process
+from . import fileio
 import warnings
 
 class Lnfl():
     def __init__(self, lblrtm, verbose = False):
         self.lblrtm_config = lblrtm.configuration
+        self.progress_callback = getattr(lblrtm, 'progress_callback', None)
+        self.cancel = getattr(lblrtm, 'cancel', None)
         self._verbose = verbose
 
     @property
@@ -46,21 +49,50 @@ class Lnfl():
     def _execute_lnfl(self, path2fld_run_lnfl):
         if self._verbose:
             print("Executing lnfl...") 
-        result = sp.run(
+        result = process.run_streamed(
             ["lnfl"],
             cwd=path2fld_run_lnfl,
-            check=True,
-            capture_output=True,
-            text=True,            # str instead of bytes
+            log_path=path2fld_run_lnfl.joinpath('lnfl.log'),
+            progress_callback=self.progress_callback,
+            timeout=self.lblrtm_config.environment.timeout,
+            cpu_timeout=self.lblrtm_config.environment.cpu_timeout,
+            cancel=self.cancel,
+            verbose=self._verbose,
         )
-        print(result.stdout+result.stderr)
         self.tp_result = result
-        if result.stderr.strip() == "STOP  LINFIL COMPLETE":
+        if result.success:
             out = 0
         else:
             out = 1
         return out
 
+    @property
+    def requested_range(self):
+        """(V1, V2) written to the LNFL TAPE5, including the 25 cm^-1 buffer (and its rounding)."""
+        return self.tape5.range
+
+    @property
+    def requested_molecules(self):
+        """1-based indices of the molecules selected in the LNFL TAPE5."""
+        return [i + 1 for i, o in enumerate(self.lblrtm_config.molecular_spectral_lines.molecules) if o.enable]
+
+    def _tape3_covers_request(self, p2f_tape3, p2f_tape5):
+        """Check with the TAPE3 header whether an existing TAPE3 already covers the requested molecules and range."""
+        try:
+            header = fileio.read_tape3_header(p2f_tape3)
+        except (ValueError, OSError) as e:
+            if self._verbose:
+                print(f"Unable to read TAPE3 header at {p2f_tape3} ({e}).")
+            return False
+        # molecules LNFL was asked for but found no lines for are recorded in the old TAPE5 only
+        selected = []
+        if p2f_tape5.exists():
+            lines = p2f_tape5.read_text().splitlines()
+            if len(lines) > 2:
+                selected = [i + 1 for i, c in enumerate(lines[2][:47]) if c == '1']
+        v1, v2 = self.requested_range
+        return header.covers(v1, v2, self.requested_molecules, selected_indices=selected)
+
     def run(self, force_run: bool = False):
         paths = self._create_filesystem()
         p2f_tape5 = paths['p2f_tape5']
@@ -84,6 +116,11 @@ class Lnfl():
                 if self._verbose:
                     print(f"TAPE5 at {p2f_tape5} unchanged, skipping lnfl run.")
                 return
+            elif self._tape3_covers_request(paths['p2f_tape3'], p2f_tape5):
+                # keep the old TAPE5, it describes the TAPE3
+                if self._verbose:
+                    print(f"TAPE3 at {paths['p2f_tape3']} covers the requested molecules and range, skipping lnfl run.")
+                return
             else:
                 if self._verbose:
                     print(f"TAPE5 at {p2f_tape5} changed, running lnfl.")
@@ -0,0 +1,246 @@
+import os
+import itertools
+import concurrent.futures
+import numpy as np
+import xarray as xr
+from . import lab
+from . import regrid
+from . import fileio
+
+
+def _set_pwv(lblrtm, v):
+    h2o = lblrtm.configuration.molecular_spectral_lines.molecules.H2O
+    h2o.enable = True
+    h2o.scale_unit = 'pwv'
+    h2o.scale = v
+
+
+def _set_airmass(lblrtm, v):
+    if v < 1:
+        raise ValueError("airmass must be >= 1")
+    lblrtm.configuration.geometry.slant_angle = float(np.degrees(np.arccos(1 / v)))
+
+
+def _set_zenith_angle(lblrtm, v):
+    lblrtm.configuration.geometry.slant_angle = float(v)
+
+
+# table axes that can be given by name; molecule names (lab.MOLECULE_NAMES) set Molecule.scale
+AXES = {'pwv': _set_pwv,                  # precipitable water vapor (cm)
+        'airmass': _set_airmass,          # plane parallel airmass, 1 / cos(zenith angle)
+        'zenith_angle': _set_zenith_angle,
+        }
+
+
+def _setter(name, setters):
+    if name in setters:
+        return setters[name]
+    if name in AXES:
+        return AXES[name]
+    if name in lab.MOLECULE_NAMES:
+        def set_scale(lblrtm, v):
+            mol = lblrtm.configuration.molecular_spectral_lines.molecules[name]
+            mol.enable = True
+            mol.scale = v
+        return set_scale
+    raise ValueError(f"Unknown axis {name}, options are {set(AXES)}, the molecule names or a setter")
+
+
+def interval_errors(x: np.ndarray, table: np.ndarray) -> np.ndarray:
+    """
+    Estimated error of linear interpolation in each interval of the first axis of table.
+
+    Leaving out an interior node and interpolating it from its neighbours gives the curvature
+    there (2 |error| / (h_left h_right)); an interval of width h then has an interpolation
+    error of about h^2 / 8 x the larger curvature at its ends. Intervals without an interior
+    node at either end (fewer than 3 nodes) get inf.
+    """
+    x = np.asarray(x, dtype=float)
+    h = np.diff(x)
+    if x.size < 3:
+        return np.full(h.size, np.inf)
+    t = table.reshape(x.size, -1)
+    w = (h[:-1] / (h[:-1] + h[1:]))[:, None]
+    loo = np.nanmax(np.abs(t[:-2] + w * (t[2:] - t[:-2]) - t[1:-1]), axis=1)
+    curvature = np.concatenate([[0.0], 2 * loo / (h[:-1] * h[1:]), [0.0]])
+    return h ** 2 / 8 * np.maximum(curvature[:-1], curvature[1:])
+
+
+def interpolate(nodes: dict, table: np.ndarray, **coords) -> np.ndarray:
+    """
+    Multilinear interpolation of table (node axes first, then the values) at points.
+
+    Parameters
+    ----------
+    nodes : dict
+        {axis name: node coordinates}, in the order of the table axes.
+    coords
+        Coordinates of the points for every axis, broadcast against each other.
+
+    Returns
+    -------
+    numpy.ndarray
+        (point, value), or (value) for scalar coordinates.
+    """
+    names = list(nodes)
+    missing = set(names) - set(coords)
+    if missing:
+        raise ValueError(f"Coordinates for {sorted(missing)} are missing")
+    points = np.broadcast_arrays(*[np.asarray(coords[n], dtype=float) for n in names])
+    scalar = points[0].ndim == 0
+    points = [np.atleast_1d(p).ravel() for p in points]
+    index, weight = [], []
+    for name, p in zip(names, points):
+        x = np.asarray(nodes[name], dtype=float)
+        i = np.clip(np.searchsorted(x, p, side='right') - 1, 0, x.size - 2)
+        index.append(i)
+        weight.append(np.clip((p - x[i]) / (x[i + 1] - x[i]), 0, 1))
+    out = 0.0
+    for corner in itertools.product((0, 1), repeat=len(names)):
+        w = np.prod([wt if c else 1 - wt for c, wt in zip(corner, weight)], axis=0)
+        out = out + w[:, None] * table[tuple(i + c for i, c in zip(index, corner))].reshape(w.size, -1)
+    return out[0] if scalar else out
+
+
+class AdaptiveLUT():
+    """
+    Lookup table over configuration parameters (e.g. PWV and airmass) with adaptively placed nodes.
+
+    The table starts on a coarse tensor grid. After each batch of runs, the interpolation error
+    of every interval along every axis is estimated by leaving out interior nodes (see
+    interval_errors). Intervals above the tolerance get a node at their midpoint, largest errors
+    first, as long as the new runs fit into the run budget; all new runs of a batch are executed
+    concurrently as children run_name/lut/<i> with the TAPE3 of lblrtm.
+
+    Parameters
+    ----------
+    axes : dict
+        {axis name: (lo, hi)}. Names are keys of AXES, molecule names (scale in the scale_unit
+        of the molecule) or keys of setters.
+    tolerance : float
+        Target maximum interpolation error of the tabulated values (transmittance or reductions).
+    initial : int
+        Nodes per axis of the first grid, at least 3 so the error can be estimated.
+    budget : int
+        Maximum number of LBLRTM runs.
+    reducers : dict, optional
+        {name: reductions.Reducer}; tabulate these numbers instead of the transmittance spectrum.
+    setters : dict, optional
+        {axis name: function(lblrtm, value)} for other parameters.
+
+    Examples
+    --------
+    >>> lut = AdaptiveLUT(run, {'pwv': (0.1, 5), 'airmass': (1, 6)}, tolerance=1e-3, budget=150)
+    >>> ds = lut.build()
+    >>> lut.interpolate(pwv=1.7, airmass=2.3)
+    """
+    def __init__(self, lblrtm: 'lab.Lblrtm', axes: dict, tolerance: float = 1e-3, initial: int = 3,
+                 budget: int = 200, reducers: dict | None = None, setters: dict | None = None,
+                 max_workers: int | None = None, var_name: str = 'optical_depth', verbose: bool = False):
+        if initial < 3:
+            raise ValueError("initial must be >= 3, the error is estimated from interior nodes")
+        self.lblrtm = lblrtm
+        self.tolerance = tolerance
+        self.budget = budget
+        self.reducers = reducers
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.var_name = var_name
+        self._verbose = verbose
+        self._setters = {name: _setter(name, setters or {}) for name in axes}
+        self.nodes = {name: np.linspace(lo, hi, initial) for name, (lo, hi) in axes.items()}
+        self.wavenumber = None
+        self.history = []       # (runs, estimated max. error) after each batch
+        self._values = {}       # node coordinates: tabulated values
+
+    @property
+    def runs(self) -> int:
+        return len(self._values)
+
+    def _evaluate(self, points) -> None:
+        def job(i, point):
+            child = self.lblrtm.spawn(f'lut/{self.runs + i}')
+            for name, v in zip(self.nodes, point):
+                self._setters[name](child, v)
+            return child.execute().joinpath('TAPE12')
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            paths = list(pool.map(job, range(len(points)), points))
+        for point, path in zip(points, paths):
+            if self.reducers:
+                values = np.array(list(fileio.reduce_tape12(path, self.reducers).values()))
+            else:
+                ds = fileio.read_tape12(path, var_name=self.var_name)
+                if isinstance(self.wavenumber, type(None)):
+                    grid = self.lblrtm.configuration.spectral_grid
+                    self.wavenumber = ds.wavenumber.sel(wavenumber=slice(grid.fmin, grid.fmax)).values
+                values = np.exp(-regrid.values_on_grid(ds, self.var_name, self.wavenumber))
+            self._values[point] = values
+
+    def _grid(self) -> list:
+        return list(itertools.product(*[x.tolist() for x in self.nodes.values()]))
+
+    def table(self) -> np.ndarray:
+        """Tabulated values, shape (*node counts, values)."""
+        shape = tuple(x.size for x in self.nodes.values())
+        return np.stack([self._values[p] for p in self._grid()]).reshape(shape + (-1,))
+
+    def errors(self) -> dict:
+        """{axis name: estimated error of each interval}, the maximum over all other axes."""
+        table = self.table()
+        return {name: interval_errors(x, np.moveaxis(table, axis, 0))
+                for axis, (name, x) in enumerate(self.nodes.items())}
+
+    def refine(self) -> int:
+        """Add midpoints where the error exceeds the tolerance and run them; returns the number of new runs."""
+        candidates = sorted(((e, name, j) for name, err in self.errors().items() for j, e in enumerate(err)
+                             if e > self.tolerance), reverse=True)
+        new = {name: set() for name in self.nodes}
+        for e, name, j in candidates:
+            x = self.nodes[name]
+            new[name].add(0.5 * (x[j] + x[j + 1]))
+            total = np.prod([self.nodes[n].size + len(new[n]) for n in self.nodes])
+            if total > self.budget:
+                new[name].discard(0.5 * (x[j] + x[j + 1]))
+        if not any(new.values()):
+            return 0
+        for name, mids in new.items():
+            self.nodes[name] = np.sort(np.concatenate([self.nodes[name], list(mids)]))
+        todo = [p for p in self._grid() if p not in self._values]
+        self._evaluate(todo)
+        return len(todo)
+
+    def build(self) -> xr.Dataset:
+        """Run the initial grid and refine until the estimated error is within tolerance or the budget is used."""
+        if np.prod([x.size for x in self.nodes.values()]) > self.budget:
+            raise ValueError("The initial grid needs more runs than the budget.")
+        self.lblrtm.prepare_tape3()
+        todo = [p for p in self._grid() if p not in self._values]
+        self._evaluate(todo)
+        while True:
+            error = max(float(np.max(e)) for e in self.errors().values())
+            self.history.append((self.runs, error))
+            if self._verbose:
+                print(f"{self.runs} runs, estimated max. interpolation error {error:.2e}")
+            if error <= self.tolerance or not self.refine():
+                break
+        return self.dataset()
+
+    def interpolate(self, **coords) -> np.ndarray:
+        """Values at new coordinates (multilinear), see interpolate."""
+        return interpolate(self.nodes, self.table(), **coords)
+
+    def dataset(self) -> xr.Dataset:
+        """The table with the node coordinates; transmittance along wavenumber or one variable per reducer."""
+        dims = tuple(self.nodes)
+        table = self.table()
+        coords = {name: (name, x) for name, x in self.nodes.items()}
+        if self.reducers:
+            data = {name: (dims, table[..., i]) for i, name in enumerate(self.reducers)}
+        else:
+            coords['wavenumber'] = self.wavenumber
+            data = {'transmittance': (dims + ('wavenumber',), table, {'long_name': 'spectral transmittance', 'units': '1'})}
+        errors = self.errors()
+        return xr.Dataset(data, coords=coords,
+                          attrs={'source': 'tapefive adaptive lookup table', 'tolerance': self.tolerance,
+                                 'runs': self.runs,
+                                 'estimated_max_error': max(float(np.max(e)) for e in errors.values())})
@@ -0,0 +1,177 @@
+import os
+import json
+import time
+import warnings
+import threading
+import concurrent.futures
+import pathlib as pl
+from . import lab
+from . import fileio
+from . import stages
+
+MANIFEST_VERSION = 1
+
+
+class Manifest():
+    """
+    Record of the jobs of a sweep, kept in a JSON file that is rewritten atomically after every
+    change, so the file is always complete even if the process is killed.
+
+    Each job has an entry {config_hash, status, output, timings, attempts, error, updated};
+    status is one of 'pending' (not started, or its configuration changed), 'running', 'done' or
+    'failed'.
+    """
+    def __init__(self, path: str | pl.Path):
+        self.path = pl.Path(path)
+        self._lock = threading.Lock()
+        self.jobs = {}
+        if self.path.exists():
+            data = json.loads(self.path.read_text())
+            if data.get('version') != MANIFEST_VERSION:
+                raise ValueError(f"{self.path} has manifest version {data.get('version')}, expected {MANIFEST_VERSION}")
+            self.jobs = data['jobs']
+
+    def __len__(self) -> int:
+        return len(self.jobs)
+
+    def get(self, key: str) -> dict | None:
+        return self.jobs.get(key)
+
+    def update(self, key: str, **fields) -> dict:
+        """Change the entry of a job and write the manifest."""
+        with self._lock:
+            entry = dict(self.jobs.get(key, {}), **fields, updated=time.time())
+            self.jobs[key] = entry
+            self._write()
+            return entry
+
+    def _write(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(f'.{self.path.name}.tmp{os.getpid()}')
+        with open(tmp, 'w') as f:
+            json.dump(dict(version=MANIFEST_VERSION, jobs=self.jobs), f, indent=1, sort_keys=True)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+    def summary(self) -> dict:
+        """Number of jobs per status."""
+        out = {}
+        for entry in self.jobs.values():
+            out[entry['status']] = out.get(entry['status'], 0) + 1
+        return out
+
+
+def _output_is_complete(p2fld: str | pl.Path, configuration) -> bool:
+    """The TAPE12 of a run covers its spectral range; with merge_mode 'layers', which writes no
+    merged TAPE12, every layer optical depth file does."""
+    grid = configuration.spectral_grid
+    p2fld = pl.Path(p2fld)
+    if configuration.output.merge_mode == 'layers':
+        files = sorted(p2fld.glob(lab.LAYER_OD_FILE_PATTERN))
+    else:
+        files = [p2fld.joinpath('TAPE12')]
+    return bool(files) and all(fileio.validate_tape12(p, fmin=grid.fmin, fmax=grid.fmax) for p in files)
+
+
+def run_sweep(lblrtms, manifest: str | pl.Path | Manifest, max_workers: int | None = None, max_attempts: int = 3,
+              load: bool = True, cost_model=None, verbose: bool = False) -> list:
+    """
+    Run many Lblrtm instances, recording every job in a manifest so an interrupted sweep can be resumed.
+
+    Calling run_sweep again with the same manifest
+    - skips jobs that are done, if their configuration is unchanged (Lblrtm.fingerprint) and their
+      TAPE12 (the layer optical depth files for merge_mode 'layers') is complete
+      (fileio.validate_tape12),
+    - reruns jobs that were running when the sweep died or whose output is missing or partial,
+    - retries failed jobs until they failed max_attempts times in total.
+
+    Jobs are identified by their run_name, so every instance needs its own run directory (e.g.
+    from Lblrtm.spawn).
+
+    Parameters
+    ----------
+    manifest : str, Path or Manifest
+        Manifest file, e.g. project_directory/sweep.json.
+    load : bool
+        Return lab.Results; if False only the run directories are returned, which keeps memory
+        low for large sweeps.
+    cost_model : scheduling.CostModel, optional
+        Start the jobs longest predicted runtime first and update the model with every run.
+
+    Returns
+    -------
+    list
+        Results (or run directory) per instance in input order; None for jobs that failed
+        max_attempts times.
+    """
+    lblrtms = list(lblrtms)
+    manifest = manifest if isinstance(manifest, Manifest) else Manifest(manifest)
+    keys = [str(r.configuration.environment.run_name) for r in lblrtms]
+    if len(set(keys)) != len(keys):
+        raise ValueError("Every Lblrtm of a sweep needs its own run_name.")
+
+    todo = []
+    outputs = [None] * len(lblrtms)
+    for i, (key, run) in enumerate(zip(keys, lblrtms)):
+        config_hash = run.fingerprint
+        entry = manifest.get(key)
+        if entry and entry.get('config_hash') != config_hash:
+            entry = manifest.update(key, config_hash=config_hash, status='pending', attempts=0, error=None, output=None)
+        if entry and entry['status'] == 'done':
+            output = entry.get('output')
+            if not isinstance(output, type(None)) and _output_is_complete(output, run.configuration):
+                outputs[i] = pl.Path(output)
+                continue
+            if verbose:
+                print(f"{key}: output is incomplete, rerunning")
+        if entry and entry['status'] == 'failed' and entry.get('attempts', 0) >= max_attempts:
+            continue
+        todo.append(i)
+        if not entry:
+            manifest.update(key, config_hash=config_hash, status='pending', attempts=0, error=None, output=None)
+
+    if not isinstance(cost_model, type(None)):
+        from . import scheduling
+        order = scheduling.longest_first([lblrtms[i] for i in todo], cost_model)
+        todo = [todo[j] for j in order]
+
+    if verbose:
+        print(f"{len(lblrtms) - len(todo)} of {len(lblrtms)} jobs are already done or given up, running {len(todo)}")
+
+    def work(i):
+        key = keys[i]
+        attempts = manifest.get(key).get('attempts', 0)
+        while True:
+            attempts += 1
+            manifest.update(key, status='running', attempts=attempts)
+            try:
+                p2fld = lblrtms[i].execute()
+                if not _output_is_complete(p2fld, lblrtms[i].configuration):
+                    raise ValueError(f"LBLRTM wrote no complete output to {p2fld}")
+            except Exception as e:
+                manifest.update(key, status='failed', error=f'{type(e).__name__}: {e}'[:2000])
+                if attempts >= max_attempts:
+                    return None
+                continue
+            if not isinstance(cost_model, type(None)):
+                cost_model.observe(lblrtms[i])
+            # a run that reused its outputs keeps the timings of the run that made them
+            fields = dict(timings=lblrtms[i].timings) if stages.ran_lblrtm(lblrtms[i]) else {}
+            manifest.update(key, status='done', output=str(p2fld), error=None, **fields)
+            return p2fld
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(work, i): i for i in todo}
+        for future in concurrent.futures.as_completed(futures):
+            outputs[futures[future]] = future.result()
+
+    failed = [k for k, o in zip(keys, outputs) if isinstance(o, type(None))]
+    if failed:
+        warnings.warn(f"{len(failed)} job(s) failed {max_attempts} times and were given up, e.g. {failed[0]}: "
+                      f"{manifest.get(failed[0]).get('error')}")
+    if not load:
+        return outputs
+    return [None if isinstance(p, type(None)) else
+            lab.Results(p, configuration=run.configuration.to_dict(), timings=manifest.get(key).get('timings'))
+            for p, run, key in zip(outputs, lblrtms, keys)]
@@ -0,0 +1,161 @@
+import numpy as np
+import xarray as xr
+from . import lab
+from . import regrid
+
+
+class OpticalDepthScaling():
+    """
+    Fast per-molecule optical-depth rescaling for absorption-only cases.
+
+    The total optical depth is approximated by
+
+        OD(s) = OD_0 + sum_m (s_m / s_ref_m) * (OD_m - OD_0)
+
+    where OD_m is a run with only molecule m at its reference scale (Molecule.scale in its
+    scale_unit) and all other enabled molecules scaled to zero, and OD_0 is a run with all enabled
+    molecules scaled to zero (continua and Rayleigh that do not depend on the molecules). After
+    prepare, which costs one LBLRTM run per enabled molecule plus one, new scale combinations are
+    a vectorized linear combination without any further LBLRTM run.
+
+    The approximation is exact for line absorption. Terms that are not linear in the column
+    amount, e.g. the H2O self continuum, are only approximated; use validate to quantify the error.
+
+    Examples
+    --------
+    >>> scaling = OpticalDepthScaling(run)
+    >>> ds = scaling.combine(H2O=np.linspace(0.1, 5, 200))   # one spectrum per PWV value
+    """
+    def __init__(self, lblrtm: lab.Lblrtm, max_workers: int | None = None, var_name: str = 'optical_depth'):
+        self.lblrtm = lblrtm
+        self.max_workers = max_workers
+        self.var_name = var_name
+        self._cache_key = None
+        self._wavenumber = None
+        self._background = None
+        self._optical_depths = None
+        self._reference = None
+        self._molecules = None
+
+    @property
+    def molecules(self) -> list:
+        """Names of the enabled molecules; one reference run is done for each."""
+        return [m.name for m in self.lblrtm.configuration.molecular_spectral_lines.molecules if m.enable]
+
+    def _spawn(self, name, keep=None):
+        child = self.lblrtm.spawn(f'od_scaling/{name}')
+        for m in child.configuration.molecular_spectral_lines.molecules:
+            if m.enable and m.name != keep:
+                m.scale_unit = 'direct'
+                m.scale = 0
+        return child
+
+    def prepare(self, force: bool = False) -> None:
+        """Run the reference runs and cache their OD spectra. Skipped if the configuration is unchanged."""
+        key = self.lblrtm.tape5.tape5
+        if not force and self._cache_key == key:
+            return
+        molecules = self.molecules
+        if not molecules:
+            raise ValueError("No molecule is enabled.")
+        mols = self.lblrtm.configuration.molecular_spectral_lines.molecules
+        for name in molecules:
+            if mols[name].scale == 0:
+                raise ValueError(f"The reference scale of {name} is 0, set Molecule.scale to a typical value.")
+
+        self.lblrtm.prepare_tape3()
+        runs = [self._spawn('background')] + [self._spawn(name, keep=name) for name in molecules]
+        results = lab.run_concurrently(runs, max_workers=self.max_workers)
+
+        background = results[0].data
+        wn = background.wavenumber.values
+        bg = regrid.values_on_grid(background, self.var_name, wn)
+        self._optical_depths = np.vstack([regrid.values_on_grid(r.data, self.var_name, wn) - bg for r in results[1:]])
+        self._background = bg
+        self._wavenumber = background.wavenumber
+        self._reference = np.array([mols[name].scale for name in molecules])
+        self._molecules = molecules
+        self._cache_key = key
+
+    def _factors(self, scales: dict) -> tuple:
+        unknown = set(scales) - set(self._molecules)
+        if unknown:
+            raise ValueError(f"Molecules {sorted(unknown)} are not enabled, options are {self._molecules}")
+        columns = [np.asarray(scales.get(name, ref), dtype=float) for name, ref in zip(self._molecules, self._reference)]
+        columns = np.broadcast_arrays(*columns)
+        scalar = columns[0].ndim == 0
+        values = np.stack([np.atleast_1d(c).ravel() for c in columns], axis=-1)    # (sample, molecule)
+        return values, values / self._reference, scalar
+
+    def combine(self, scales: dict | None = None, validate: bool = False, **kwargs) -> xr.Dataset:
+        """
+        Optical depth and transmittance for new molecule scales, e.g. combine(H2O=[0.5, 1, 2]).
+
+        Parameters
+        ----------
+        scales : dict, optional
+            {molecule name: scale}, scale in the reference scale_unit of that molecule. Scalars
+            and arrays are broadcast against each other; molecules not given keep their reference
+            scale. Can also be given as keyword arguments.
+        validate : bool
+            Run LBLRTM for one combination (the one furthest from the reference) and store the
+            errors from validate in the attributes.
+
+        Returns
+        -------
+        xr.Dataset
+            optical_depth and transmittance with dimensions (sample, wavenumber), or (wavenumber)
+            if all scales are scalars. The scales are coordinates scale_<molecule>.
+        """
+        scales = dict(scales or {}, **kwargs)
+        self.prepare()
+        values, factors, scalar = self._factors(scales)
+        od = self._background + factors @ self._optical_depths
+
+        coords = {'wavenumber': self._wavenumber}
+        for i, name in enumerate(self._molecules):
+            coords[f'scale_{name}'] = ('sample', values[:, i])
+        ds = xr.Dataset({self.var_name: (('sample', 'wavenumber'), od, {'long_name': self.var_name, 'units': '1'})},
+                        coords=coords,
+                        attrs={'source': 'tapefive per-molecule optical depth rescaling',
+                               'molecules': ', '.join(self._molecules),
+                               'reference_scales': self._reference})
+        ds['transmittance'] = np.exp(-ds[self.var_name])
+        ds['transmittance'].attrs = {'long_name': 'spectral transmittance', 'units': '1'}
+
+        if validate:
+            i = int(np.argmax(np.abs(np.log(np.where(factors > 0, factors, 1))).max(axis=1)))
+            errors = self.validate(dict(zip(self._molecules, values[i])), approximation=ds.isel(sample=i))
+            ds.attrs.update({f'validation_{k}': v for k, v in errors.items()})
+            ds.attrs['validation_sample'] = i
+        if scalar:
+            ds = ds.isel(sample=0)
+        return ds
+
+    def validate(self, scales: dict | None = None, approximation: xr.Dataset | None = None, **kwargs) -> dict:
+        """
+        Compare the rescaled optical depth for scalar scales with a true LBLRTM run.
+
+        Returns
+        -------
+        dict
+            max_abs_error and rms_error of the optical depth, max_rel_error (relative to the true
+            optical depth where it is > 1e-6) and max_abs_error_transmittance.
+        """
+        scales = dict(scales or {}, **kwargs)
+        if isinstance(approximation, type(None)):
+            approximation = self.combine(scales)
+        child = self.lblrtm.spawn('od_scaling/validation')
+        mols = child.configuration.molecular_spectral_lines.molecules
+        for name, value in scales.items():
+            mols[name].scale = float(value)
+        true = lab.run_concurrently([child])[0].data
+        wn = approximation.wavenumber.values
+        od_true = regrid.values_on_grid(true, self.var_name, wn)
+        od = approximation[self.var_name].values
+        diff = od - od_true
+        significant = np.abs(od_true) > 1e-6
+        return dict(max_abs_error=float(np.nanmax(np.abs(diff))),
+                    rms_error=float(np.sqrt(np.nanmean(diff ** 2))),
+                    max_rel_error=float(np.nanmax(np.abs(diff[significant] / od_true[significant]))) if significant.any() else 0.0,
+                    max_abs_error_transmittance=float(np.nanmax(np.abs(np.exp(-od) - np.exp(-od_true)))))
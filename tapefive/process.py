@@ -0,0 +1,249 @@
+import os
+import re
+import math
+import signal
+import time
+import threading
+import collections
+import pathlib as pl
+import subprocess as sp
+from dataclasses import dataclass, field
+
+# Patterns in LNFL/LBLRTM console output that mean the run is lost. As soon as
+# one of them shows up the child is killed instead of waiting for it to exit.
+ERROR_PATTERNS = (r'forrtl:\s*severe',
+                  r'Fortran runtime error',
+                  r'Program received signal',
+                  r'Segmentation fault',
+                  r'\*{3,}\s*ERROR',
+                  r'^\s*ERROR\b',
+                  r'STOP\s+.*ERROR',
+                  r'cannot open file',
+                  )
+
+# LBLRTM reports the layer it is working on, e.g. "LAYER =   3" or "Layer 3 of 18"
+PROGRESS_PATTERNS = {'layer': r'\bLAYER\b\s*[=:#]?\s*(\d+)',
+                     }
+
+SUCCESS_PATTERNS = {'lblrtm': r'STOP\s+LBLRTM EXIT',
+                    'lnfl': r'STOP\s+LINFIL COMPLETE',
+                    }
+
+# gfortran fully buffers stdout when it is a pipe; without this the output (and with it the
+# progress and error detection) would only arrive when the child exits
+UNBUFFERED_ENV = {'GFORTRAN_UNBUFFERED_PRECONNECTED': 'y'}
+
+# seconds between checks of the cancel event of run_streamed
+CANCEL_POLL = 0.5
+
+
+class ProcessError(RuntimeError):
+    """Raised when LNFL/LBLRTM fails, times out, or reports a known error."""
+    def __init__(self, message, result=None):
+        super().__init__(message)
+        self.result = result
+
+
+@dataclass
+class ProcessResult:
+    program: str
+    returncode: int | None = None
+    log_path: pl.Path | None = None
+    elapsed: float = 0.0
+    success: bool = False
+    timed_out: bool = False
+    cancelled: bool = False
+    error: str | None = None
+    progress: dict = field(default_factory=dict)
+    tail: list = field(default_factory=list)
+
+    @property
+    def output(self) -> str:
+        """Last lines of the console output (the full output is in log_path)."""
+        return '\n'.join(self.tail)
+
+
+class OutputParser():
+    """Incremental parser for the console output of LNFL/LBLRTM.
+
+    Every line is passed to feed. Progress (e.g. which layer is processed) is
+    reported through progress_callback as a dict with the keys program, kind,
+    value and line. The first line matching one of error_patterns is stored in
+    error.
+    """
+    def __init__(self, program, progress_callback=None, error_patterns=ERROR_PATTERNS,
+                 progress_patterns=PROGRESS_PATTERNS, success_pattern=None, tail_lines=50):
+        self.program = program
+        self.progress_callback = progress_callback
+        self._error_patterns = [re.compile(p, re.IGNORECASE) for p in error_patterns]
+        self._progress_patterns = {k: re.compile(p, re.IGNORECASE) for k, p in progress_patterns.items()}
+        if isinstance(success_pattern, type(None)):
+            success_pattern = SUCCESS_PATTERNS.get(program, r'^\s*STOP\b')
+        self._success_pattern = re.compile(success_pattern, re.IGNORECASE)
+        self.progress = {}
+        self.error = None
+        self.success = False
+        self.tail = collections.deque(maxlen=tail_lines)
+
+    def feed(self, line: str) -> None:
+        line = line.rstrip('\n')
+        self.tail.append(line)
+        if self._success_pattern.search(line):
+            self.success = True
+            return
+        if isinstance(self.error, type(None)):
+            for p in self._error_patterns:
+                if p.search(line):
+                    self.error = line.strip()
+                    return
+        for kind, p in self._progress_patterns.items():
+            m = p.search(line)
+            if m:
+                value = int(m.group(1))
+                self.progress[kind] = value
+                if self.progress_callback:
+                    self.progress_callback(dict(program=self.program, kind=kind, value=value, line=line))
+
+
+def _cpu_limit(cmd, seconds):
+    """
+    cmd and a function that applies RLIMIT_CPU to the started child.
+
+    With prlimit (Linux) the parent sets the limit right after the start, elsewhere cmd is started
+    through `ulimit -t`. A preexec_fn would be simpler, but it can deadlock the fork while other
+    threads run, and LBLRTM is started from thread pools (lab.run_concurrently, batch, ...).
+    """
+    import resource
+    soft = int(math.ceil(seconds))
+    if hasattr(resource, 'prlimit'):
+        def apply(proc):
+            # the kernel sends SIGXCPU at the soft and SIGKILL at the hard limit
+            try:
+                resource.prlimit(proc.pid, resource.RLIMIT_CPU, (soft, soft + 5))
+            except ProcessLookupError:
+                pass    # already gone
+        return cmd, apply
+    return ['/bin/sh', '-c', f'ulimit -t {soft} && exec "$0" "$@"', *cmd], lambda proc: None
+
+
+def _kill(proc):
+    # the child runs in its own session, so wrapper scripts and their children go too
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        proc.kill()
+
+
+def run_streamed(cmd, cwd, log_path, program=None, progress_callback=None,
+                 timeout=None, cpu_timeout=None, success_pattern=None,
+                 error_patterns=ERROR_PATTERNS, cancel=None, verbose=False) -> ProcessResult:
+    """
+    Run cmd in cwd, streaming its combined stdout/stderr to log_path while parsing it.
+
+    Parameters
+    ----------
+    cmd : list of str
+        Command to execute, e.g. ['lblrtm'].
+    cwd : path
+        Working directory of the child.
+    log_path : path
+        File the console output is written to, line by line.
+    program : str, optional
+        Name used in progress reports and errors. Defaults to cmd[0].
+    progress_callback : callable, optional
+        Called with a dict(program, kind, value, line) whenever progress is parsed.
+    timeout : float, optional
+        Wall-clock limit in seconds. The child is killed when it is exceeded.
+    cpu_timeout : float, optional
+        CPU time limit in seconds, enforced by the kernel (RLIMIT_CPU).
+    success_pattern : str, optional
+        Regex marking a successful run, defaults to the known final message of program.
+    error_patterns : sequence of str
+        Regexes that mark a failed run. The child is killed on the first match.
+    cancel : threading.Event, optional
+        The child is killed when the event is set (checked every CANCEL_POLL seconds).
+    verbose : bool
+        Echo the output while it is produced.
+
+    Returns
+    -------
+    ProcessResult
+
+    Raises
+    ------
+    ProcessError
+        If the child timed out, was cancelled, reported an error, or exited with a non-zero code.
+    """
+    program = program or pl.Path(cmd[0]).name
+    log_path = pl.Path(log_path)
+    parser = OutputParser(program, progress_callback=progress_callback, error_patterns=error_patterns,
+                          success_pattern=success_pattern)
+    limit = None
+    if not isinstance(cpu_timeout, type(None)):
+        cmd, limit = _cpu_limit(cmd, cpu_timeout)
+
+    start = time.monotonic()
+    with open(log_path, 'w') as log:
+        proc = sp.Popen(cmd, cwd=cwd, stdout=sp.PIPE, stderr=sp.STDOUT, text=True, bufsize=1,
+                        errors='replace', start_new_session=True, env={**os.environ, **UNBUFFERED_ENV})
+        if limit:
+            limit(proc)
+
+        def consume():
+            for line in proc.stdout:
+                log.write(line)
+                if verbose:
+                    print(line, end='')
+                parser.feed(line)
+                if parser.error and proc.poll() is None:
+                    _kill(proc)
+            proc.stdout.close()
+
+        reader = threading.Thread(target=consume, name=f'{program}-output', daemon=True)
+        reader.start()
+        timed_out = cancelled = False
+        deadline = None if isinstance(timeout, type(None)) else start + timeout
+        while True:
+            wait = None if isinstance(deadline, type(None)) else max(deadline - time.monotonic(), 0)
+            if not isinstance(cancel, type(None)):
+                wait = CANCEL_POLL if isinstance(wait, type(None)) else min(wait, CANCEL_POLL)
+            try:
+                proc.wait(timeout=wait)
+                break
+            except sp.TimeoutExpired:
+                if not isinstance(cancel, type(None)) and cancel.is_set():
+                    cancelled = True
+                elif not isinstance(deadline, type(None)) and time.monotonic() >= deadline:
+                    timed_out = True
+                else:
+                    continue
+            _kill(proc)
+            proc.wait()
+            break
+        reader.join()
+
+    result = ProcessResult(program=program,
+                           returncode=proc.returncode,
+                           log_path=log_path,
+                           elapsed=time.monotonic() - start,
+                           success=parser.success,
+                           timed_out=timed_out,
+                           cancelled=cancelled,
+                           error=parser.error,
+                           progress=dict(parser.progress),
+                           tail=list(parser.tail))
+
+    if cancelled:
+        msg = f'{program} was cancelled and killed'
+    elif timed_out:
+        msg = f'{program} exceeded the wall-clock timeout of {timeout} s and was killed'
+    elif result.error:
+        msg = f'{program} reported an error and was killed: {result.error!r}'
+    elif result.returncode != 0:
+        if result.returncode in (-24, -9) and not isinstance(cpu_timeout, type(None)):
+            msg = f'{program} exceeded the CPU time limit of {cpu_timeout} s'
+        else:
+            msg = f'{program} exited with code {result.returncode}'
+    else:
+        return result
+    raise ProcessError(f'{msg} (log: {log_path})\n' + result.output, result=result)
@@ -0,0 +1,192 @@
+import os
+import concurrent.futures
+import numpy as np
+import xarray as xr
+from dataclasses import dataclass, field
+from . import lab
+from . import fileio
+from . import tape5parser
+
+# conversions of level coordinates to the units of RECORD 3.5 (km, mb)
+_ALTITUDE_SCALE = {'km': 1.0, 'm': 1e-3}
+_PRESSURE_SCALE = {'mb': 1.0, 'hpa': 1.0, 'pa': 1e-2}
+
+
+def unit_code(unit: str) -> str:
+    """RECORD 3.5 JCHAR code of a unit name (see tape5parser.PROFILE_UNIT_CODES) or code."""
+    unit = str(unit)
+    if unit in tape5parser.PROFILE_UNIT_CODES.values() or unit in ('1', '2', '3', '4', '5', '6'):
+        return unit
+    if unit.lower() in tape5parser.PROFILE_UNIT_CODES:
+        return tape5parser.PROFILE_UNIT_CODES[unit.lower()]
+    raise ValueError(f"Unknown profile unit {unit!r}, options are {set(tape5parser.PROFILE_UNIT_CODES)}")
+
+
+@dataclass
+class ProfileStack:
+    """
+    Atmospheric profiles on levels: altitude (km), pressure (mb), temperature (K) and molecule
+    amounts, each (n_profile, n_level).
+
+    Use from_arrays or from_dataset to create one; render writes RECORD 3.4 - 3.6 of all
+    profiles at once.
+    """
+    altitude: np.ndarray
+    pressure: np.ndarray
+    temperature: np.ndarray
+    amounts: dict                                    # molecule name: (n_profile, n_level)
+    units: dict = field(default_factory=dict)        # molecule name: JCHAR code, default 'A' (ppmv)
+    coords: dict = field(default_factory=dict)       # coordinates along profile, e.g. launch time
+
+    def __len__(self) -> int:
+        return self.altitude.shape[0]
+
+    @classmethod
+    def from_arrays(cls, altitude, pressure, temperature, units: dict | None = None, coords: dict | None = None,
+                    **amounts) -> 'ProfileStack':
+        """
+        Profiles from arrays of shape (n_level,) or (n_profile, n_level); 1-D arrays are the
+        same for all profiles, e.g. a common altitude grid.
+
+        Examples
+        --------
+        >>> ProfileStack.from_arrays(z, p, t, H2O=h2o, O3=o3, units={'H2O': 'rh'})
+        """
+        for name in amounts:
+            if name not in lab.MOLECULE_NAMES:
+                raise ValueError(f"Unknown molecule {name}, options are {lab.MOLECULE_NAMES}")
+        arrays = [np.atleast_2d(np.asarray(a, dtype=float)) for a in (altitude, pressure, temperature, *amounts.values())]
+        try:
+            arrays = np.broadcast_arrays(*arrays)
+        except ValueError:
+            raise ValueError("altitude, pressure, temperature and amounts must have the same levels "
+                             "and the same number of profiles")
+        altitude, pressure, temperature = arrays[:3]
+        return cls(altitude=altitude, pressure=pressure, temperature=temperature,
+                   amounts=dict(zip(amounts, arrays[3:])),
+                   units={name: unit_code(u) for name, u in (units or {}).items()},
+                   coords=dict(coords or {}))
+
+    @classmethod
+    def from_dataset(cls, ds: xr.Dataset, profile_dim: str = 'profile') -> 'ProfileStack':
+        """
+        Profiles from a dataset with the variables altitude, pressure, temperature and one
+        variable per molecule (named as in lab.MOLECULE_NAMES).
+
+        The dimensions are profile_dim and one level dimension. The units attribute of altitude
+        (km, m) and pressure (mb, hPa, Pa) is converted; the units attribute of a molecule is
+        its unit (a key of tape5parser.PROFILE_UNIT_CODES, default ppmv). Coordinates along
+        profile_dim are kept for the results of run_profiles.
+        """
+        if profile_dim not in ds.dims:
+            ds = ds.expand_dims(profile_dim)
+        level_dims = [d for d in ds.temperature.dims if d != profile_dim]
+        if len(level_dims) != 1:
+            raise ValueError(f"temperature needs the dimensions ({profile_dim}, <level>), has {ds.temperature.dims}")
+        dims = (profile_dim, level_dims[0])
+
+        def values(name, scales=None):
+            da = ds[name]
+            v = da.transpose(*[d for d in dims if d in da.dims]).values
+            if scales:
+                unit = str(da.attrs.get('units', next(iter(scales)))).lower()
+                if unit not in scales:
+                    raise ValueError(f"Unit {unit} of {name} not supported, options are {set(scales)}")
+                v = v * scales[unit]
+            return v
+
+        names = [n for n in lab.MOLECULE_NAMES if n in ds.data_vars]
+        coords = {k: c.values for k, c in ds.coords.items() if c.dims == (profile_dim,)}
+        return cls.from_arrays(values('altitude', _ALTITUDE_SCALE), values('pressure', _PRESSURE_SCALE),
+                               values('temperature'),
+                               units={n: ds[n].attrs['units'] for n in names if 'units' in ds[n].attrs},
+                               coords=coords, **{n: values(n) for n in names})
+
+    def nmol(self) -> int:
+        return max([7] + [lab.MOLECULE_NAMES.index(name) + 1 for name in self.amounts])
+
+    def render(self, fill_model: int = 2, index=slice(None)) -> list:
+        """
+        RECORD 3.4 - 3.6 of the profiles (index selects some), see tape5parser.render_user_profiles.
+
+        Molecules up to the last one in amounts that are not given are taken from the
+        standard atmosphere fill_model (1 - 6).
+        """
+        altitude = self.altitude[index]
+        if altitude.shape[-1] < 2:
+            raise ValueError("A profile needs at least two levels")
+        if np.any(np.diff(altitude, axis=-1) <= 0):
+            raise ValueError("The altitude of a profile must be strictly increasing")
+        nmol = self.nmol()
+        amounts = np.zeros(altitude.shape + (nmol,))
+        jchar = [str(fill_model)] * nmol
+        for name, a in self.amounts.items():
+            i = lab.MOLECULE_NAMES.index(name)
+            amounts[..., i] = a[index]
+            jchar[i] = self.units.get(name, 'A')
+        return tape5parser.render_user_profiles(altitude, self.pressure[index], self.temperature[index], amounts, jchar)
+
+    def assign(self, profile: 'lab.AtmosphericProfile', i: int, records: str | None = None) -> None:
+        """Set the configuration profile to profile i (and its already rendered records)."""
+        profile.altitude = self.altitude[i]
+        profile.pressure = self.pressure[i]
+        profile.temperature = self.temperature[i]
+        profile.amounts = {name: a[i] for name, a in self.amounts.items()}
+        profile.units = self.units
+        if not isinstance(records, type(None)):
+            profile._records = records
+
+
+def run_profiles(lblrtm: 'lab.Lblrtm', profiles, max_workers: int | None = None, chunk_size: int = 256,
+                 fmin: float | None = None, fmax: float | None = None, dtype=np.float32, load: bool = True,
+                 profile_dim: str = 'profile', var_name: str = 'optical_depth'):
+    """
+    Run lblrtm once per profile and stack the spectra along profile.
+
+    Every profile runs as a child (run_name/profiles/<i>) with the TAPE3 of lblrtm. The TAPE5
+    records of the profiles are rendered chunk_size profiles at a time in one vectorized pass,
+    and only chunk_size profiles are pending at any time, so thousands of profiles do not need
+    thousands of TAPE5s in memory. The outputs are read with fileio.read_many.
+    The layer boundaries of lblrtm (atmospheric_layers.boundaries) must lie within the altitude
+    range of every profile.
+
+    Parameters
+    ----------
+    profiles : ProfileStack or xr.Dataset
+        A dataset is converted with ProfileStack.from_dataset.
+    load : bool
+        If False, return the run directories instead of reading them.
+
+    Returns
+    -------
+    xr.Dataset or list
+        var_name with dimensions (profile, wavenumber) and the profile coordinates of the input.
+    """
+    if isinstance(profiles, xr.Dataset):
+        profiles = ProfileStack.from_dataset(profiles, profile_dim=profile_dim)
+    fill_model = lblrtm.configuration.atmospheric_profile.fill_model
+    lblrtm.prepare_tape3()
+    paths = [None] * len(profiles)
+
+    def job(child, i):
+        paths[i] = child.execute()
+
+    max_workers = max_workers or os.cpu_count() or 1
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for start in range(0, len(profiles), chunk_size):
+            index = slice(start, min(start + chunk_size, len(profiles)))
+            records = profiles.render(fill_model=fill_model, index=index)
+            futures = []
+            for i, rec in zip(range(index.start, index.stop), records):
+                child = lblrtm.spawn(f'profiles/{i}')
+                profiles.assign(child.configuration.atmospheric_profile, i, rec)
+                futures.append(pool.submit(job, child, i))
+            for f in futures:
+                f.result()
+
+    if not load:
+        return paths
+    ds = fileio.read_many([p.joinpath('TAPE12') for p in paths], fmin=fmin, fmax=fmax, dtype=dtype,
+                          var_name=var_name, max_workers=max_workers)
+    ds = ds.rename(run=profile_dim)
+    return ds.assign_coords({k: (profile_dim, v) for k, v in profiles.coords.items()})
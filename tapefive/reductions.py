@@ -0,0 +1,141 @@
+import numpy as np
+
+# functions applied to the optical depth before reducing
+TRANSFORMS = {'transmittance': lambda od: np.exp(-od),
+              'absorptance': lambda od: -np.expm1(-od),
+              }
+
+
+def _transform(transform):
+    if isinstance(transform, type(None)):
+        return None
+    if callable(transform):
+        return transform
+    if transform not in TRANSFORMS:
+        raise ValueError(f"transform must be a callable or one of {set(TRANSFORMS)}")
+    return TRANSFORMS[transform]
+
+
+class Reducer():
+    """
+    Accumulates a number from a spectrum that is passed panel by panel, see fileio.reduce_tape12.
+
+    Subclasses implement update and result; reset is called before the first panel of a file,
+    so one reducer can be used for many files.
+    """
+    def __init__(self, fmin: float | None = None, fmax: float | None = None, transform=None):
+        self.fmin = fmin
+        self.fmax = fmax
+        self._transform = _transform(transform)
+        self.reset()
+
+    def reset(self) -> None:
+        pass
+
+    def _select(self, wavenumber, values):
+        """Samples inside fmin - fmax, transformed."""
+        mask = np.ones(wavenumber.shape, dtype=bool)
+        if not isinstance(self.fmin, type(None)):
+            mask &= wavenumber >= self.fmin
+        if not isinstance(self.fmax, type(None)):
+            mask &= wavenumber <= self.fmax
+        if not mask.all():
+            wavenumber, values = wavenumber[mask], values[mask]
+        if self._transform:
+            values = self._transform(values)
+        return wavenumber, values
+
+    def update(self, wavenumber: np.ndarray, values: np.ndarray, dv: float) -> None:
+        raise NotImplementedError
+
+    def result(self):
+        raise NotImplementedError
+
+
+class Integral(Reducer):
+    """Integral over wavenumber, e.g. band-integrated optical depth (cm^-1). Each sample counts with its spacing dv."""
+    def reset(self) -> None:
+        self._sum = 0.0
+
+    def update(self, wavenumber, values, dv) -> None:
+        _, values = self._select(wavenumber, values)
+        self._sum += float(values.sum()) * dv
+
+    def result(self) -> float:
+        return self._sum
+
+
+class EquivalentWidth(Integral):
+    """Equivalent width (cm^-1) of the band: integral of 1 - exp(-OD)."""
+    def __init__(self, fmin: float | None = None, fmax: float | None = None):
+        super().__init__(fmin=fmin, fmax=fmax, transform='absorptance')
+
+
+class WeightedMean(Reducer):
+    """
+    Mean weighted by a spectral response, e.g. the filter-weighted mean transmittance.
+
+    Parameters
+    ----------
+    response : callable or tuple
+        Either a function of wavenumber returning the weights, or a tuple (wavenumber, weights)
+        that is linearly interpolated (zero outside).
+    transform : str or callable, optional
+        Applied to the values before averaging, e.g. 'transmittance'.
+    """
+    def __init__(self, response, fmin: float | None = None, fmax: float | None = None, transform=None):
+        if callable(response):
+            self._response = response
+        else:
+            wn, weights = (np.asarray(a, dtype=np.float64) for a in response)
+            order = np.argsort(wn)
+            wn, weights = wn[order], weights[order]
+            self._response = lambda x: np.interp(x, wn, weights, left=0.0, right=0.0)
+            if isinstance(fmin, type(None)):
+                fmin = float(wn[0])
+            if isinstance(fmax, type(None)):
+                fmax = float(wn[-1])
+        super().__init__(fmin=fmin, fmax=fmax, transform=transform)
+
+    def reset(self) -> None:
+        self._sum = 0.0
+        self._weight = 0.0
+
+    def update(self, wavenumber, values, dv) -> None:
+        wavenumber, values = self._select(wavenumber, values)
+        if wavenumber.size == 0:
+            return
+        w = self._response(wavenumber) * dv
+        self._sum += float(np.dot(w, values))
+        self._weight += float(w.sum())
+
+    def result(self) -> float:
+        return self._sum / self._weight if self._weight else np.nan
+
+
+class Mean(WeightedMean):
+    """Mean over fmin - fmax (uniform weight per cm^-1)."""
+    def __init__(self, fmin: float | None = None, fmax: float | None = None, transform=None):
+        super().__init__(lambda x: np.ones_like(x), fmin=fmin, fmax=fmax, transform=transform)
+
+
+def reduce_many(paths, reducers, max_workers: int | None = None) -> list:
+    """
+    fileio.reduce_tape12 for many files, read concurrently.
+
+    The reducers are copied for each file, so the same instances can be passed for all runs.
+
+    Returns
+    -------
+    list
+        One result per path, in the order of paths, each structured like reducers.
+    """
+    import copy
+    import concurrent.futures
+    from . import fileio
+
+    def work(path):
+        return fileio.reduce_tape12(path, copy.deepcopy(reducers))
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(work, paths))
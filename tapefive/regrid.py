@@ -0,0 +1,282 @@
+import collections
+import threading
+import numpy as np
+import xarray as xr
+
+_MODES = {'linear', 'binned'}
+
+
+class PanelGrid():
+    """
+    Piecewise uniform wavenumber grid as written by LBLRTM: panel i has n[i] samples starting at
+    v1[i] with spacing dv[i]. The samples of all panels are stored back to back, so the panel
+    layout describes a coordinate without materializing it.
+    """
+    __slots__ = ('v1', 'dv', 'n', 'offset', 'key')
+
+    def __init__(self, v1, dv, n):
+        self.v1 = np.atleast_1d(np.asarray(v1, dtype=np.float64))
+        self.dv = np.atleast_1d(np.asarray(dv, dtype=np.float64))
+        self.n = np.atleast_1d(np.asarray(n, dtype=np.int64))
+        if not (self.v1.size == self.dv.size == self.n.size):
+            raise ValueError("v1, dv and n must have the same length")
+        if np.any(self.n < 1) or np.any(self.dv <= 0):
+            raise ValueError("panels need at least one sample and dv > 0")
+        self.offset = np.concatenate([[0], np.cumsum(self.n)[:-1]])
+        self.key = ('panels', self.v1.tobytes(), self.dv.tobytes(), self.n.tobytes())
+
+    def __repr__(self) -> str:
+        return f"PanelGrid(panels={self.v1.size}, size={self.size}, v1={self.v1[0]}, v2={self.last})"
+
+    @property
+    def size(self) -> int:
+        return int(self.n.sum())
+
+    @property
+    def last(self) -> float:
+        return float(self.v1[-1] + (self.n[-1] - 1) * self.dv[-1])
+
+    @classmethod
+    def from_coordinate(cls, wn, rtol: float = 1e-4) -> 'PanelGrid':
+        """Split a wavenumber coordinate into uniform panels (used if the panel layout is unknown)."""
+        wn = np.asarray(wn, dtype=np.float64)
+        if wn.size < 2:
+            return cls(wn[:1], [1.0], [wn.size])
+        d = np.diff(wn)
+        # a new panel starts where the spacing changes
+        change = np.flatnonzero(~np.isclose(d[1:], d[:-1], rtol=rtol, atol=0)) + 1
+        starts = np.concatenate([[0], change + 1])
+        starts = starts[starts < wn.size]
+        ends = np.concatenate([starts[1:], [wn.size]])
+        dv = np.array([d[s] if s < d.size else d[-1] for s in starts])
+        return cls(wn[starts], dv, ends - starts)
+
+    @classmethod
+    def from_dataset(cls, ds: xr.Dataset) -> 'PanelGrid':
+        """Panel layout of a dataset from fileio.read_tape12 (attrs panel_v1/dv/n) or of its coordinate."""
+        attrs = ds.attrs
+        if {'panel_v1', 'panel_dv', 'panel_n'} <= set(attrs):
+            grid = cls(attrs['panel_v1'], attrs['panel_dv'], attrs['panel_n'])
+            if grid.size == ds.sizes['wavenumber']:
+                return grid
+        return cls.from_coordinate(ds.wavenumber.values)
+
+    def coordinate(self) -> np.ndarray:
+        """The full wavenumber coordinate."""
+        return np.concatenate([v1 + np.arange(n) * dv for v1, dv, n in zip(self.v1, self.dv, self.n)])
+
+    def _panel(self, x, starts):
+        return np.clip(np.searchsorted(starts, x, side='right') - 1, 0, self.v1.size - 1)
+
+    def linear_weights(self, x):
+        """Flat index k of the sample at or left of x and the fraction towards sample k + 1."""
+        x = np.asarray(x, dtype=np.float64)
+        p = self._panel(x, self.v1)
+        i = np.clip(np.floor((x - self.v1[p]) / self.dv[p]).astype(np.int64), 0, self.n[p] - 1)
+        k = self.offset[p] + i
+        x_left = self.v1[p] + i * self.dv[p]
+        last_in_panel = i == self.n[p] - 1
+        # the right neighbour of the last sample of a panel is the first sample of the next panel
+        nxt = np.minimum(p + 1, self.v1.size - 1)
+        x_right = np.where(last_in_panel, self.v1[nxt], x_left + self.dv[p])
+        width = x_right - x_left
+        frac = np.where(width > 0, (x - x_left) / np.where(width > 0, width, 1), 0.0)
+        valid = (x >= self.v1[0]) & (x <= self.last)
+        frac = np.clip(frac, 0, 1)
+        if self.size > 1:
+            # the last sample has no right neighbour; it is the right end of the last interval
+            at_end = k > self.size - 2
+            k = np.where(at_end, self.size - 2, k)
+            frac = np.where(at_end, 1.0, frac)
+        else:
+            k = np.zeros_like(k)
+        return k, frac, valid
+
+    def cell_widths(self):
+        """Width of the first and of the last cell of each panel.
+
+        Cells tile the coordinate: interior cells are sample +- dv/2, at a panel border the cells
+        meet halfway between the last sample of one panel and the first of the next."""
+        last = self.v1 + (self.n - 1) * self.dv
+        gap_left = np.concatenate([[self.dv[0]], self.v1[1:] - last[:-1]])
+        gap_right = np.concatenate([self.v1[1:] - last[:-1], [self.dv[-1]]])
+        return (self.dv + gap_left) / 2, (self.dv + gap_right) / 2, gap_left
+
+    def cell_weights(self, x):
+        """Panel and flat index of the cell containing x and the offset of x from the lower cell edge."""
+        x = np.asarray(x, dtype=np.float64)
+        w_first, w_last, gap_left = self.cell_widths()
+        panel_lo = self.v1 - gap_left / 2
+        p = self._panel(x, panel_lo)
+        i = np.clip(np.floor((x - (self.v1[p] - self.dv[p] / 2)) / self.dv[p]).astype(np.int64), 0, self.n[p] - 1)
+        first = i == 0
+        lower = np.where(first, panel_lo[p], self.v1[p] + (i - 0.5) * self.dv[p])
+        width = np.where(i == self.n[p] - 1, w_last[p], self.dv[p])
+        width = np.where(first, np.where(self.n[p] == 1, w_first[p] + w_last[p] - self.dv[p], w_first[p]), width)
+        off = np.clip(x - lower, 0, width)
+        tol = 1e-9 * self.dv.min()
+        valid = (x >= panel_lo[0] - tol) & (x <= self.last + self.dv[-1] / 2 + tol)
+        return p, self.offset[p] + i, off, valid
+
+
+def values_on_grid(ds: xr.Dataset, var: str, wn: np.ndarray) -> np.ndarray:
+    """Values of ds[var] on the wavenumbers wn, interpolated linearly if ds has a different grid
+    (NaN outside its coverage). The grids count as the same if every wavenumber agrees to
+    1e-6 cm^-1, as in fileio.read_many; a relative tolerance would pass grids shifted by samples."""
+    if ds.sizes['wavenumber'] == wn.size and np.allclose(ds.wavenumber.values, wn, rtol=0, atol=1e-6):
+        return ds[var].values
+    return np.interp(wn, ds.wavenumber.values, ds[var].values, left=np.nan, right=np.nan)
+
+
+def _target_coordinate(target):
+    if isinstance(target, PanelGrid):
+        return target.coordinate()
+    if isinstance(target, (xr.Dataset, xr.DataArray)):
+        return np.asarray(target.wavenumber.values, dtype=np.float64)
+    return np.asarray(target, dtype=np.float64)
+
+
+def _target_key(x):
+    return ('target', x.size, float(x[0]), float(x[-1]), hash(x.tobytes()))
+
+
+def _bin_edges(x):
+    if x.size < 2:
+        raise ValueError("binned mode needs at least two target wavenumbers")
+    mid = (x[1:] + x[:-1]) / 2
+    return np.concatenate([[x[0] - (mid[0] - x[0])], mid, [x[-1] + (x[-1] - mid[-1])]])
+
+
+class _WeightCache():
+    """LRU cache of interpolation weights per (source grid, target grid, mode)."""
+    def __init__(self, maxsize: int = 64):
+        self.maxsize = maxsize
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, compute):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+        value = compute()
+        with self._lock:
+            self._data[key] = value
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+
+
+_weight_cache = _WeightCache()
+
+
+def cache_info() -> dict:
+    """Hit/miss statistics of the weight cache."""
+    return dict(hits=_weight_cache.hits, misses=_weight_cache.misses, entries=len(_weight_cache._data),
+                maxsize=_weight_cache.maxsize)
+
+
+def cache_clear() -> None:
+    _weight_cache.clear()
+
+
+class Regridder():
+    """
+    Map many spectra onto a common wavenumber grid.
+
+    Spectra that share a source grid are regridded together in one vectorized pass; the weights
+    for each (source grid, target grid) pair are computed once and cached.
+
+    Parameters
+    ----------
+    target : array-like, PanelGrid or xr.Dataset
+        Target wavenumbers (bin centers in binned mode).
+    mode : str
+        'linear': linear interpolation between neighbouring samples, also across panel borders.
+        'binned': flux-conserving average of the source over each target bin, the source
+        samples being cells of width dv. Use this when going to a coarser grid.
+    """
+    def __init__(self, target, mode: str = 'linear'):
+        if mode not in _MODES:
+            raise ValueError(f"mode must be one of {_MODES}")
+        self.mode = mode
+        self.target = _target_coordinate(target)
+        self._target_key = _target_key(self.target)
+
+    def weights(self, source: PanelGrid):
+        key = (source.key, self._target_key, self.mode)
+        return _weight_cache.get(key, lambda: self._compute_weights(source))
+
+    def _compute_weights(self, source):
+        if self.mode == 'linear':
+            return source.linear_weights(self.target)
+        edges = _bin_edges(self.target)
+        p, k, off, valid = source.cell_weights(edges)
+        return p, k, off, valid[:-1] & valid[1:], np.diff(edges)
+
+    def apply(self, source: PanelGrid, values: np.ndarray) -> np.ndarray:
+        """Regrid values with shape (..., source.size) to (..., target.size)."""
+        values = np.asarray(values)
+        if values.shape[-1] != source.size:
+            raise ValueError(f"values have {values.shape[-1]} samples, the source grid {source.size}")
+        if self.mode == 'linear':
+            k, frac, valid = self.weights(source)
+            out = values[..., k] * (1 - frac) + values[..., np.minimum(k + 1, source.size - 1)] * frac
+            return np.where(valid, out, np.nan)
+
+        p, k, off, valid, width = self.weights(source)
+        # integral of the piecewise constant source up to the lower edge of each cell: inside a
+        # panel all cells have width dv, only the first and the last cell differ
+        w_first, w_last, _ = source.cell_widths()
+        end = source.offset + source.n - 1
+        cs = np.cumsum(values, axis=-1, dtype=np.float64)
+        cs = np.concatenate([np.zeros(values.shape[:-1] + (1,)), cs], axis=-1)   # cs[..., j] = sum of v[:j]
+        c_first = values[..., source.offset] * (w_first - source.dv)
+        c_last = values[..., end] * (w_last - source.dv)
+        panel_total = (cs[..., end + 1] - cs[..., source.offset]) * source.dv + c_first + c_last
+        panel_base = np.concatenate([np.zeros(values.shape[:-1] + (1,)), np.cumsum(panel_total, axis=-1)[..., :-1]], axis=-1)
+        integral = (panel_base[..., p]
+                    + source.dv[p] * (cs[..., k] - cs[..., source.offset[p]])
+                    + np.where(k > source.offset[p], c_first[..., p], 0.0)
+                    + values[..., k] * off)
+        out = np.diff(integral, axis=-1) / width
+        return np.where(valid, out, np.nan)
+
+    def __call__(self, spectra, var_name: str = 'optical_depth') -> xr.Dataset:
+        """
+        Regrid a sequence of datasets from fileio.read_tape12 and stack them along a run dimension.
+
+        Returns
+        -------
+        xr.Dataset
+            var_name with dimensions (run, wavenumber); samples outside the source coverage are NaN.
+        """
+        spectra = list(spectra)
+        groups = collections.OrderedDict()
+        for i, ds in enumerate(spectra):
+            grid = PanelGrid.from_dataset(ds)
+            groups.setdefault(grid.key, (grid, []))[1].append(i)
+
+        out = np.empty((len(spectra), self.target.size), dtype=np.float64)
+        for grid, members in groups.values():
+            stacked = np.stack([np.asarray(spectra[i][var_name].values) for i in members])
+            out[members] = self.apply(grid, stacked)
+
+        attrs = dict(spectra[0][var_name].attrs) if spectra else {}
+        return xr.Dataset({var_name: (('run', 'wavenumber'), out, attrs)},
+                          coords={'run': np.arange(len(spectra)), 'wavenumber': ('wavenumber', self.target)},
+                          attrs={'regrid_mode': self.mode, 'source_grids': len(groups)})
+
+
+def regrid(spectra, target, mode: str = 'linear', var_name: str = 'optical_depth') -> xr.Dataset:
+    """Regrid datasets from fileio.read_tape12 onto target and stack them, see Regridder."""
+    return Regridder(target, mode=mode)(spectra, var_name=var_name)
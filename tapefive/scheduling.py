@@ -0,0 +1,240 @@
+import os
+import json
+import time
+import threading
+import concurrent.futures
+import pathlib as pl
+from dataclasses import dataclass
+import numpy as np
+from . import lab
+
+FEATURES = ('intercept', 'log_span', 'log_df', 'exact', 'exact_log_df', 'log_molecules', 'log_layers')
+# prior for log(runtime): proportional to spectral range, molecules and layers; finer sampling
+# (larger SAMPLE, smaller DVOUT) costs more
+PRIOR_RUNTIME = np.array([np.log(2e-4), 1.0, 1.0, 0.0, -2.0, 1.0, 1.0])
+# prior for log(TAPE12 bytes)
+PRIOR_OUTPUT = np.array([np.log(4e3), 1.0, 1.0, 0.0, -2.0, 0.0, 0.0])
+# the intercept is learned quickly, the exponents only move with enough evidence
+PRIOR_STRENGTH = np.array([1e-3, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0])
+# peak memory of a run (LBLRTM panels, reading TAPE12 into float64) relative to the TAPE12 size
+MEMORY_PER_OUTPUT_BYTE = 6.0
+
+
+def features(lblrtm: 'lab.Lblrtm') -> np.ndarray:
+    """Feature vector (see FEATURES) of a configuration for the cost model."""
+    config = lblrtm.configuration
+    grid = config.spectral_grid
+    span = grid.fmax - grid.fmin + 50     # including the 25 cm^-1 buffers
+    df = max(float(grid.df or 1), 1e-6)
+    exact = float(grid.layering_control == 'exact')
+    molecules = sum(m.enable for m in config.molecular_spectral_lines.molecules)
+    layers = len(lblrtm.tape5.layer_boundaries) - 1
+    return np.array([1.0, np.log(span), np.log(df), exact, exact * np.log(df), np.log(molecules + 1), np.log(max(layers, 1))])
+
+
+@dataclass
+class Estimate:
+    seconds: float
+    memory: float   # bytes
+
+
+class CostModel():
+    """
+    Runtime and memory model of LBLRTM runs, fitted online from completed runs.
+
+    log(runtime) and log(TAPE12 size) are linear in the log of the spectral range, df, number of
+    molecules and layers (see FEATURES). The fit is a ridge regression towards a prior that
+    scales the runtime with range x molecules x layers, so the model is usable before the first
+    observation and the exponents only move away from the prior with enough data. Observations
+    are kept as sufficient statistics, so update is O(1) and the model can be saved as JSON.
+
+    Parameters
+    ----------
+    path : str or Path, optional
+        JSON file the model is loaded from (if it exists) and saved to after every update.
+    """
+    def __init__(self, path: str | pl.Path | None = None):
+        self.path = None if isinstance(path, type(None)) else pl.Path(path)
+        k = len(FEATURES)
+        self._xtx = np.zeros((k, k))
+        self._xty = np.zeros((2, k))
+        self.n = 0
+        self._lock = threading.Lock()
+        self._weights = None
+        if not isinstance(self.path, type(None)) and self.path.exists():
+            d = json.loads(self.path.read_text())
+            self._xtx = np.array(d['xtx'])
+            self._xty = np.array(d['xty'])
+            self.n = d['n']
+
+    def _solve(self):
+        # the caller holds self._lock
+        weights = self._weights
+        if isinstance(weights, type(None)):
+            a = self._xtx + np.diag(PRIOR_STRENGTH)
+            b = self._xty + PRIOR_STRENGTH * np.vstack([PRIOR_RUNTIME, PRIOR_OUTPUT])
+            weights = np.linalg.solve(a, b.T).T
+            self._weights = weights
+        return weights
+
+    def _fit(self):
+        # update runs concurrently from the workers of run_batch
+        with self._lock:
+            return self._solve()
+
+    def predict(self, lblrtm: 'lab.Lblrtm') -> Estimate:
+        w = self._fit()
+        x = features(lblrtm)
+        return Estimate(seconds=float(np.exp(w[0] @ x)), memory=float(MEMORY_PER_OUTPUT_BYTE * np.exp(w[1] @ x)))
+
+    def update(self, lblrtm: 'lab.Lblrtm', seconds: float, output_bytes: float | None = None) -> None:
+        """Add the observed runtime (and TAPE12 size) of a completed run."""
+        x = features(lblrtm)
+        with self._lock:
+            if isinstance(output_bytes, type(None)):
+                output_bytes = np.exp(self._solve()[1] @ x)
+            self._xtx += np.outer(x, x)
+            self._xty += np.outer([np.log(max(seconds, 1e-3)), np.log(max(output_bytes, 1))], x)
+            self.n += 1
+            self._weights = None
+            if not isinstance(self.path, type(None)):
+                self.save()
+
+    def observe(self, lblrtm: 'lab.Lblrtm') -> None:
+        """update from the timings and TAPE12 of a run that just executed. Runs that reused the
+        outputs of their run directory instead of running LBLRTM (see stages.plan) are ignored."""
+        from . import stages
+        if not stages.ran_lblrtm(lblrtm):
+            return
+        p2f_tape12 = lblrtm._filesystem['p2fld_run_lblrtm'].joinpath('TAPE12')
+        size = p2f_tape12.stat().st_size if p2f_tape12.exists() else None
+        self.update(lblrtm, lblrtm.timings.get('lnfl', 0) + lblrtm.timings.get('lblrtm', 0), size)
+
+    def save(self, path: str | pl.Path | None = None) -> None:
+        path = pl.Path(path or self.path)
+        tmp = path.with_name(f'.{path.name}.tmp{os.getpid()}')
+        tmp.write_text(json.dumps(dict(features=FEATURES, xtx=self._xtx.tolist(), xty=self._xty.tolist(), n=self.n)))
+        os.replace(tmp, path)
+
+    @property
+    def coefficients(self) -> dict:
+        """Fitted exponents of the runtime model by feature."""
+        return dict(zip(FEATURES, self._fit()[0].tolist()))
+
+
+def longest_first(lblrtms, model: CostModel) -> list:
+    """Indices of lblrtms ordered by decreasing predicted runtime."""
+    seconds = [model.predict(r).seconds for r in lblrtms]
+    return sorted(range(len(seconds)), key=lambda i: -seconds[i])
+
+
+def plan(lblrtms, n_workers: int, model: CostModel) -> list:
+    """
+    Static longest-processing-time-first assignment of runs to n_workers.
+
+    Returns
+    -------
+    list
+        Per worker the list of indices into lblrtms; the predicted makespan is the largest sum
+        of predicted runtimes of a worker.
+    """
+    loads = np.zeros(n_workers)
+    bins = [[] for _ in range(n_workers)]
+    for i in longest_first(lblrtms, model):
+        w = int(np.argmin(loads))
+        bins[w].append(i)
+        loads[w] += model.predict(lblrtms[i]).seconds
+    return bins
+
+
+def run_batch(lblrtms, max_workers: int | None = None, memory_limit: float | None = None,
+              model: CostModel | None = None, progress_callback=None, load: bool = True,
+              verbose: bool = False) -> list:
+    """
+    Run many Lblrtm instances, longest predicted runtime first, within a memory limit.
+
+    Runs are dispatched dynamically to max_workers threads: whenever a worker is free the
+    longest remaining run whose predicted memory fits into what is left of memory_limit is
+    started (a run larger than the limit is started alone). Each completed run updates the cost
+    model, which refines the predictions for the rest of the batch and the ETA.
+
+    Parameters
+    ----------
+    memory_limit : float, optional
+        Bytes that the concurrently executing runs may use together.
+    model : CostModel, optional
+        Defaults to a model kept in project_directory/.cost_model.json of the first run.
+    progress_callback : callable, optional
+        Called after every completed run with a dict(done, total, elapsed, eta, index, failed).
+
+    Returns
+    -------
+    list
+        Results (run directories if load is False) in the order of lblrtms. A run that raised
+        is represented by its exception; it does not stop the other runs and is not added to
+        the cost model.
+    """
+    lblrtms = list(lblrtms)
+    if not lblrtms:
+        return []
+    max_workers = max_workers or os.cpu_count() or 1
+    if isinstance(model, type(None)):
+        model = CostModel(lblrtms[0].configuration.environment.project_directory.joinpath('.cost_model.json'))
+    pending = longest_first(lblrtms, model)
+    estimates = {i: model.predict(lblrtms[i]) for i in pending}
+    outputs = [None] * len(lblrtms)
+    running = {}
+    start = time.monotonic()
+    memory_in_use = 0.0
+
+    def job(i):
+        t0 = time.monotonic()
+        p2fld = lblrtms[i].execute()
+        model.observe(lblrtms[i])
+        return p2fld, t0
+
+    def eta():
+        now = time.monotonic()
+        remaining = sum(model.predict(lblrtms[i]).seconds for i in pending)
+        remaining += sum(max(model.predict(lblrtms[i]).seconds - (now - t0), 0) for i, t0 in running.values())
+        return remaining / max_workers
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as pool:
+        while pending or running:
+            while pending and len(running) < max_workers:
+                fits = [i for i in pending if isinstance(memory_limit, type(None))
+                        or memory_in_use + estimates[i].memory <= memory_limit]
+                if not fits:
+                    if running:
+                        break
+                    fits = pending[:1]      # too large for the limit, run it alone
+                i = fits[0]
+                pending.remove(i)
+                memory_in_use += estimates[i].memory
+                running[pool.submit(job, i)] = (i, time.monotonic())
+            done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                i, _ = running.pop(future)
+                memory_in_use -= estimates[i].memory
+                try:
+                    outputs[i] = future.result()[0]
+                except Exception as e:
+                    # keep going, the caller gets the other results and the exception of this run
+                    outputs[i] = e
+                    if verbose:
+                        print(f"Run {i} failed: {type(e).__name__}: {e}")
+                info = dict(done=sum(not isinstance(o, type(None)) for o in outputs), total=len(lblrtms),
+                            elapsed=time.monotonic() - start, eta=eta(), index=i,
+                            failed=sum(isinstance(o, Exception) for o in outputs))
+                if verbose:
+                    print(f"{info['done']}/{info['total']} runs done, {info['elapsed']:.0f} s elapsed, ETA {info['eta']:.0f} s")
+                if progress_callback:
+                    progress_callback(info)
+            # later runs are predicted with the updated model
+            estimates.update({i: model.predict(lblrtms[i]) for i in pending})
+            pending.sort(key=lambda i: -estimates[i].seconds)
+
+    if not load:
+        return outputs
+    return [p if isinstance(p, Exception) else lab.Results(p, configuration=r.configuration.to_dict(), timings=dict(r.timings))
+            for p, r in zip(outputs, lblrtms)]
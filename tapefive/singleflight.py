@@ -0,0 +1,100 @@
+import os
+import json
+import time
+import fcntl
+import threading
+import concurrent.futures
+import pathlib as pl
+from . import lab
+from . import fileio
+
+# in-process: fingerprint -> Future of the run that is executing it
+_inflight = {}
+_lock = threading.Lock()
+
+
+def _paths(lblrtm, fp):
+    base = lblrtm.configuration.environment.project_directory.joinpath('.singleflight')
+    base.mkdir(parents=True, exist_ok=True)
+    return base.joinpath(f'{fp}.lock'), base.joinpath(f'{fp}.json')
+
+
+def _shared_result(lblrtm, registry, since):
+    """Results of an identical run finished by another process after since, None if there is none."""
+    try:
+        entry = json.loads(registry.read_text())
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    if entry['finished'] < since:
+        return None
+    p2fld = pl.Path(entry['path'])
+    p2f_tape5 = p2fld.joinpath('TAPE5')
+    # the directory might have been reused for another configuration since
+    if not p2f_tape5.exists() or p2f_tape5.read_text() != lblrtm.tape5.tape5:
+        return None
+    if not fileio.validate_tape12(p2fld.joinpath('TAPE12')):
+        return None
+    return lab.Results(p2fld, configuration=lblrtm.configuration.to_dict(), timings=entry.get('timings'))
+
+
+def _run_exclusive(lblrtm, fp, since, **kwargs):
+    lock_path, registry = _paths(lblrtm, fp)
+    with open(lock_path, 'w') as lock:
+        # blocks while another process runs the same configuration
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            result = _shared_result(lblrtm, registry, since)
+            if not isinstance(result, type(None)):
+                if lblrtm._verbose:
+                    print(f"Sharing the results of an identical run in {result.path2result_dir}")
+                return result
+            result = lblrtm.run(**kwargs)
+            tmp = registry.with_name(f'.{registry.name}.tmp{os.getpid()}')
+            tmp.write_text(json.dumps(dict(path=str(result.path2result_dir), finished=time.time(),
+                                           timings=result.timings, pid=os.getpid())))
+            os.replace(tmp, registry)
+            return result
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def run(lblrtm: 'lab.Lblrtm', **kwargs) -> 'lab.Results':
+    """
+    Lblrtm.run, coalesced with identical runs that are executing at the same time.
+
+    Runs are identical if their Lblrtm.fingerprint (TAPE5s and line data) is the same. Within a
+    process, concurrent callers wait for the first one and get the same Results object. Across
+    processes that share the project directory, a file lock in project_directory/.singleflight
+    serializes identical runs; a process that had to wait uses the results of the run that
+    finished while it was waiting instead of running LBLRTM again. Results are only shared
+    between runs that overlap in time, this is not a cache.
+
+    Parameters
+    ----------
+    kwargs
+        Passed to Lblrtm.run by the caller that executes the run.
+    """
+    since = time.time()
+    fp = lblrtm.fingerprint
+    with _lock:
+        future = _inflight.get(fp)
+        leader = isinstance(future, type(None))
+        if leader:
+            future = concurrent.futures.Future()
+            _inflight[fp] = future
+    if not leader:
+        if lblrtm._verbose:
+            print(f"Waiting for an identical run ({fp[:12]})")
+        return future.result()
+
+    try:
+        result = _run_exclusive(lblrtm, fp, since, **kwargs)
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    else:
+        future.set_result(result)
+    finally:
+        with _lock:
+            _inflight.pop(fp, None)
+    return result
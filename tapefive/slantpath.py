@@ -0,0 +1,184 @@
+import numpy as np
+import xarray as xr
+from . import lab
+from . import regrid
+
+EARTH_RADIUS_KM = 6371.23
+# refractivity (n - 1) at the surface in the near infrared and its scale height
+SURFACE_REFRACTIVITY = 2.77e-4
+REFRACTIVITY_SCALE_HEIGHT_KM = 8.0
+
+
+def airmass_factors(boundaries, zenith_angles, refraction: bool = False,
+                    earth_radius: float = EARTH_RADIUS_KM, substeps: int = 64) -> np.ndarray:
+    """
+    Per-layer airmass factors (slant path length / vertical thickness) for spherical shells.
+
+    Parameters
+    ----------
+    boundaries : array-like
+        Layer boundaries in km, increasing. The path starts at boundaries[0] and goes to space.
+    zenith_angles : array-like
+        Zenith angles at boundaries[0] in degree, 0 - 90.
+    refraction : bool
+        Bend the path with an exponential refractivity profile (SURFACE_REFRACTIVITY,
+        REFRACTIVITY_SCALE_HEIGHT_KM) by keeping n (R + z) sin(theta) constant.
+    earth_radius : float
+        Earth radius in km.
+    substeps : int
+        Integration steps per layer when refraction is True.
+
+    Returns
+    -------
+    numpy.ndarray
+        Shape (angle, layer).
+    """
+    z = np.asarray(boundaries, dtype=float)
+    theta = np.radians(np.atleast_1d(np.asarray(zenith_angles, dtype=float)))
+    if np.any(theta < 0) or np.any(theta > np.pi / 2):
+        raise ValueError("zenith angles need to be between 0 and 90 degree")
+    thickness = np.diff(z)
+    r = earth_radius + z
+
+    if not refraction:
+        b = (r[0] * np.sin(theta))[:, None]                           # impact parameter
+        s = np.sqrt(np.clip(r[None, :] ** 2 - b ** 2, 0, None))      # distance along the path to the tangent point
+        return np.diff(s, axis=1) / thickness
+
+    def n(zz):
+        return 1 + SURFACE_REFRACTIVITY * np.exp(-(zz - z[0]) / REFRACTIVITY_SCALE_HEIGHT_KM)
+
+    # sub-levels inside each layer, midpoints of the sub-steps: (layer, substep)
+    frac = (np.arange(substeps) + 0.5) / substeps
+    zz = z[:-1, None] + thickness[:, None] * frac[None, :]
+    b = (n(z[0]) * r[0] * np.sin(theta))[:, None, None]
+    sin_t = np.clip(b / (n(zz) * (earth_radius + zz))[None], 0, 1 - 1e-12)
+    # ds = dz / cos(theta(z)), midpoint rule; the singularity at 90 degree is integrable
+    ds = 1 / np.sqrt(1 - sin_t ** 2)
+    airmass = ds.mean(axis=-1)
+    return airmass
+
+
+class SlantPathScaling():
+    """
+    Approximate slant-path spectra from a single vertical run.
+
+    prepare runs LBLRTM once for the vertical path with output.merge_mode 'layers' and keeps
+    the optical depth of every layer. Spectra for arbitrary zenith angles are then
+
+        OD(theta) = sum_i airmass_i(theta) * OD_i(vertical)
+
+    evaluated for all angles in one matrix product. The approximation ignores that the absorber
+    is not uniformly distributed inside a layer and the change of the line shape with the path;
+    use validate to get error bounds against exact runs.
+
+    Examples
+    --------
+    >>> slant = SlantPathScaling(run)
+    >>> slant.validate([0, 60, 80])
+    >>> ds = slant.spectra(solar_zenith_angles)
+    """
+    def __init__(self, lblrtm: lab.Lblrtm, var_name: str = 'optical_depth', earth_radius: float = EARTH_RADIUS_KM,
+                 max_workers: int | None = None):
+        self.lblrtm = lblrtm
+        self.var_name = var_name
+        self.earth_radius = earth_radius
+        self.max_workers = max_workers
+        self.layer_optical_depth = None
+        self.validation = None
+        self._boundaries = None
+        self._cache_key = None
+
+    def _key(self):
+        # everything but the angle of the configuration
+        child = self.lblrtm.spawn('slant_path/vertical')
+        child.configuration.geometry.slant_angle = 0
+        return child.tape5.tape5
+
+    def prepare(self, force: bool = False) -> None:
+        """Run the vertical path once and read the layer optical depths. Skipped if the configuration is unchanged."""
+        key = self._key()
+        if not force and key == self._cache_key:
+            return
+        child = self.lblrtm.spawn('slant_path/vertical')
+        child.configuration.geometry.slant_angle = 0
+        child.configuration.output.merge_mode = 'layers'
+        self.lblrtm.prepare_tape3()
+        p2fld = child.execute()
+        layers = lab.read_layer_optical_depths(p2fld, var_name=self.var_name)
+        boundaries = child.tape5.layer_boundaries
+        if layers.sizes['layer'] != len(boundaries) - 1:
+            raise ValueError(f"Found {layers.sizes['layer']} layer files in {p2fld} but the TAPE5 defines {len(boundaries) - 1} layers.")
+        self.layer_optical_depth = layers
+        self._boundaries = boundaries
+        self._cache_key = key
+        self.validation = None
+
+    def spectra(self, zenith_angles, refraction: bool = False) -> xr.Dataset:
+        """
+        Optical depth and transmittance for the given zenith angles.
+
+        Returns
+        -------
+        xr.Dataset
+            optical_depth, transmittance and airmass_factor with dimension zenith_angle. If validate
+            was run, error_bound gives for each angle the maximum absolute transmittance error
+            found at the closest validated angle that is at least as large (NaN beyond the largest
+            validated angle).
+        """
+        self.prepare()
+        angles = np.atleast_1d(np.asarray(zenith_angles, dtype=float))
+        am = airmass_factors(self._boundaries, angles, refraction=refraction, earth_radius=self.earth_radius)
+        od = am @ self.layer_optical_depth[self.var_name].values
+        ds = xr.Dataset({self.var_name: (('zenith_angle', 'wavenumber'), od, {'long_name': self.var_name, 'units': '1'}),
+                         'transmittance': (('zenith_angle', 'wavenumber'), np.exp(-od), {'long_name': 'spectral transmittance', 'units': '1'}),
+                         'airmass_factor': (('zenith_angle', 'layer'), am, {'long_name': 'slant path length / layer thickness'})},
+                        coords={'zenith_angle': ('zenith_angle', angles, {'units': 'degree'}),
+                                'wavenumber': self.layer_optical_depth.wavenumber,
+                                'layer': self.layer_optical_depth.layer},
+                        attrs={'source': 'tapefive vertical optical depth scaled by layer airmass',
+                               'refraction': int(refraction),
+                               'layer_boundaries_km': self._boundaries})
+        if not isinstance(self.validation, type(None)) and bool(self.validation.attrs['refraction']) == refraction:
+            validated = self.validation.zenith_angle.values
+            errors = self.validation.max_abs_error_transmittance.values
+            idx = np.searchsorted(validated, angles, side='left')
+            bound = np.where(idx < validated.size, errors[np.clip(idx, 0, validated.size - 1)], np.nan)
+            ds = ds.assign_coords(error_bound=('zenith_angle', bound, {'long_name': 'max. abs. transmittance error from validation'}))
+        return ds
+
+    def validate(self, zenith_angles, refraction: bool = False) -> xr.Dataset:
+        """
+        Compare the approximation with exact LBLRTM runs (run concurrently) at the given angles.
+
+        Returns
+        -------
+        xr.Dataset
+            max_abs_error (optical depth), max_rel_error (optical depth) and
+            max_abs_error_transmittance by zenith_angle. Also kept in self.validation and used
+            for the error_bound of spectra.
+        """
+        angles = np.unique(np.atleast_1d(np.asarray(zenith_angles, dtype=float)))
+        approx = self.spectra(angles, refraction=refraction)
+        runs = []
+        for a in angles:
+            child = self.lblrtm.spawn(f'slant_path/exact_{a:g}')
+            child.configuration.geometry.slant_angle = float(a)
+            child.configuration.output.merge_mode = 'total'
+            runs.append(child)
+        results = lab.run_concurrently(runs, max_workers=self.max_workers)
+        wn = approx.wavenumber.values
+        abs_err, rel_err, t_err = [], [], []
+        for i, res in enumerate(results):
+            od_true = regrid.values_on_grid(res.data, self.var_name, wn)
+            od = approx[self.var_name].values[i]
+            significant = np.abs(od_true) > 1e-6
+            abs_err.append(np.nanmax(np.abs(od - od_true)))
+            rel_err.append(np.nanmax(np.abs(od - od_true)[significant] / np.abs(od_true[significant])) if significant.any() else 0.0)
+            t_err.append(np.nanmax(np.abs(np.exp(-od) - np.exp(-od_true))))
+        self.validation = xr.Dataset({'max_abs_error': ('zenith_angle', np.array(abs_err)),
+                                      'max_rel_error': ('zenith_angle', np.array(rel_err)),
+                                      'max_abs_error_transmittance': ('zenith_angle', np.array(t_err))},
+                                     coords={'zenith_angle': ('zenith_angle', angles, {'units': 'degree'})},
+                                     attrs={'refraction': int(refraction)})
+        return self.validation
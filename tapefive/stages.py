@@ -0,0 +1,195 @@
+import os
+import copy
+import json
+import types
+import hashlib
+import shutil
+import pathlib as pl
+import numpy as np
+from . import lab
+from . import fileio
+from . import tape5parser
+
+STATE_FILE = '.stages.json'
+# outputs of an LBLRTM run that are recreated by the downstream stage; the layer optical depth
+# files (lab.LAYER_OD_FILE_PATTERN) are the output of the line-by-line stage
+DOWNSTREAM_OUTPUTS = ('TAPE10', 'TAPE11', 'TAPE12', 'TAPE13', 'TAPE27')
+
+
+def _sha(*parts) -> str:
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(str(part).encode())
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+def _line_data_id(lblrtm: 'lab.Lblrtm') -> str:
+    if lblrtm.configuration.molecular_spectral_lines._lineshape_no == 0:
+        return ''      # no line-by-line calculation, no TAPE3
+    from . import index
+    return index.tape3_id(lblrtm.p2f_lblrtm_tape3_orig) or ''
+
+
+def line_by_line_tape5(lblrtm: 'lab.Lblrtm') -> str:
+    """The TAPE5 of the line-by-line stage: the configuration with every layer written to its own
+    optical depth file (merge_mode 'layers'), independent of the downstream options."""
+    config = copy.deepcopy(lblrtm.configuration)
+    config.output.merge_mode = 'layers'
+    return tape5parser.Tape5Generator(types.SimpleNamespace(configuration=config)).tape5
+
+
+def fingerprints(lblrtm: 'lab.Lblrtm') -> dict:
+    """
+    What each stage depends on.
+
+    line_by_line: the TAPE5 without the downstream options and the TAPE3.
+    output: the TAPE5 as configured and the TAPE3.
+    """
+    line_data = _line_data_id(lblrtm)
+    return {'line_by_line': _sha(tape5parser.normalize_tape5(line_by_line_tape5(lblrtm)), line_data),
+            'output': _sha(tape5parser.normalize_tape5(lblrtm.tape5.tape5), line_data)}
+
+
+def _layer_files(p2fld: pl.Path) -> list:
+    return sorted(p2fld.glob(lab.LAYER_OD_FILE_PATTERN))
+
+
+def _read_state(p2fld: pl.Path) -> dict:
+    try:
+        return json.loads(p2fld.joinpath(STATE_FILE).read_text())
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def _write_state(p2fld: pl.Path, state: dict) -> None:
+    p2f = p2fld.joinpath(STATE_FILE)
+    tmp = p2f.with_name(f'{STATE_FILE}.tmp{os.getpid()}')
+    tmp.write_text(json.dumps(state, indent=1))
+    os.replace(tmp, p2f)
+
+
+def _grid(path) -> list:
+    return [(p.v1, p.n, p.dv) for p in fileio.iter_tape12_panels(path, headers_only=True)]
+
+
+def common_grid(files) -> bool:
+    """True if all files have the same panels (as with layering_control 'exact', where every
+    layer is interpolated to DVOUT)."""
+    if not files:
+        return False
+    first = _grid(files[0])
+    return bool(first) and all(_grid(f) == first for f in files[1:])
+
+
+def merge_layers(p2fld: str | pl.Path, output: str = 'TAPE12') -> pl.Path:
+    """
+    Write the optical depth of the whole path, the sum of the layer optical depth files, to output.
+
+    The layers must share one grid (see common_grid). The file structure (records and panel
+    headers) is copied from the top layer file and the panel values are replaced by the sums, so
+    the result is read like a TAPE12 written by LBLRTM.
+    """
+    p2fld = pl.Path(p2fld)
+    files = _layer_files(p2fld)
+    if not common_grid(files):
+        raise ValueError(f"The layer optical depth files in {p2fld} are not on one grid")
+    p2f_out = p2fld.joinpath(output)
+    tmp = p2f_out.with_name(f'.{output}.tmp{os.getpid()}')
+    shutil.copyfile(files[-1], tmp)
+    with open(tmp, 'r+b') as f:
+        for panels in zip(*[fileio.iter_tape12_panels(p) for p in files]):
+            total = np.sum([p.values for p in panels], axis=0)
+            top = panels[-1]
+            f.seek(top.data_offset)
+            f.write(total.astype(f'{top.endian}f{top.itemsize}').tobytes())
+    os.replace(tmp, p2f_out)
+    return p2f_out
+
+
+def plan(lblrtm: 'lab.Lblrtm') -> str:
+    """
+    Which stages a run has to execute in its run directory.
+
+    Returns
+    -------
+    str
+        'none': the outputs of the same configuration are there and complete.
+        'downstream': only downstream options (merge mode) changed and the layer optical depth
+        files of the line-by-line stage are there; they are merged instead of running LBLRTM.
+        'full': line-by-line and downstream.
+    """
+    p2fld = lblrtm._filesystem['p2fld_run_lblrtm']
+    state = _read_state(p2fld)
+    if not state:
+        return 'full'
+    fp = fingerprints(lblrtm)
+    files = _layer_files(p2fld)
+    layers_ok = bool(files) and len(files) == state.get('layers')
+    if state.get('output') == fp['output']:
+        if lblrtm.configuration.output.merge_mode == 'layers' and layers_ok:
+            return 'none'
+        if lblrtm.configuration.output.merge_mode == 'total' and fileio.validate_tape12(p2fld.joinpath('TAPE12')):
+            return 'none'
+    if state.get('line_by_line') == fp['line_by_line'] and layers_ok and common_grid(files):
+        return 'downstream'
+    return 'full'
+
+
+def ran_lblrtm(lblrtm: 'lab.Lblrtm') -> bool:
+    """False if the last execute of lblrtm did not run LBLRTM (plan 'none' or 'downstream') and
+    reused the outputs in its run directory; its timings are then no LBLRTM runtimes."""
+    return lblrtm.stage not in ('none', 'downstream')
+
+
+def _remove(p2fld: pl.Path, names, verbose: bool = False) -> None:
+    for name in names:
+        p2f = p2fld.joinpath(name)
+        if p2f.exists():
+            if verbose:
+                print(f"Removing old result file {p2f}")
+            p2f.unlink()
+
+
+def execute(lblrtm: 'lab.Lblrtm', force_run: bool = False) -> int:
+    """
+    Run the stages that plan asks for (all of them with force_run) and record the fingerprints.
+
+    With output.keep_layers and layering_control 'exact', the line-by-line stage always writes
+    the layer optical depth files, and the downstream stage merges them into TAPE12. Later runs
+    in the same run directory that only change the merge mode skip LBLRTM.
+
+    Returns
+    -------
+    int
+        0 if the run succeeded, 1 if LBLRTM failed.
+    """
+    p2fld = lblrtm._filesystem['p2fld_run_lblrtm']
+    config = lblrtm.configuration
+    stage = 'full' if force_run else plan(lblrtm)
+    lblrtm.stage = stage
+    if lblrtm._verbose:
+        print(f"Stages to run: {stage}")
+    if stage == 'none':
+        return 0
+    fp = fingerprints(lblrtm)
+    merge = config.output.merge_mode == 'total'
+    if stage == 'full':
+        p2fld.joinpath(STATE_FILE).unlink(missing_ok=True)
+        lblrtm._remove_old_results()
+        keep = config.output.keep_layers and config.spectral_grid.layering_control == 'exact'
+        lblrtm._write_tape5(line_by_line_tape5(lblrtm) if keep else None)
+        out = lblrtm._execute_lblrtm()
+        if out != 0:
+            return out
+        merge = keep and merge
+    else:
+        _remove(p2fld, DOWNSTREAM_OUTPUTS, verbose=lblrtm._verbose)
+        merge = True    # TAPE12 holds the whole path also with merge_mode 'layers'
+    if merge:
+        merge_layers(p2fld)
+    lblrtm._write_tape5()
+    files = _layer_files(p2fld)
+    _write_state(p2fld, {'line_by_line': fp['line_by_line'] if files else None, 'output': fp['output'],
+                         'layers': len(files)})
+    return 0
@@ -1,6 +1,82 @@
 from . import tools
 import numpy as np
 
+# standard atmosphere layers in km
+STANDARD_LAYER_BOUNDARIES = np.array([0.0,
+                1.0,
+                2.0,
+                3.0,
+                4.0,
+                5.0,
+                6.0,
+                7.0,
+                8.0,
+                9.0,
+                10.0,
+                11.0,
+                20.0,
+                30.0,
+                50.0,
+                70.0,
+                80.0,
+                90.0,
+                100.0])
+
+# RECORD 3.5 JCHAR codes of user profile amounts, see AtmosphericProfile.units
+PROFILE_UNIT_CODES = {'ppmv': 'A',           # volume mixing ratio
+                      'cm-3': 'B',           # number density
+                      'g/kg': 'C',           # mass mixing ratio
+                      'g/m3': 'D',           # mass density
+                      'mb': 'E',             # partial pressure
+                      'dewpoint_k': 'F',     # H2O only
+                      'dewpoint_c': 'G',     # H2O only
+                      'rh': 'H',             # relative humidity in %, H2O only
+                      }
+
+
+def render_user_profiles(altitude, pressure, temperature, amounts, jchar, name: str = 'tapefive') -> list:
+    """
+    RECORD 3.4 - 3.6 (user defined atmospheric profile, MODEL = 0) for a stack of profiles.
+
+    All numbers of all profiles are formatted in one vectorized pass, only the final joining of
+    the lines is done per profile.
+
+    Parameters
+    ----------
+    altitude, pressure, temperature : array-like
+        (n_profile, n_level), km, mb and K.
+    amounts : array-like
+        (n_profile, n_level, n_mol), molecules in HITRAN order; entries of molecules taken from
+        a standard atmosphere (jchar '1' - '6') are ignored.
+    jchar : sequence of str
+        n_mol unit codes (RECORD 3.5 JCHAR), see PROFILE_UNIT_CODES.
+
+    Returns
+    -------
+    list of str
+        The records of each profile, starting with a newline like the other record properties.
+    """
+    altitude = np.atleast_2d(altitude)
+    amounts = np.asarray(amounts, dtype=float)
+    n_profile, n_level, n_mol = amounts.shape
+    # RECORD 3.5: ZM, PM, TM (3E10.3), 5X, JCHARP, JCHART (mb, K), 1X, JLONG (L: RECORD 3.6 in E15.8), 1X, JCHAR
+    flags = '     AA L ' + ''.join(jchar)
+    rec35 = np.char.add(np.char.add(np.char.add(np.char.mod('%10.3E', altitude), np.char.mod('%10.3E', pressure)),
+                                    np.char.mod('%10.3E', temperature)), flags)
+    # RECORD 3.6: VMOL(M), 8 per line (E15.8)
+    values = np.char.mod('%15.8E', amounts)
+    n_lines = -(-n_mol // 8)
+    values = np.concatenate([values, np.full((n_profile, n_level, n_lines * 8 - n_mol), '', dtype=values.dtype)], axis=-1)
+    values = values.reshape(n_profile, n_level, n_lines, 8)
+    rec36 = values[..., 0]
+    for k in range(1, 8):
+        rec36 = np.char.add(rec36, values[..., k])
+    level = rec35
+    for i in range(n_lines):
+        level = np.char.add(np.char.add(level, '\n'), rec36[..., i])
+    header = f"\n{n_level:5d}{name[:24]:24s}\n"
+    return [header + '\n'.join(row) for row in level.tolist()]
+
 class Tape5GeneratorLnfl():
     def __init__(self, lnflinst):
         self.configuration = lnflinst.lblrtm_config
@@ -18,16 +94,25 @@ class Tape5GeneratorLnfl():
         record1 = '$ TAPE5 LNFL INPUT file generated by tapefive.'
         return record1
     
+    @property
+    def _v1_v2(self):
+        # V1 and V2 as written to RECORD 2
+        V1 = self.configuration.spectral_grid.fmin - 25 # LBLRTM recommends a 25 cm^-1 buffer
+        V2 = self.configuration.spectral_grid.fmax + 25 # LBLRTM recommends a 25 cm^-1 buffer
+        return f'{V1:10.3E}', f'{V2:10.3E}'
+
+    @property
+    def range(self):
+        """(V1, V2) as LNFL reads them from RECORD 2, i.e. rounded to 4 significant digits."""
+        V1, V2 = self._v1_v2
+        return float(V1), float(V2)
+
     @property
     def record_2(self):
         # Record 2
-                #RECORD 1.3
         # if self.configuration.molecular_spectral_lines._lineshape_no > 0:
-        V1 = self.configuration.spectral_grid.fmin - 25 # LBLRTM recommends a 25 cm^-1 buffer
-        V1 = f'{V1:10.3E}'
-        V2 = self.configuration.spectral_grid.fmax + 25 # LBLRTM recommends a 25 cm^-1 buffer
-        V2 = f'{V2:10.3E}'
-       
+        V1, V2 = self._v1_v2
+
         vp = ((f'{V1}',10),
             (f'{V2}',20),
             )
@@ -62,13 +147,13 @@ class Tape5Generator():
         # RECORD 1.1 & RECORD 1.2
         tape5 = self.record_1 + '\n' + self.record_12
 
-        # RECORD 1.3
-        if self.configuration.molecular_spectral_lines._lineshape_no > 0: # TODO  (required if IHIRAC > 0; IAERSL > 0; IEMIT = 1; IATM = 1; or ILAS > 0; otherwise omit)
-            tape5 += '\n' + self.record_13
-            # RECORD 1.3a & 1.3b # which molecuels (a) and concentrations (b)
-            if 1:  # TODO (required if NMOL_SCAL > 0;  otherwise omit)
-                tape5 += '\n' + self.record_13a
-                tape5 += self.record_13b #requriered if 13a is present
+        # RECORD 1.3, required if IHIRAC > 0, IAERSL > 0, IEMIT = 1, IATM = 1 or ILAS > 0. RECORD 1.2
+        # always selects LBLATM (AM=1, IATM = 1), so it is always written, also with HI=0.
+        tape5 += '\n' + self.record_13
+        # RECORD 1.3a & 1.3b # which molecuels (a) and concentrations (b)
+        if 1:  # TODO (required if NMOL_SCAL > 0;  otherwise omit)
+            tape5 += '\n' + self.record_13a
+            tape5 += self.record_13b #requriered if 13a is present
         # TODO 0 RECORD 1.4    (required if IEMIT = 1, or both IEMIT=2 and IOTFLG=2; otherwise omit)
         # TODO 0 RECORD 1.5   (required for Analytic Jacobian calculation: IEMIT=3 and IMRG=40,41,42 or 43)
         # TODO 0 RECORD 1.6a    (required if IMRG = 35-36, 40-41, 45-46; otherwise omit)
@@ -87,9 +172,9 @@ class Tape5Generator():
             if 1:    # TODO For IBMAX > 0  (from RECORD 3.1)
                 tape5 += self.record_33b 
 
-        # TODO 0 User Defined Atmospheric Profile (MODEL = 0) RECORD 3.4
-        # TODO 0 RECORD 3.5
-        # TODO  RECORD 3.6.1 ... 3.6.N
+        # User Defined Atmospheric Profile (MODEL = 0) RECORD 3.4, 3.5 and 3.6.1 ... 3.6.N
+        if self.configuration.atmospheric_profile.enabled:
+            tape5 += self.record_34
         # TODO  RECORD 3.7
         # TODO  RECORD 3.7.1
         # TODO  RECORD 3.8
@@ -141,7 +226,7 @@ class Tape5Generator():
             ('PL=0', 40),
             ('TS=0', 45),
             ('AM=1', 50),#TODO configure
-            ('MG=0', 55),
+            (f'MG={self.configuration.output._merge_mode_options[self.configuration.output.merge_mode]}', 55),
             ('LA=0', 60),
             (f'OD={od}', 65), #TODO configure
             ('XS=0', 70),
@@ -332,12 +417,13 @@ class Tape5Generator():
     @property
     def record_31(self):
         # RECORD 3.1
-        vd =   {'MODEL' : 2, #TODO configure
+        profile = self.configuration.atmospheric_profile
+        vd =   {'MODEL' : 0 if profile.enabled else 2, #TODO configure the standard atmosphere
                 'ITYPE' : 2, #TODO configure
-                'IBMAX' : 19,#TODO configure
+                'IBMAX' : len(self.layer_boundaries),
                 'ZERO' : 0,
                 'NOPRNT' : 0,
-                'NMOL' : '',
+                'NMOL' : profile.nmol if profile.enabled else '',
                 'IPUNCH' : 1, #TODO configure
                 'IFXTYP' : '',
                 'MUNITS' : 0, #TODO configure this is the unit for the IPUNCH output above
@@ -357,8 +443,9 @@ class Tape5Generator():
     
     @property
     def record_32(self):
-        vd =   {'H1' : f"{0:10.3E}",
-        'H2' : f"{100:10.3E}",
+        boundaries = self.layer_boundaries
+        vd =   {'H1' : f"{boundaries[0]:10.3E}",
+        'H2' : f"{boundaries[-1]:10.3E}",
         'ANGLE' : f"{self.configuration.geometry.slant_angle:10.3E}",
         'RANGE' : '',
         'BETA' : '',
@@ -375,30 +462,30 @@ class Tape5Generator():
         record32 =  tools.place_in_string(val, pos)
         return record32
 
+    @property
+    def record_34(self):
+        # RECORD 3.4 - 3.6 of the user defined profile
+        return self.configuration.atmospheric_profile.records
+
+    @property
+    def layer_boundaries(self) -> np.ndarray:
+        """Layer boundaries in km written to RECORD 3.3b. With a user profile they must lie within
+        its altitude range, LBLATM does not extrapolate the profile."""
+        boundaries = self.configuration.atmospheric_layers.boundaries
+        profile = self.configuration.atmospheric_profile
+        if profile.enabled:
+            bottom, top = profile.altitude[0], profile.altitude[-1]
+            tol = 1e-6 * max(abs(top), 1)
+            if boundaries[0] < bottom - tol or boundaries[-1] > top + tol:
+                raise ValueError(f"The layer boundaries ({boundaries[0]:g} - {boundaries[-1]:g} km) must lie within "
+                                 f"the altitude range of the atmospheric profile ({bottom:g} - {top:g} km); "
+                                 f"set configuration.atmospheric_layers.boundaries")
+        return boundaries
+
     @property
     def record_33b(self):
         # RECORD 3.3b
-        # standard atmosphere layers in km
-        layers = np.array([0.0,
-                1.0,
-                2.0,
-                3.0,
-                4.0,
-                5.0,
-                6.0,
-                7.0,
-                8.0,
-                9.0,
-                10.0,
-                11.0,
-                20.0,
-                30.0,
-                50.0,
-                70.0,
-                80.0,
-                90.0,
-                100.0])
-
+        layers = self.layer_boundaries
 
         chunk_size = 8
 
@@ -411,6 +498,109 @@ class Tape5Generator():
         return record33b
 
 
-
-
-        
\ No newline at end of file
+def _field(line: str, start: int, end: int, kind=float, default=None):
+    """Value in the 1-based columns start-end of a fixed-format line, default if blank."""
+    txt = line[start - 1:end].split('=')[-1].strip()   # flags are written as e.g. MG=0
+    if not txt:
+        return default
+    if kind is int:
+        return int(float(txt))
+    return kind(txt)
+
+
+def normalize_tape5(text: str) -> str:
+    """TAPE5 without comment records ($ ...) and trailing blanks, for comparing TAPE5s."""
+    lines = [l.rstrip() for l in text.splitlines()]
+    return '\n'.join(l for l in lines if l and not l.startswith('$'))
+
+
+def parse_tape5(text: str) -> dict:
+    """
+    Parse an LBLRTM TAPE5 back into normalized parameters, the inverse of Tape5Generator.
+
+    Reads RECORD 1.2 (control flags), 1.3 (spectral range and sampling), 1.3a/b (molecule
+    scaling), 3.1 (atmosphere), 3.2 (path), 3.3b (layer boundaries) and 3.4 - 3.6 (user
+    profile). Records that follow are not interpreted. Works for hand-written TAPE5s as long as they follow the fixed format of
+    the LBLRTM instructions.
+
+    Returns
+    -------
+    dict
+        Keys: ihirac, ilblf4, icntnm, iaersl, iemit, iscan, ifiltr, iatm, imrg, iod, v1, v2,
+        sample, dvset, dvout, nmol_scal, molecule_scales ({HITRAN index: (unit code, value)}),
+        model, itype, ibmax, h1, h2, angle, layer_boundaries (list, km) and profile (dict of
+        altitude, pressure, temperature, jchar and amounts per level) when present.
+
+    Raises
+    ------
+    ValueError
+        If the text is not an LBLRTM TAPE5 (e.g. an LNFL TAPE5).
+    """
+    lines = [l.rstrip('\n') for l in text.splitlines()]
+    lines = [l for l in lines if not l.startswith('$')]
+    lines = [l for l in lines if not l.startswith('%')]
+    if not lines or 'HI=' not in lines[0] and len(lines[0]) < 50:
+        raise ValueError("Not an LBLRTM TAPE5: RECORD 1.2 not found")
+    rec = iter(lines)
+    r12 = next(rec).ljust(80)
+    names = ('ihirac', 'ilblf4', 'icntnm', 'iaersl', 'iemit', 'iscan', 'ifiltr', 'iplot', 'itest', 'iatm')
+    out = {name: _field(r12, 5 * i + 5, 5 * i + 5, int, 0) for i, name in enumerate(names)}
+    out['imrg'] = _field(r12, 54, 55, int, 0)
+    out['ilas'] = _field(r12, 60, 60, int, 0)
+    out['iod'] = _field(r12, 65, 65, int, 0)
+    out['ixsect'] = _field(r12, 70, 70, int, 0)
+
+    if out['ihirac'] > 0 or out['iaersl'] > 0 or out['iemit'] == 1 or out['iatm'] == 1 or out['ilas'] > 0:
+        r13 = next(rec).ljust(105)
+        for i, name in enumerate(('v1', 'v2', 'sample', 'dvset', 'alfal0', 'avmass', 'dptmin', 'dptfac')):
+            out[name] = _field(r13, 10 * i + 1, 10 * i + 10, float, 0.0)
+        out['ilnflg'] = _field(r13, 85, 85, int, 0)
+        out['dvout'] = _field(r13, 91, 100, float, 0.0)
+        out['nmol_scal'] = _field(r13, 104, 105, int, 0)
+        out['molecule_scales'] = {}
+        if out['nmol_scal'] > 0:
+            hmol = next(rec)
+            n = out['nmol_scal']
+            values = []
+            for _ in range(-(-n // 8)):     # 8 values per line, missing values are 0
+                line = next(rec)
+                values += [float(line[i:i + 15]) for i in range(0, len(line.rstrip()), 15)]
+            values += [0.0] * (n - len(values))
+            for i in range(n):
+                code = hmol[i] if i < len(hmol) else '0'
+                if code != '0':
+                    out['molecule_scales'][i + 1] = (code, values[i])
+
+    if out['iatm'] == 1:
+        r31 = next(rec).ljust(90)
+        for i, name in enumerate(('model', 'itype', 'ibmax', 'zero', 'noprnt', 'nmol', 'ipunch')):
+            out[name] = _field(r31, 5 * i + 1, 5 * i + 5, int, 0)
+        out['munits'] = _field(r31, 39, 40, int, 0)
+        if out['itype'] in (2, 3):
+            r32 = next(rec).ljust(70)
+            out['h1'] = _field(r32, 1, 10, float, 0.0)
+            out['h2'] = _field(r32, 11, 20, float, 0.0)
+            out['angle'] = _field(r32, 21, 30, float, 0.0)
+        if out['ibmax'] != 0:
+            boundaries = []
+            while len(boundaries) < abs(out['ibmax']):
+                line = next(rec)
+                boundaries += [float(line[i:i + 10]) for i in range(0, len(line.rstrip()), 10)]
+            out['layer_boundaries'] = boundaries[:abs(out['ibmax'])]
+        if out['model'] == 0:
+            immax = _field(next(rec), 1, 5, int, 0)
+            nmol = out['nmol'] or 7
+            profile = {'altitude': [], 'pressure': [], 'temperature': [], 'jchar': None, 'amounts': []}
+            for _ in range(abs(immax)):
+                r35 = next(rec).ljust(40 + nmol)
+                for i, name in enumerate(('altitude', 'pressure', 'temperature')):
+                    profile[name].append(_field(r35, 10 * i + 1, 10 * i + 10, float, 0.0))
+                profile['jchar'] = r35[40:40 + nmol]
+                width = 15 if r35[38] == 'L' else 10
+                values = []
+                for _ in range(-(-nmol // 8)):
+                    line = next(rec)
+                    values += [float(line[i:i + width]) for i in range(0, len(line.rstrip()), width)]
+                profile['amounts'].append(values + [0.0] * (nmol - len(values)))
+            out['profile'] = profile
+    return out
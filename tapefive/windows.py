@@ -0,0 +1,165 @@
+import numpy as np
+import xarray as xr
+from dataclasses import dataclass
+from . import lab
+from . import linefile
+from . import tools
+
+# LBLRTM computes 25 cm^-1 beyond each end of a run (see Tape5Generator.record_13), so two
+# windows closer than 2 x 25 cm^-1 are cheaper as one run
+LBLRTM_BUFFER = 25.0
+
+
+@dataclass
+class Window:
+    fmin: float
+    fmax: float
+    filters: tuple     # indices of the filters that need this window
+
+    @property
+    def width(self) -> float:
+        return self.fmax - self.fmin
+
+
+def _filter_arrays(filt, units):
+    """(wavenumber, response) of a filter, sorted by wavenumber."""
+    if isinstance(filt, xr.DataArray):
+        if 'wavenumber' in filt.coords:
+            x, units = filt.wavenumber.values, 'cm-1'
+        elif 'wavelength' in filt.coords:
+            x, units = filt.wavelength.values, 'nm'
+        else:
+            raise ValueError("A filter DataArray needs a wavenumber (cm^-1) or wavelength (nm) coordinate.")
+        y = filt.values
+    else:
+        x, y = filt
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    if units == 'nm':
+        x = tools.nm_to_inv_cm(x)
+    elif units != 'cm-1':
+        raise ValueError("units must be one of {'cm-1', 'nm'}")
+    order = np.argsort(x)
+    return x[order], y[order]
+
+
+def _bands(x, y, tolerance):
+    """Wavenumber ranges where the response exceeds tolerance x its maximum."""
+    if not np.any(y > 0):
+        return []
+    above = y > tolerance * y.max()
+    edges = np.flatnonzero(np.diff(np.concatenate([[0], above.astype(int), [0]])))
+    bands = []
+    for start, stop in zip(edges[::2], edges[1::2] - 1):
+        # include the neighbouring samples, the response crosses the threshold between them
+        bands.append((x[max(start - 1, 0)], x[min(stop + 1, x.size - 1)]))
+    return bands
+
+
+def plan_windows(filters, tolerance: float = 1e-3, margin: float = 0.0, merge_gap: float = 2 * LBLRTM_BUFFER,
+                 units: str = 'cm-1') -> list:
+    """
+    Smallest set of wavenumber windows that cover the filter responses.
+
+    Parameters
+    ----------
+    filters : sequence
+        Filter response functions, each a tuple (x, response) or an xr.DataArray with a
+        wavenumber (cm^-1) or wavelength (nm) coordinate. A filter can have several disjoint bands.
+    tolerance : float
+        Response below tolerance x the filter maximum is treated as zero.
+    margin : float
+        Extra cm^-1 added to both sides of each band (e.g. for the width of an instrument line
+        shape). The 25 cm^-1 buffer of LBLRTM is added by the TAPE5 anyway.
+    merge_gap : float
+        Windows closer than this (in cm^-1) are merged, because separate runs would compute the
+        buffer in between twice. The default is twice the LBLRTM buffer.
+    units : str
+        'cm-1' or 'nm', units of x for filters given as tuples.
+
+    Returns
+    -------
+    list of Window
+        Sorted by wavenumber, non-overlapping.
+    """
+    if isinstance(filters, xr.DataArray) or (isinstance(filters, tuple) and np.ndim(filters[0]) == 1
+                                               and not isinstance(filters[0], (tuple, list, xr.DataArray))):
+        filters = [filters]     # a single filter
+    intervals = []
+    for i, filt in enumerate(filters):
+        x, y = _filter_arrays(filt, units)
+        for lo, hi in _bands(x, y, tolerance):
+            intervals.append(Window(fmin=float(lo - margin), fmax=float(hi + margin), filters=(i,)))
+    if not intervals:
+        raise ValueError("No filter has a response above the tolerance.")
+    intervals.sort(key=lambda w: w.fmin)
+    merged = [intervals[0]]
+    for w in intervals[1:]:
+        last = merged[-1]
+        if w.fmin - last.fmax <= merge_gap:
+            merged[-1] = Window(fmin=last.fmin, fmax=max(last.fmax, w.fmax),
+                                filters=tuple(sorted(set(last.filters) | set(w.filters))))
+        else:
+            merged.append(w)
+    return merged
+
+
+def run_windows(lblrtm: 'lab.Lblrtm', windows, max_workers: int | None = None,
+                var_name: str = 'optical_depth', tape3: str = 'span') -> xr.Dataset:
+    """
+    Run only the given windows (child runs run_name/windows/<i>, concurrently) and join the results.
+
+    Parameters
+    ----------
+    tape3 : str
+        'span': one TAPE3 for the span of all windows, unless environment.tape3 is set.
+        'window': one compact TAPE3 per window. The lines of all windows are taken from the
+        linefile in one scan (see linefile.prepare_runs), so LNFL and the line reading of LBLRTM
+        only handle the lines of each window; better for windows far apart.
+
+    Returns
+    -------
+    xr.Dataset
+        The spectra of all windows concatenated along wavenumber (with gaps between the windows);
+        attrs window_fmin and window_fmax.
+    """
+    if tape3 not in ('span', 'window'):
+        raise ValueError("tape3 must be one of {'span', 'window'}")
+    if tape3 == 'window' and not isinstance(lblrtm.configuration.environment.tape3, type(None)):
+        raise ValueError("tape3='window' needs the linefile, environment.tape3 is set")
+    windows = sorted(windows, key=lambda w: w.fmin)
+    base = lblrtm.spawn('windows')
+    if isinstance(lblrtm.configuration.environment.tape3, type(None)):
+        base.configuration.environment.tape3 = None     # own TAPE3 for the span of the windows
+    grid = base.configuration.spectral_grid
+    grid.fmin = windows[0].fmin
+    grid.fmax = windows[-1].fmax
+    if tape3 == 'span':
+        base.prepare_tape3()
+
+    runs = []
+    for i, w in enumerate(windows):
+        child = base.spawn(f'{i}')
+        if tape3 == 'window':
+            child.configuration.environment.tape3 = None
+        child.configuration.spectral_grid.fmin = w.fmin
+        child.configuration.spectral_grid.fmax = w.fmax
+        runs.append(child)
+    if tape3 == 'window':
+        linefile.prepare_runs(runs, verbose=lblrtm._verbose)
+    results = lab.run_concurrently(runs, max_workers=max_workers)
+
+    parts = [r.data.sel(wavenumber=slice(w.fmin, w.fmax)) for r, w in zip(results, windows)]
+    out = xr.concat([p[[var_name]] for p in parts], dim='wavenumber')
+    out.attrs = {'source': 'tapefive spectral windows',
+                 'window_fmin': np.array([w.fmin for w in windows]),
+                 'window_fmax': np.array([w.fmax for w in windows])}
+    return out
+
+
+def run_filtered(lblrtm: 'lab.Lblrtm', filters, tolerance: float = 1e-3, margin: float = 0.0,
+                 units: str = 'cm-1', max_workers: int | None = None, var_name: str = 'optical_depth',
+                 tape3: str = 'span') -> xr.Dataset:
+    """plan_windows for the filters and run_windows; the spectral_grid range of lblrtm is ignored."""
+    windows = plan_windows(filters, tolerance=tolerance, margin=margin, units=units)
+    return run_windows(lblrtm, windows, max_workers=max_workers, var_name=var_name, tape3=tape3)
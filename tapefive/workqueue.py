@@ -0,0 +1,314 @@
+import os
+import sys
+import json
+import time
+import uuid
+import socket
+import threading
+import traceback
+import pathlib as pl
+import subprocess as sp
+from . import lab
+
+STATES = ('pending', 'running', 'done', 'failed')
+
+
+def _write_json(path: pl.Path, data: dict) -> None:
+    # write next to the target and move in place, readers never see a partial file
+    tmp = path.with_name(f'.{path.name}.tmp{os.getpid()}.{threading.get_ident()}')
+    tmp.write_text(json.dumps(data, indent=1, sort_keys=True))
+    os.replace(tmp, path)
+
+
+def _read_json(path: pl.Path) -> dict | None:
+    try:
+        return json.loads(path.read_text())
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+class WorkQueue():
+    """
+    Job queue on a (shared) filesystem, no broker needed.
+
+    Every job is a JSON file holding an LblrtmConfig snapshot (LblrtmConfig.to_dict). Its state
+    is the sub-directory it is in: pending, running, done or failed. Workers (see Worker or
+    `tapefive worker --queue DIR`) claim a job by atomically renaming it from pending to running
+    and touch the file every heartbeat seconds while the job runs. The coordinator calls
+    requeue_stale (wait does it while waiting) to put jobs whose heartbeat stopped, e.g. because
+    the worker or its node died, back to pending.
+
+    The queue directory and the project directory of the jobs have to be visible under the same
+    path on all nodes; rename is atomic on local filesystems and NFS.
+
+    Examples
+    --------
+    >>> queue = WorkQueue('/shared/queue')
+    >>> ids = [queue.submit(run.configuration) for run in runs]
+    >>> workers = start_local_workers('/shared/queue', 4)
+    >>> results = queue.wait(ids)
+    """
+    def __init__(self, path: str | pl.Path, max_attempts: int = 3, stale_timeout: float = 60.0):
+        self.path = pl.Path(path)
+        self.max_attempts = max_attempts
+        self.stale_timeout = stale_timeout
+        for state in STATES:
+            self.path.joinpath(state).mkdir(parents=True, exist_ok=True)
+
+    def _file(self, state: str, job_id: str) -> pl.Path:
+        return self.path.joinpath(state, f'{job_id}.json')
+
+    def _jobs(self, state: str) -> list:
+        return sorted(p for p in self.path.joinpath(state).glob('*.json'))
+
+    def submit(self, configuration: 'lab.LblrtmConfig | dict', job_id: str | None = None,
+               unique_run_name: bool = True) -> str:
+        """
+        Add a job and return its id.
+
+        Parameters
+        ----------
+        configuration : LblrtmConfig or dict
+            The configuration to run (a dict as from LblrtmConfig.to_dict).
+        job_id : str, optional
+            Defaults to a time-ordered unique id; jobs are claimed in the order of their ids.
+        unique_run_name : bool
+            Run the job in run_name/job_id, so concurrent jobs never share a run directory.
+        """
+        snapshot = configuration.to_dict() if isinstance(configuration, lab.LblrtmConfig) else dict(configuration)
+        job_id = job_id or f'{time.time_ns():020d}-{uuid.uuid4().hex[:8]}'
+        if any(self._file(state, job_id).exists() for state in STATES):
+            raise ValueError(f"Job {job_id} already exists in {self.path}")
+        # fail here rather than on a worker, with the snapshot as the worker reads it (sorted keys)
+        lab.LblrtmConfig.from_dict(json.loads(json.dumps(snapshot, sort_keys=True)))
+        if unique_run_name:
+            env = dict(snapshot.get('environment', {}))
+            env['run_name'] = f"{env.get('run_name') or 'queue'}/{job_id}"
+            snapshot['environment'] = env
+        _write_json(self._file('pending', job_id), dict(id=job_id, configuration=snapshot, attempts=0,
+                                                         submitted=time.time()))
+        return job_id
+
+    def claim(self, worker: str) -> dict | None:
+        """Move the oldest pending job to running and return it, None if there is none."""
+        for p2f in self._jobs('pending'):
+            target = self.path.joinpath('running', p2f.name)
+            try:
+                os.utime(p2f)   # rename keeps the mtime, which is the heartbeat
+                os.rename(p2f, target)
+            except FileNotFoundError:
+                continue        # claimed by another worker
+            job = _read_json(target)
+            if isinstance(job, type(None)):
+                continue
+            job['attempts'] += 1
+            job['worker'] = worker
+            job['claimed'] = time.time()
+            _write_json(target, job)
+            return job
+        return None
+
+    def _owns(self, job: dict) -> bool:
+        """Whether job is still running with this claim (same worker and attempt), i.e. was not requeued."""
+        current = _read_json(self._file('running', job['id']))
+        return (not isinstance(current, type(None)) and current.get('worker') == job.get('worker')
+                and current.get('attempts') == job.get('attempts'))
+
+    def heartbeat(self, job_id: str) -> bool:
+        """Mark a running job as alive. False if it is not running any more (it was requeued)."""
+        try:
+            os.utime(self._file('running', job_id))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def complete(self, job: dict, result_path: str | pl.Path, timings: dict | None = None) -> bool:
+        """
+        Record a finished job with the path of its results.
+
+        Returns False and records nothing if the job was requeued since it was claimed, the
+        claim then belongs to another worker.
+        """
+        if not self._owns(job):
+            return False
+        job = dict(job, result_path=str(result_path), timings=timings or {}, finished=time.time())
+        _write_json(self._file('done', job['id']), job)
+        for state in ('running', 'pending', 'failed'):
+            # the job might have been requeued in the meantime
+            self._file(state, job['id']).unlink(missing_ok=True)
+        return True
+
+    def fail(self, job: dict, error: str) -> None:
+        """Record a failed attempt; the job is retried until max_attempts is reached. Nothing is
+        recorded if the job was requeued since it was claimed."""
+        if not self._owns(job):
+            return
+        job = dict(job, error=error, finished=time.time())
+        state = 'pending' if job['attempts'] < self.max_attempts else 'failed'
+        if not self._file('done', job['id']).exists():
+            _write_json(self._file(state, job['id']), job)
+        self._file('running', job['id']).unlink(missing_ok=True)
+
+    def requeue_stale(self, stale_timeout: float | None = None) -> list:
+        """Put running jobs without a heartbeat for stale_timeout seconds back to pending. Returns their ids."""
+        stale_timeout = self.stale_timeout if isinstance(stale_timeout, type(None)) else stale_timeout
+        requeued = []
+        now = time.time()
+        for p2f in self._jobs('running'):
+            try:
+                age = now - p2f.stat().st_mtime
+            except FileNotFoundError:
+                continue
+            if age < stale_timeout:
+                continue
+            job = _read_json(p2f)
+            if isinstance(job, type(None)):
+                continue
+            self.fail(job, f"no heartbeat from worker {job.get('worker')} for {age:.0f} s")
+            requeued.append(job['id'])
+        return requeued
+
+    def job(self, job_id: str) -> tuple:
+        """(state, job dict) of a job."""
+        for _ in range(3):   # the job can move between states while we look
+            for state in STATES:
+                job = _read_json(self._file(state, job_id))
+                if not isinstance(job, type(None)):
+                    return state, job
+        raise KeyError(f"Unknown job {job_id}")
+
+    def status(self) -> dict:
+        """Number of jobs per state."""
+        return {state: len(self._jobs(state)) for state in STATES}
+
+    def result(self, job_id: str) -> 'lab.Results':
+        state, job = self.job(job_id)
+        if state != 'done':
+            raise ValueError(f"Job {job_id} is {state}" + (f": {job['error']}" if job.get('error') else ''))
+        return lab.Results(job['result_path'], configuration=job['configuration'], timings=job.get('timings'))
+
+    def wait(self, job_ids, poll: float = 1.0, timeout: float | None = None, raise_on_failure: bool = True) -> list:
+        """
+        Wait for jobs to finish, requeueing stale jobs meanwhile, and return their Results.
+
+        Returns
+        -------
+        list
+            lab.Results in the order of job_ids; None for failed jobs if raise_on_failure is False.
+        """
+        job_ids = list(job_ids)
+        start = time.monotonic()
+        while True:
+            self.requeue_stale()
+            states = {job_id: self.job(job_id)[0] for job_id in job_ids}
+            failed = [job_id for job_id, s in states.items() if s == 'failed']
+            if failed and raise_on_failure:
+                raise RuntimeError(f"{len(failed)} job(s) failed, e.g. {failed[0]}: {self.job(failed[0])[1].get('error')}")
+            if all(s in ('done', 'failed') for s in states.values()):
+                return [self.result(job_id) if states[job_id] == 'done' else None for job_id in job_ids]
+            if not isinstance(timeout, type(None)) and time.monotonic() - start > timeout:
+                raise TimeoutError(f"Jobs not finished after {timeout} s: {self.status()}")
+            time.sleep(poll)
+
+    def map(self, configurations, **kwargs) -> list:
+        """Submit configurations and wait for their Results, see wait."""
+        job_ids = [self.submit(c) for c in configurations]
+        return self.wait(job_ids, **kwargs)
+
+
+class Worker():
+    """
+    Pull jobs from a WorkQueue and run them with Lblrtm.run, until the queue stays empty.
+
+    The job file is touched every heartbeat seconds from a background thread while LNFL and
+    LBLRTM run, so choose the stale_timeout of the queue a few times larger. If the job was
+    requeued meanwhile (its heartbeat went stale), LNFL/LBLRTM are killed and the job is left to
+    the worker that claims it next, without completing or failing it.
+    """
+    def __init__(self, queue: WorkQueue | str | pl.Path, name: str | None = None, heartbeat: float = 10.0,
+                 verbose: bool = False):
+        self.queue = queue if isinstance(queue, WorkQueue) else WorkQueue(queue)
+        self.name = name or f'{socket.gethostname()}:{os.getpid()}'
+        self.heartbeat = heartbeat
+        self._verbose = verbose
+
+    def _beat(self, job, stop, lost):
+        while not stop.wait(self.heartbeat):
+            # after a requeue the job can be running again, claimed by another worker
+            if not (self.queue._owns(job) and self.queue.heartbeat(job['id'])):
+                lost.set()
+                return
+
+    def run_job(self, job: dict) -> None:
+        stop = threading.Event()
+        lost = threading.Event()    # the job was requeued, stops the run
+        beat = threading.Thread(target=self._beat, args=(job, stop, lost), name=f"heartbeat-{job['id']}",
+                                daemon=True)
+        beat.start()
+        try:
+            run = lab.Lblrtm(verbose=self._verbose, cancel=lost)
+            run.configuration = lab.LblrtmConfig.from_dict(job['configuration'])
+            run.lnfl = lab.lnfl.Lnfl(run, verbose=self._verbose)
+            p2fld = run.execute()
+            if not p2fld.joinpath('TAPE12').exists():
+                raise FileNotFoundError(f"LBLRTM did not write {p2fld.joinpath('TAPE12')}")
+        except Exception:
+            stop.set()
+            if lost.is_set():
+                if self._verbose:
+                    print(f"{self.name}: job {job['id']} was requeued, its run was stopped")
+                return
+            if self._verbose:
+                traceback.print_exc()
+            self.queue.fail(job, traceback.format_exc(limit=3))
+            return
+        stop.set()
+        if not self.queue.complete(job, p2fld, timings=run.timings) and self._verbose:
+            print(f"{self.name}: job {job['id']} was requeued, its result is not recorded")
+
+    def run(self, max_jobs: int | None = None, idle_timeout: float | None = 0, poll: float = 1.0) -> int:
+        """
+        Process jobs and return how many were processed.
+
+        Parameters
+        ----------
+        max_jobs : int, optional
+            Stop after this many jobs.
+        idle_timeout : float, optional
+            Stop when no job showed up for this many seconds; None waits forever.
+        """
+        count = 0
+        idle_since = time.monotonic()
+        while isinstance(max_jobs, type(None)) or count < max_jobs:
+            job = self.queue.claim(self.name)
+            if isinstance(job, type(None)):
+                if not isinstance(idle_timeout, type(None)) and time.monotonic() - idle_since >= idle_timeout:
+                    break
+                time.sleep(poll)
+                continue
+            if self._verbose:
+                print(f"{self.name}: running job {job['id']} (attempt {job['attempts']})")
+            self.run_job(job)
+            count += 1
+            idle_since = time.monotonic()
+        return count
+
+
+def start_local_workers(queue: WorkQueue | str | pl.Path, n: int, idle_timeout: float | None = 10.0,
+                        heartbeat: float = 10.0, log_directory: str | pl.Path | None = None) -> list:
+    """
+    Start n worker processes (`tapefive worker`) on this machine and return their Popen objects.
+
+    Output of worker i goes to log_directory/worker_i.log, by default in the queue directory.
+    """
+    path = queue.path if isinstance(queue, WorkQueue) else pl.Path(queue)
+    log_directory = pl.Path(log_directory or path.joinpath('logs'))
+    log_directory.mkdir(parents=True, exist_ok=True)
+    cmd = [sys.executable, '-m', 'tapefive.cli', 'worker', '--queue', str(path), '--heartbeat', str(heartbeat)]
+    if not isinstance(idle_timeout, type(None)):
+        cmd += ['--idle-timeout', str(idle_timeout)]
+    workers = []
+    for i in range(n):
+        with open(log_directory.joinpath(f'worker_{i}.log'), 'w') as log:
+            workers.append(sp.Popen(cmd + ['--name', f'{socket.gethostname()}:local{i}'], stdout=log, stderr=sp.STDOUT))
+    return workers
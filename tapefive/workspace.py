@@ -0,0 +1,225 @@
+import os
+import re
+import json
+import time
+import uuid
+import socket
+import shutil
+import contextlib
+import pathlib as pl
+from dataclasses import dataclass
+
+ACCESS_FILE = '.tapefive_access'
+PIN_PREFIX = '.tapefive_pin.'
+# pins from other hosts can not be checked for liveness, they are dropped after this many seconds
+FOREIGN_PIN_LIFETIME = 24 * 3600
+# the directories of a run that are managed: LBLRTM outputs and the LNFL TAPE3
+ENTRY_KINDS = {'lblrtm': 'run', 'lnfl': 'tape3'}
+_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+
+def parse_size(v: int | float | str | None) -> int | None:
+    """Bytes from a number or a string like '500M' or '2.5 GB'."""
+    if isinstance(v, type(None)) or isinstance(v, (int, float)):
+        return v if isinstance(v, type(None)) else int(v)
+    m = re.fullmatch(r'\s*([\d.]+)\s*([KMGT]?)i?B?\s*', str(v), re.IGNORECASE)
+    if not m:
+        raise ValueError(f"Can not interpret {v!r} as a size, use e.g. 500M or 20G")
+    return int(float(m.group(1)) * _UNITS[m.group(2).upper()])
+
+
+def format_size(n: float) -> str:
+    for unit in ('B', 'K', 'M', 'G', 'T'):
+        if abs(n) < 1024 or unit == 'T':
+            return f'{n:.1f}{unit}' if unit != 'B' else f'{int(n)}B'
+        n /= 1024
+
+
+def touch(path: str | pl.Path) -> None:
+    """Mark a run or TAPE3 directory as used now."""
+    p2f = pl.Path(path).joinpath(ACCESS_FILE)
+    try:
+        p2f.touch()
+    except FileNotFoundError:
+        pass
+
+
+@contextlib.contextmanager
+def pin(*paths):
+    """
+    Protect directories from eviction while the block runs.
+
+    A pin is a file holding host and pid of this process; pins of processes that died are
+    ignored (and removed), so a killed run does not pin its directory forever.
+    """
+    pins = []
+    host = socket.gethostname()
+    try:
+        for path in paths:
+            path = pl.Path(path)
+            if not path.is_dir():
+                continue
+            p2f = path.joinpath(f'{PIN_PREFIX}{host}.{os.getpid()}.{uuid.uuid4().hex[:8]}')
+            p2f.write_text(json.dumps(dict(host=host, pid=os.getpid(), created=time.time())))
+            pins.append(p2f)
+        yield
+    finally:
+        for p2f in pins:
+            p2f.unlink(missing_ok=True)
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def is_pinned(path: str | pl.Path) -> bool:
+    host = socket.gethostname()
+    pinned = False
+    for p2f in pl.Path(path).glob(f'{PIN_PREFIX}*'):
+        try:
+            info = json.loads(p2f.read_text())
+            age = time.time() - p2f.stat().st_mtime
+        except (FileNotFoundError, json.JSONDecodeError):
+            continue
+        if info.get('host') == host:
+            alive = _pid_alive(int(info.get('pid', -1)))
+        else:
+            alive = age < FOREIGN_PIN_LIFETIME
+        if alive:
+            pinned = True
+        else:
+            p2f.unlink(missing_ok=True)
+    return pinned
+
+
+@dataclass
+class Entry:
+    path: pl.Path
+    kind: str           # 'run' (LBLRTM output directory) or 'tape3' (LNFL directory)
+    size: int           # bytes on disk
+    last_access: float  # unix time
+    pinned: bool
+
+
+def _scan(path: pl.Path):
+    size = 0
+    last = 0.0
+    access = None
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            try:
+                st = os.lstat(os.path.join(root, name))
+            except FileNotFoundError:
+                continue
+            size += st.st_blocks * 512
+            if name == ACCESS_FILE and root == str(path):
+                access = st.st_mtime
+            elif not name.startswith(PIN_PREFIX):
+                last = max(last, st.st_mtime)
+    return size, access if not isinstance(access, type(None)) else last
+
+
+class Workspace():
+    """
+    Disk usage of a project directory and eviction of the least recently used run directories.
+
+    Entries are the lblrtm (outputs) and lnfl (TAPE3) directories of every run, also of child
+    runs. Their last access is recorded by Lblrtm.execute and when results are read; entries
+    used by a running Lblrtm are pinned and never evicted.
+
+    Examples
+    --------
+    >>> ws = Workspace(run.configuration.environment.project_directory)
+    >>> print(ws.report())
+    >>> ws.enforce('50G')
+    """
+    def __init__(self, project_directory: str | pl.Path, budget: int | str | None = None):
+        self.project_directory = pl.Path(project_directory)
+        self.budget = parse_size(budget)
+
+    def entries(self) -> list:
+        """All entries, least recently used first."""
+        out = []
+        for kind_dir, kind in ENTRY_KINDS.items():
+            for path in self.project_directory.rglob(kind_dir):
+                if not path.is_dir() or path.is_symlink():
+                    continue
+                size, last = _scan(path)
+                if size == 0:
+                    continue    # e.g. the unused lnfl directory of a run with a shared TAPE3
+                out.append(Entry(path=path, kind=kind, size=size, last_access=last, pinned=is_pinned(path)))
+        return sorted(out, key=lambda e: e.last_access)
+
+    def usage(self) -> dict:
+        """Total size, size per kind and number of entries."""
+        entries = self.entries()
+        out = dict(total=sum(e.size for e in entries), entries=len(entries),
+                   pinned=sum(e.size for e in entries if e.pinned), budget=self.budget)
+        for kind in ENTRY_KINDS.values():
+            out[kind] = sum(e.size for e in entries if e.kind == kind)
+        return out
+
+    def report(self) -> str:
+        """Table of the entries, most recently used first."""
+        entries = self.entries()
+        lines = [f"{'size':>9s}  {'kind':5s}  {'last access':19s}  {'pin':3s}  path"]
+        for e in reversed(entries):
+            stamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(e.last_access))
+            lines.append(f"{format_size(e.size):>9s}  {e.kind:5s}  {stamp}  {'yes' if e.pinned else '':3s}  "
+                         f"{e.path.relative_to(self.project_directory)}")
+        total = sum(e.size for e in entries)
+        budget = '' if isinstance(self.budget, type(None)) else f' of {format_size(self.budget)} budget'
+        lines.append(f"{format_size(total):>9s}  total in {len(entries)} entries{budget}")
+        return '\n'.join(lines)
+
+    def evict(self, entry: Entry) -> None:
+        if is_pinned(entry.path):
+            raise ValueError(f"{entry.path} is pinned by an active run")
+        shutil.rmtree(entry.path, ignore_errors=True)
+        # remove run directories that are empty now, e.g. run/child after run/child/lblrtm
+        parent = entry.path.parent
+        while parent != self.project_directory and self.project_directory in parent.parents:
+            leftovers = [p for p in parent.iterdir() if not (p.is_dir() and not any(p.iterdir()))]
+            if leftovers:
+                break
+            shutil.rmtree(parent, ignore_errors=True)
+            parent = parent.parent
+
+    def enforce(self, budget: int | str | None = None, dry_run: bool = False, verbose: bool = False) -> list:
+        """
+        Evict least recently used, unpinned entries until the total size is within budget.
+
+        Returns
+        -------
+        list
+            The evicted entries (the ones that would be evicted if dry_run).
+        """
+        budget = parse_size(budget) if not isinstance(budget, type(None)) else self.budget
+        if isinstance(budget, type(None)):
+            raise ValueError("No disk budget given.")
+        entries = self.entries()
+        total = sum(e.size for e in entries)
+        evicted = []
+        for e in entries:
+            if total <= budget:
+                break
+            if e.pinned:
+                continue
+            if not dry_run:
+                try:
+                    self.evict(e)
+                except ValueError:
+                    continue    # got pinned meanwhile
+            if verbose:
+                print(f"{'Would evict' if dry_run else 'Evicted'} {e.path} ({format_size(e.size)})")
+            total -= e.size
+            evicted.append(e)
+        if total > budget and verbose:
+            print(f"Still {format_size(total)} in use, the rest is pinned.")
+        return evicted
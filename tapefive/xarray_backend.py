@@ -0,0 +1,141 @@
+import os
+import re
+import numpy as np
+import xarray as xr
+from xarray.backends import BackendArray, BackendEntrypoint
+from xarray.core import indexing
+from . import fileio
+
+# file names the tape12 engine opens without being asked for it, see Tape12BackendEntrypoint.guess_can_open
+TAPE12_NAMES = re.compile(r'^(TAPE1[0-3]|OD(deflt|int)_\d+)$')
+TAPE27_NAMES = re.compile(r'^TAPE2[78]$')
+
+
+class Tape12BackendArray(BackendArray):
+    """
+    The values of a TAPE12-like file, read on indexing.
+
+    The panel headers are read when the file is opened; indexing reads only the samples of the
+    panels it touches (see fileio.iter_tape12_panels), with a new file handle per read, so
+    concurrent reads (e.g. dask threads) need no lock.
+    """
+    def __init__(self, path, panels, dtype=np.float64):
+        self.path = path
+        self.panels = panels
+        self.offsets = np.concatenate([[0], np.cumsum([p.n for p in panels])])
+        self.shape = (int(self.offsets[-1]),)
+        self.dtype = np.dtype(dtype)
+
+    def __getitem__(self, key: indexing.ExplicitIndexer) -> np.typing.ArrayLike:
+        return indexing.explicit_indexing_adapter(key, self.shape, indexing.IndexingSupport.BASIC,
+                                                  self._raw_indexing_method)
+
+    def _read(self, start: int, stop: int) -> np.ndarray:
+        """Samples start:stop (stop > start)."""
+        out = np.empty(stop - start, dtype=self.dtype)
+        first = int(np.searchsorted(self.offsets, start, side='right')) - 1
+        with open(self.path, 'rb') as f:
+            for i in range(first, len(self.panels)):
+                p, lo = self.panels[i], int(self.offsets[i])
+                if lo >= stop:
+                    break
+                a, b = max(start, lo) - lo, min(stop, lo + p.n) - lo
+                f.seek(p.data_offset + a * p.itemsize)
+                raw = f.read((b - a) * p.itemsize)
+                out[lo + a - start:lo + b - start] = np.frombuffer(raw, dtype=np.dtype(f'{p.endian}f{p.itemsize}'))
+        return out
+
+    def _raw_indexing_method(self, key: tuple) -> np.ndarray:
+        k = key[0]
+        if isinstance(k, slice):
+            start, stop, step = k.indices(self.shape[0])
+            if step < 0:
+                lo, hi = stop + 1, start + 1
+            else:
+                lo, hi = start, stop
+            if hi <= lo:
+                return np.empty(0, dtype=self.dtype)
+            values = self._read(lo, hi)
+            return values[::step] if step > 0 else values[::-1][::-step]
+        k = int(k)
+        k = k + self.shape[0] if k < 0 else k
+        return self._read(k, k + 1)[0]
+
+
+class Tape12BackendEntrypoint(BackendEntrypoint):
+    """
+    xarray engine 'tape12' for TAPE12 and the other panel files of LBLRTM (TAPE10/11/13, layer
+    optical depth files ODdeflt_###).
+
+    The dataset matches fileio.read_tape12, but the values are only read when they are used:
+    selecting a wavenumber range reads only the panels in that range.
+
+    Examples
+    --------
+    >>> ds = xr.open_dataset('run/lblrtm/TAPE12', engine='tape12')
+    >>> ds.optical_depth.sel(wavenumber=slice(10000, 10010)).values
+    >>> xr.open_mfdataset(paths, engine='tape12', combine='nested', concat_dim='run')
+    """
+    open_dataset_parameters = ('filename_or_obj', 'drop_variables', 'var_name', 'units')
+    description = 'LBLRTM TAPE12/TAPE10/TAPE11/TAPE13 panel files, read lazily'
+    url = 'https://hagentelg.github.io/tapefive/'
+
+    def open_dataset(self, filename_or_obj, *, drop_variables=None, var_name: str = 'optical_depth',
+                     units: str = '1') -> xr.Dataset:
+        path = os.fspath(filename_or_obj)
+        panels = list(fileio.iter_tape12_panels(path, headers_only=True))
+        if not panels:
+            raise ValueError(f"No recognizable panels found in {path}.")
+        wn = np.concatenate([p.wavenumber for p in panels])
+        data = indexing.LazilyIndexedArray(Tape12BackendArray(path, panels))
+        ds = xr.Dataset(
+            data_vars={var_name: xr.Variable('wavenumber', data, {'long_name': var_name, 'units': units})},
+            coords={'wavenumber': ('wavenumber', wn)},
+            attrs={
+                'source': os.path.basename(path),
+                'endianness': 'little' if panels[0].endian == '<' else 'big',
+                'record_marker_bytes': panels[0].marker_bytes,
+                'panel_count': len(panels),
+                'v1_first': panels[0].v1,
+                'v2_last': panels[-1].v2,
+                'panel_v1': np.array([p.start for p in panels]),
+                'panel_dv': np.array([p.dv for p in panels], dtype=np.float64),
+                'panel_n': np.array([p.n for p in panels], dtype=np.int64),
+            },
+        )
+        if drop_variables:
+            ds = ds.drop_vars(drop_variables, errors='ignore')
+        return ds
+
+    def guess_can_open(self, filename_or_obj) -> bool:
+        try:
+            name = os.path.basename(os.fspath(filename_or_obj))
+        except TypeError:
+            return False
+        return bool(TAPE12_NAMES.match(name))
+
+
+class Tape27BackendEntrypoint(BackendEntrypoint):
+    """
+    xarray engine 'tape27' for the ASCII transmittance (TAPE27) and radiance (TAPE28) files.
+
+    ASCII has no panel offsets to seek to, so the file is parsed when opened (with
+    fileio.read_tape27 and its cache); in open_mfdataset this happens in the dask tasks when
+    parallel=True.
+    """
+    open_dataset_parameters = ('filename_or_obj', 'drop_variables')
+    description = 'LBLRTM TAPE27/TAPE28 ASCII spectra'
+    url = 'https://hagentelg.github.io/tapefive/'
+
+    def open_dataset(self, filename_or_obj, *, drop_variables=None) -> xr.Dataset:
+        ds = fileio.read_tape27(os.fspath(filename_or_obj))
+        if drop_variables:
+            ds = ds.drop_vars(drop_variables, errors='ignore')
+        return ds
+
+    def guess_can_open(self, filename_or_obj) -> bool:
+        try:
+            name = os.path.basename(os.fspath(filename_or_obj))
+        except TypeError:
+            return False
+        return bool(TAPE27_NAMES.match(name))
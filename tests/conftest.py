@@ -0,0 +1,34 @@
+import struct
+import numpy as np
+import pytest
+
+
+def write_tape12(path, panels, marker_bytes=4, endian='<', itemsize=4, header_size=1000):
+    """
+    Write a synthetic TAPE12: a file header record, then per panel a header record (v1, v2, dv, n)
+    and a data record. panels is a sequence of (v1, dv, values).
+    """
+    fmt = endian + ('I' if marker_bytes == 4 else 'Q')
+
+    def record(payload):
+        m = struct.pack(fmt, len(payload))
+        return m + payload + m
+
+    with open(path, 'wb') as f:
+        f.write(record(b'\0' * header_size))
+        for v1, dv, values in panels:
+            values = np.asarray(values)
+            v2 = v1 + (values.size - 1) * dv
+            f.write(record(struct.pack(endian + 'ddfi', v1, v2, dv, values.size)))
+            f.write(record(values.astype(f'{endian}f{itemsize}').tobytes()))
+    return path
+
+
+@pytest.fixture
+def tape12(tmp_path):
+    """Factory writing synthetic TAPE12s into tmp_path, see write_tape12."""
+    count = iter(range(10 ** 6))
+
+    def make(panels, name=None, **kwargs):
+        return write_tape12(tmp_path.joinpath(name or f'TAPE12_{next(count)}'), panels, **kwargs)
+    return make
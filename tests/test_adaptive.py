@@ -0,0 +1,90 @@
+import types
+import numpy as np
+import pytest
+import xarray as xr
+import tapefive.lab as tf
+from tapefive import adaptive
+
+
+def test_interpolation_error():
+    wn = np.arange(100.0, 110.0, 0.5)
+    np.testing.assert_allclose(adaptive.interpolation_error(wn, 0.5 + 0.01 * wn), 0, atol=1e-12)
+    # the second difference of x^2 with spacing h is 2 h^2
+    np.testing.assert_allclose(adaptive.interpolation_error(wn, wn ** 2), 0.25)
+    spike = np.ones(wn.size)
+    spike[7] = 0.5
+    err = adaptive.interpolation_error(wn, spike)
+    assert err[7] == 0.5 and err[6] == err[8] == 0.25
+    assert np.all(err[np.r_[:6, 9:wn.size]] == 0)
+    np.testing.assert_array_equal(adaptive.interpolation_error(wn[:2], spike[:2]), 0)
+
+
+def test_plan_refinement_widens_and_merges():
+    wn = np.arange(1000.0, 1200.0, 0.1)
+    error = np.zeros(wn.size)
+    assert adaptive.plan_refinement(wn, error, 1e-3) == []
+    error[(wn >= 1050.2) & (wn < 1050.6)] = 1e-2
+    (w,) = adaptive.plan_refinement(wn, error, 1e-3)
+    # the block 1050 - 1051 and one block on each side
+    assert (w.fmin, w.fmax) == pytest.approx((1049.0, 1052.0))
+    error[wn >= 1150.0] = 1e-2
+    planned = adaptive.plan_refinement(wn, error, 1e-3)
+    assert [(w.fmin, w.fmax) for w in planned] == pytest.approx([(1049.0, 1052.0), (1149.0, wn[-1])])
+    (merged,) = adaptive.plan_refinement(wn, error, 1e-3, merge_gap=100)
+    assert (merged.fmin, merged.fmax) == pytest.approx((1049.0, wn[-1]))
+    # at the lower end of the band the window starts at the first sample
+    error[:] = 0
+    error[0] = 1
+    (w,) = adaptive.plan_refinement(wn, error, 1e-3, block=5)
+    assert (w.fmin, w.fmax) == pytest.approx((1000.0, 1010.0))
+
+
+def _line(wn):
+    # a weak background and a line much narrower than the coarse spacing at 1050 cm^-1
+    return 0.01 + 2 * np.exp(-((wn - 1050.0) / 0.05) ** 2)
+
+
+@pytest.fixture
+def fake_runs(monkeypatch):
+    def run_concurrently(lblrtms, max_workers=None):
+        out = []
+        for r in lblrtms:
+            grid = r.configuration.spectral_grid
+            wn = np.arange(grid.fmin - 25, grid.fmax + 25 + grid.df / 2, grid.df)
+            out.append(types.SimpleNamespace(data=xr.Dataset({'optical_depth': ('wavenumber', _line(wn))},
+                                                             coords={'wavenumber': wn})))
+        return out
+
+    monkeypatch.setattr(tf, 'run_concurrently', run_concurrently)
+    monkeypatch.setattr(tf.Lblrtm, 'prepare_tape3', lambda self: None)
+
+
+@pytest.mark.parametrize('grid', ['nonuniform', 'uniform'])
+def test_run_adaptive(tmp_path, fake_runs, grid):
+    lblrtm = tf.Lblrtm()
+    lblrtm.configuration.environment.project_directory = tmp_path
+    lblrtm.configuration.spectral_grid.fmin = 1000
+    lblrtm.configuration.spectral_grid.fmax = 1100
+    lblrtm.configuration.spectral_grid.df = 0.01
+    ds = adaptive.run_adaptive(lblrtm, df_coarse=0.25, tolerance=1e-3, grid=grid)
+    wn = ds.wavenumber.values
+    assert wn[0] == 1000 and wn[-1] == pytest.approx(1100)
+    # the line sits on the edge of the blocks 1049 - 1050 and 1050 - 1051, plus one block each side
+    np.testing.assert_allclose(ds.window_fmin, [1048.0])
+    np.testing.assert_allclose(ds.window_fmax, [1052.0])
+    assert ds.refined_fraction == pytest.approx(0.04)
+    refined = ds.refined.values
+    assert refined[np.abs(wn - 1050) < 0.5].all() and not refined[np.abs(wn - 1050) > 5].any()
+    np.testing.assert_allclose(ds.optical_depth.values[refined], _line(wn[refined]), atol=1e-9)
+    if grid == 'nonuniform':
+        assert np.all(np.diff(wn) > 0)
+        np.testing.assert_allclose(ds.optical_depth.values, _line(wn), atol=1e-9)
+    else:
+        np.testing.assert_allclose(np.diff(wn), 0.01)
+
+
+def test_run_adaptive_needs_a_coarser_grid(tmp_path, fake_runs):
+    lblrtm = tf.Lblrtm()
+    lblrtm.configuration.spectral_grid.df = 0.01
+    with pytest.raises(ValueError):
+        adaptive.run_adaptive(lblrtm, df_coarse=0.01)
@@ -0,0 +1,13 @@
+import json
+import tapefive.lab as tf
+from tapefive import batch
+
+
+def test_sorted_job_line():
+    config = tf.LblrtmConfig()
+    config.spectral_grid.fmin = 2000
+    config.spectral_grid.fmax = 2100
+    line = json.dumps({'id': 'ir', 'configuration': config.to_dict()}, sort_keys=True)
+    restored = batch.job_configuration(json.loads(line))
+    assert (restored.spectral_grid.fmin, restored.spectral_grid.fmax) == (2000, 2100)
+    assert restored.environment.run_name == 'run/ir'
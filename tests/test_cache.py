@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+from tapefive import fileio
+
+
+def test_cache_returns_read_only_copies(tape12):
+    p = tape12([(100.0, 0.5, np.arange(10.0))])
+    fileio.cache_clear()
+    a = fileio.read_tape12(p)
+    b = fileio.read_tape12(p)
+    assert fileio.cache_info()['hits'] == 1
+    with pytest.raises(ValueError):
+        b.optical_depth.values[0] = 1
+    b.attrs['x'] = 1
+    assert 'x' not in a.attrs
+
+
+def test_cache_sees_rewritten_files(tape12):
+    p = tape12([(100.0, 0.5, np.arange(10.0))])
+    fileio.cache_clear()
+    assert fileio.read_tape12(p).sizes['wavenumber'] == 10
+    tape12([(100.0, 1.0, np.zeros(3))], name=p.name)
+    assert fileio.read_tape12(p).sizes['wavenumber'] == 3
+
+
+def test_cache_bypass(tape12):
+    p = tape12([(100.0, 0.5, np.arange(10.0))])
+    fileio.cache_clear()
+    fileio.read_tape12(p, cache=False)
+    fileio.read_tape12(p, cache=False)
+    assert fileio.cache_info()['hits'] == 0
@@ -0,0 +1,20 @@
+import json
+import pytest
+import tapefive.lab as tf
+
+
+@pytest.mark.parametrize('fmin, fmax', [(2000, 2100), (10000, 10300), (20000, 20100)])
+def test_json_round_trip(fmin, fmax):
+    config = tf.LblrtmConfig()
+    config.spectral_grid.fmin = fmin
+    config.spectral_grid.fmax = fmax
+    config.molecular_spectral_lines.molecules.H2O.enable = True
+    restored = tf.LblrtmConfig.from_dict(json.loads(config.to_json()))
+    assert restored.spectral_grid.fmin == fmin
+    assert restored.spectral_grid.fmax == fmax
+    assert restored.to_dict() == config.to_dict()
+
+
+def test_from_dict_rejects_fmax_below_fmin():
+    with pytest.raises(ValueError):
+        tf.LblrtmConfig.from_dict({'spectral_grid': {'fmin': 2100, 'fmax': 2000}})
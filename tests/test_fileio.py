@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+from tapefive import fileio
+
+FORMATS = [(4, '<'), (4, '>'), (8, '<'), (8, '>')]
+
+
+def _panels():
+    # the second panel repeats the last sample of the first, as LBLRTM writes them
+    return [(100.0, 0.5, np.arange(10.0)), (104.5, 0.5, np.arange(9.0, 19.0)), (109.0, 0.25, np.arange(18.0, 22.0))]
+
+
+@pytest.mark.parametrize('marker_bytes, endian', FORMATS)
+@pytest.mark.parametrize('itemsize', [4, 8])
+def test_read_tape12_formats(tape12, marker_bytes, endian, itemsize):
+    p = tape12(_panels(), marker_bytes=marker_bytes, endian=endian, itemsize=itemsize)
+    ds = fileio.read_tape12(p, cache=False)
+    np.testing.assert_array_equal(ds.optical_depth.values, np.arange(22.0))
+    wn = ds.wavenumber.values
+    assert np.all(np.diff(wn) > 0)
+    assert wn[0] == 100.0 and wn[9] == 104.5 and wn[10] == 105.0 and wn[-1] == 109.75
+    assert ds.attrs['record_marker_bytes'] == marker_bytes
+    assert ds.attrs['endianness'] == ('little' if endian == '<' else 'big')
+    assert ds.attrs['panel_count'] == 3
+    np.testing.assert_array_equal(ds.attrs['panel_n'], [10, 9, 3])
+    np.testing.assert_array_equal(ds.attrs['panel_v1'], [100.0, 105.0, 109.25])
+
+
+def test_duplicate_boundary_is_dropped(tape12):
+    panels = list(fileio.iter_tape12_panels(tape12(_panels())))
+    assert [p.skip for p in panels] == [0, 1, 1]
+    np.testing.assert_array_equal(panels[1].values, np.arange(10.0, 19.0))
+    np.testing.assert_array_equal(panels[1].wavenumber, 105.0 + 0.5 * np.arange(9))
+
+
+def test_headers_only(tape12):
+    p = tape12(_panels(), itemsize=8)
+    full = list(fileio.iter_tape12_panels(p))
+    headers = list(fileio.iter_tape12_panels(p, headers_only=True))
+    assert all(h.values is None for h in headers)
+    assert [(h.start, h.n, h.data_offset) for h in headers] == [(f.start, f.n, f.data_offset) for f in full]
+    with open(p, 'rb') as f:
+        f.seek(headers[1].data_offset)
+        assert np.frombuffer(f.read(8), '<f8')[0] == 10.0
+
+
+def test_unrecognized_file(tmp_path):
+    p = tmp_path.joinpath('TAPE12')
+    p.write_bytes(b'not a fortran file')
+    with pytest.raises(ValueError):
+        fileio.read_tape12(p, cache=False)
+
+
+def test_reduce_tape12(tape12):
+    from tapefive import reductions
+    p = tape12(_panels())
+    out = fileio.reduce_tape12(p, {'mean': reductions.Mean()})
+    ds = fileio.read_tape12(p, cache=False)
+    assert out['mean'] == pytest.approx(float(np.average(ds.optical_depth, weights=np.gradient(ds.wavenumber))), rel=0.05)
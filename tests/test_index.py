@@ -0,0 +1,78 @@
+import sqlite3
+import numpy as np
+import tapefive.lab as tf
+from tapefive import index
+from conftest import write_tape12
+
+
+def make_run(project, linefile, run_name='run'):
+    run = tf.Lblrtm()
+    run.configuration.spectral_grid.fmin = 2000
+    run.configuration.spectral_grid.fmax = 2100
+    run.configuration.environment.project_directory = project
+    run.configuration.environment.run_name = run_name
+    run.configuration.environment.linefile = linefile
+    return run
+
+
+def write_outputs(run):
+    """Run directory as left by LNFL and LBLRTM: lnfl/{TAPE1,TAPE3,TAPE5} and lblrtm/{TAPE3,TAPE5,TAPE12}."""
+    env = run.configuration.environment
+    p2fld_lnfl = env.project_directory.joinpath(env.run_name, 'lnfl')
+    p2fld = env.project_directory.joinpath(env.run_name, 'lblrtm')
+    p2fld_lnfl.mkdir(parents=True)
+    p2fld.mkdir()
+    p2fld_lnfl.joinpath('TAPE1').symlink_to(env.linefile)
+    p2fld_lnfl.joinpath('TAPE3').write_bytes(b'tape3')
+    p2fld_lnfl.joinpath('TAPE5').write_text(run.tape5_lnfl.tape5)
+    p2fld.joinpath('TAPE3').symlink_to(p2fld_lnfl.joinpath('TAPE3'))
+    p2fld.joinpath('TAPE5').write_text(run.tape5.tape5)
+    write_tape12(p2fld.joinpath('TAPE12'), [(2000.0, 1.0, np.ones(101))])
+    return p2fld
+
+
+def test_lookup_without_own_tape3_compares_line_data(tmp_path):
+    linefile = tmp_path.joinpath('linefile')
+    linefile.write_bytes(b'lines')
+    p2fld = write_outputs(make_run(tmp_path.joinpath('a'), linefile))
+    idx = index.RunIndex(tmp_path.joinpath('runs.sqlite'))
+    assert idx.scan(tmp_path) == 1
+    row, = idx.query()
+    assert row['lnfl_tape5_hash'] and row['linefile_id'] == index.linefile_id(linefile)
+
+    # same TAPE5 and linefile in another project, no TAPE3 there yet
+    assert idx.lookup(make_run(tmp_path.joinpath('b'), linefile)) == p2fld.resolve()
+
+    # same LBLRTM TAPE5, but another linefile
+    other = tmp_path.joinpath('other_linefile')
+    other.write_bytes(b'other lines')
+    assert idx.lookup(make_run(tmp_path.joinpath('b'), other)) is None
+
+    # same LBLRTM TAPE5 and linefile, but the indexed TAPE3 came from another LNFL TAPE5
+    p2f_lnfl_tape5 = p2fld.parent.joinpath('lnfl', 'TAPE5')
+    p2f_lnfl_tape5.write_text(p2f_lnfl_tape5.read_text() + '\n-1.\n')
+    p2fld.joinpath('TAPE12').touch()
+    idx.scan(tmp_path)
+    assert idx.lookup(make_run(tmp_path.joinpath('b'), linefile)) is None
+
+
+def test_lookup_requires_stored_line_data(tmp_path):
+    linefile = tmp_path.joinpath('linefile')
+    linefile.write_bytes(b'lines')
+    p2fld = write_outputs(make_run(tmp_path.joinpath('a'), linefile))
+    idx = index.RunIndex(tmp_path.joinpath('runs.sqlite'))
+    idx.add(p2fld)
+    with sqlite3.connect(idx.path) as con:
+        con.execute('UPDATE runs SET lnfl_tape5_hash = NULL, linefile_id = NULL, tape3_id = NULL')
+    assert idx.lookup(make_run(tmp_path.joinpath('b'), linefile)) is None
+
+
+def test_old_database_gets_new_columns(tmp_path):
+    p2f = tmp_path.joinpath('runs.sqlite')
+    with sqlite3.connect(p2f) as con:
+        columns = [c for c in index.COLUMNS if c not in index.ADDED_COLUMNS]
+        con.execute(f"CREATE TABLE runs ({', '.join(columns)})")
+    index.RunIndex(p2f)
+    with sqlite3.connect(p2f) as con:
+        names = {r[1] for r in con.execute('PRAGMA table_info(runs)')}
+    assert set(index.ADDED_COLUMNS) <= names
@@ -0,0 +1,63 @@
+import types
+import numpy as np
+import pytest
+import xarray as xr
+import tapefive.lab as tf
+
+WN = np.linspace(1000.0, 1010.0, 21)
+
+
+@pytest.fixture
+def runs(monkeypatch):
+    """Replace LBLRTM by od = H2O scale * sin(wn) + (O2 scale)^2 * cos(wn); returns the run names executed."""
+    executed = []
+
+    def run(self, **kwargs):
+        molecules = self.configuration.molecular_spectral_lines.molecules
+        od = molecules.H2O.scale * np.sin(WN) + molecules.O2.scale ** 2 * np.cos(WN)
+        executed.append(self.configuration.environment.run_name)
+        return types.SimpleNamespace(data=xr.Dataset({'optical_depth': ('wavenumber', od, {'units': '1'})},
+                                                     coords={'wavenumber': WN}))
+
+    monkeypatch.setattr(tf.Lblrtm, 'run', run)
+    monkeypatch.setattr(tf.Lblrtm, 'prepare_tape3', lambda self: None)
+    return executed
+
+
+def _lblrtm(tmp_path):
+    lblrtm = tf.Lblrtm()
+    lblrtm.configuration.environment.project_directory = tmp_path
+    for name in ('H2O', 'O2'):
+        mol = lblrtm.configuration.molecular_spectral_lines.molecules[name]
+        mol.enable = True
+        mol.scale = 2.0
+    return lblrtm
+
+
+def test_forward(tmp_path, runs):
+    lblrtm = _lblrtm(tmp_path)
+    jac = lblrtm.jacobian(['H2O', 'O2'], step=1e-4)
+    np.testing.assert_allclose(jac.optical_depth.sel(parameter='H2O'), np.sin(WN), atol=1e-6)
+    np.testing.assert_allclose(jac.optical_depth.sel(parameter='O2'), 4 * np.cos(WN), atol=1e-3)
+    np.testing.assert_allclose(jac.step, [2e-4, 2e-4])
+    np.testing.assert_allclose(jac.base_optical_depth, 2 * np.sin(WN) + 4 * np.cos(WN))
+    assert len(runs) == 3
+    # the base run is cached per TAPE5
+    lblrtm.jacobian('H2O', step=1e-4)
+    assert len(runs) == 4
+
+
+def test_central(tmp_path, runs):
+    jac = _lblrtm(tmp_path).jacobian('O2', step=0.1, method='central')
+    np.testing.assert_allclose(jac.optical_depth.sel(parameter='O2'), 4 * np.cos(WN), atol=1e-9)
+    assert sorted(r.rsplit('/', 1)[1] for r in runs) == ['O2_minus', 'O2_plus']
+
+
+def test_invalid_parameters(tmp_path, runs):
+    lblrtm = _lblrtm(tmp_path)
+    lblrtm.configuration.molecular_spectral_lines.molecules.O2.enable = False
+    with pytest.raises(ValueError):
+        lblrtm.jacobian('O2')
+    with pytest.raises(ValueError):
+        lblrtm.jacobian('H2O', step=3, method='central')
+    assert not runs
@@ -0,0 +1,93 @@
+import types
+import numpy as np
+import pytest
+import xarray as xr
+import tapefive.lab as tf
+from tapefive import layering
+
+WN = np.linspace(10000.0, 10010.0, 11)
+REFERENCE = [0.0, 1.0, 2.0, 3.0, 4.0, 6.0, 8.0, 10.0, 15.0, 20.0, 30.0, 50.0, 100.0]
+
+
+@pytest.fixture
+def runs(monkeypatch):
+    """
+    Replace LBLRTM by a water vapor like path: the layer optical depth is the midpoint value of
+    exp(-z / 2) times the thickness, so coarse layers near the ground cost accuracy and layers
+    at the top almost nothing. Returns the number of runs.
+    """
+    count = []
+
+    def run_concurrently(lblrtms, max_workers=None):
+        out = []
+        for r in lblrtms:
+            z = np.asarray(r.configuration.atmospheric_layers.boundaries)
+            mid = (z[1:] + z[:-1]) / 2
+            column = np.sum(np.exp(-mid / 2) * np.diff(z)) / (1 + r.configuration.geometry.slant_angle)
+            od = column * (1 + 0.5 * np.sin(WN))
+            out.append(types.SimpleNamespace(data=xr.Dataset({'optical_depth': ('wavenumber', od)},
+                                                             coords={'wavenumber': WN})))
+            count.append(1)
+        return out
+
+    monkeypatch.setattr(tf, 'run_concurrently', run_concurrently)
+    monkeypatch.setattr(tf.Lblrtm, 'prepare_tape3', lambda self: None)
+    return count
+
+
+def _lblrtm(tmp_path):
+    lblrtm = tf.Lblrtm()
+    lblrtm.configuration.environment.project_directory = tmp_path
+    lblrtm.configuration.atmospheric_layers.boundaries = REFERENCE
+    return lblrtm
+
+
+def test_greedy_removal_within_tolerance(tmp_path, runs):
+    lblrtm = _lblrtm(tmp_path)
+    result = layering.optimize_layers(lblrtm, tolerance=1e-2)
+    assert result.max_error <= 1e-2
+    assert result.boundaries.size < len(REFERENCE)
+    assert set(result.boundaries) <= set(REFERENCE) and result.boundaries[0] == 0
+    assert result.runs == len(runs)
+    # the top is removed first, it holds almost no absorber
+    assert result.history[0][0] == 100
+    np.testing.assert_array_equal(lblrtm.configuration.atmospheric_layers.boundaries, result.boundaries)
+    loose = layering.optimize_layers(_lblrtm(tmp_path), tolerance=1e-1, cache=False)
+    assert loose.boundaries.size <= result.boundaries.size
+
+
+def test_min_layers(tmp_path, runs):
+    result = layering.optimize_layers(_lblrtm(tmp_path), tolerance=1.0, min_layers=3, cache=False)
+    assert result.boundaries.size == 4
+
+
+def test_cache_per_atmosphere(tmp_path, runs):
+    first = layering.optimize_layers(_lblrtm(tmp_path), tolerance=1e-2)
+    n = len(runs)
+    cached = layering.optimize_layers(_lblrtm(tmp_path), tolerance=1e-2)
+    assert cached.cached and len(runs) == n
+    np.testing.assert_array_equal(cached.boundaries, first.boundaries)
+
+    slant = _lblrtm(tmp_path)
+    slant.configuration.geometry.slant_angle = 60
+    assert not layering.optimize_layers(slant, tolerance=1e-2).cached
+    scaled = _lblrtm(tmp_path)
+    h2o = scaled.configuration.molecular_spectral_lines.molecules.H2O
+    h2o.enable = True
+    h2o.scale = 2
+    assert layering._key(scaled, np.asarray(REFERENCE), 1e-2) != layering._key(_lblrtm(tmp_path), np.asarray(REFERENCE), 1e-2)
+
+
+def test_cache_key_includes_the_profile(tmp_path):
+    def sonde(temperature):
+        lblrtm = _lblrtm(tmp_path)
+        profile = lblrtm.configuration.atmospheric_profile
+        profile.altitude = np.linspace(0, 100, 7)
+        profile.pressure = 1013 * np.exp(-profile.altitude / 8)
+        profile.temperature = np.full(7, temperature)
+        profile.amounts = {'H2O': np.full(7, 100.0)}
+        return layering._key(lblrtm, np.asarray(REFERENCE), 1e-2)
+
+    assert sonde(250.0) == sonde(250.0)
+    assert sonde(250.0) != sonde(280.0)
+    assert sonde(250.0) != layering._key(_lblrtm(tmp_path), np.asarray(REFERENCE), 1e-2)
@@ -0,0 +1,19 @@
+from tapefive import linefile
+
+
+def _record(molecule, wavenumber):
+    return f'{molecule:2d}1{wavenumber:12.6f}{1e-22:10.3E}'.ljust(100) + '\n'
+
+
+def test_split(tmp_path):
+    source = tmp_path.joinpath('TAPE1')
+    lines = [_record(m, w) for w, m in [(99.0, 1), (100.0, 1), (150.0, 2), (150.0, 3), (200.0, 1), (250.0, 1), (400.0, 1)]]
+    lines.insert(3, 'continuation of the line at 150'.ljust(100) + '\n')
+    source.write_text(''.join(lines))
+    outputs = [tmp_path.joinpath('a'), tmp_path.joinpath('b')]
+    counts = linefile.split(source, [(100, 200), (150, 300)], outputs, molecules=[1, 2])
+    assert counts == [3, 3]
+    a = outputs[0].read_text().splitlines()
+    assert [linefile.record_line(l.encode()) for l in a] == [(1, 100.0), (2, 150.0), None, (1, 200.0)]
+    b = outputs[1].read_text().splitlines()
+    assert [linefile.record_line(l.encode()) for l in b] == [(2, 150.0), None, (1, 200.0), (1, 250.0)]
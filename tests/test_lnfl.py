@@ -0,0 +1,10 @@
+import tapefive.lab as tf
+
+
+def test_requested_range_matches_tape5():
+    run = tf.Lblrtm()
+    run.configuration.spectral_grid.fmin = 2000
+    run.configuration.spectral_grid.fmax = 2124.4
+    record_2 = run.lnfl.tape5.tape5.splitlines()[1]
+    assert run.lnfl.requested_range == (float(record_2[:10]), float(record_2[10:20]))
+    assert run.lnfl.requested_range == (1975.0, 2149.0)
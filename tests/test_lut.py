@@ -0,0 +1,23 @@
+import numpy as np
+import pytest
+import tapefive.lab as tf
+from tapefive import lut
+
+
+def test_initial_needs_interior_nodes():
+    with pytest.raises(ValueError):
+        lut.AdaptiveLUT(tf.Lblrtm(), {'pwv': (0.1, 5)}, initial=2)
+
+
+def test_interval_errors_of_a_parabola():
+    x = np.linspace(0, 1, 5)
+    err = lut.interval_errors(x, x ** 2)
+    np.testing.assert_allclose(err, 0.25 ** 2 / 8 * 2)
+
+
+def test_interpolate_is_exact_for_bilinear_functions():
+    nodes = {'a': np.array([0.0, 1.0, 3.0]), 'b': np.array([1.0, 2.0])}
+    a, b = np.meshgrid(nodes['a'], nodes['b'], indexing='ij')
+    table = (2 * a + 3 * b + a * b)[..., None]
+    out = lut.interpolate(nodes, table, a=[0.5, 2.0, 3.0], b=[1.5, 1.0, 2.0])
+    np.testing.assert_allclose(out[:, 0], [1 + 4.5 + 0.75, 4 + 3 + 2, 6 + 6 + 6])
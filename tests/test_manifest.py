@@ -0,0 +1,112 @@
+import os
+import warnings
+import numpy as np
+import pytest
+import tapefive.lab as tf
+from tapefive import fileio, manifest
+from conftest import write_tape12
+
+PANELS = [(100.0, 0.5, np.arange(10.0)), (104.5, 0.5, np.arange(9.0, 19.0)), (109.0, 0.25, np.arange(18.0, 22.0))]
+
+
+def test_validate_tape12(tape12):
+    p = tape12(PANELS)
+    assert fileio.validate_tape12(p)
+    assert fileio.validate_tape12(p, fmin=100, fmax=109.5)
+    assert not fileio.validate_tape12(p, fmax=110)
+    with open(p, 'r+b') as f:
+        f.truncate(os.path.getsize(p) - 10)
+    assert not fileio.validate_tape12(p)
+    assert not fileio.validate_tape12(p.with_name('missing'))
+
+
+@pytest.fixture
+def fake_execute(monkeypatch):
+    """Replace Lblrtm.execute by writing synthetic outputs; returns the run names executed."""
+    executed = []
+
+    def execute(self, force_run=False):
+        env = self.configuration.environment
+        p2fld = env.project_directory.joinpath(env.run_name, 'lblrtm')
+        p2fld.mkdir(parents=True, exist_ok=True)
+        if self.configuration.output.merge_mode == 'layers':
+            for k in (1, 2):
+                write_tape12(p2fld.joinpath(f'ODdeflt_{k:03d}'), PANELS)
+        else:
+            write_tape12(p2fld.joinpath('TAPE12'), PANELS)
+        self.timings = {'lblrtm': 1.0}
+        executed.append(env.run_name)
+        return p2fld
+
+    monkeypatch.setattr(tf.Lblrtm, 'execute', execute)
+    return executed
+
+
+def _runs(tmp_path, merge_mode='total'):
+    parent = tf.Lblrtm()
+    parent.configuration.environment.project_directory = tmp_path
+    parent.configuration.spectral_grid.fmin = 100
+    parent.configuration.spectral_grid.fmax = 109
+    parent.configuration.output.merge_mode = merge_mode
+    return [parent.spawn(f'sweep/{i}') for i in range(3)]
+
+
+@pytest.mark.parametrize('merge_mode', ['total', 'layers'])
+def test_resume_skips_complete_jobs(tmp_path, fake_execute, merge_mode):
+    p2f = tmp_path.joinpath('sweep.json')
+    runs = _runs(tmp_path, merge_mode)
+    outputs = manifest.run_sweep(runs, p2f, load=False)
+    assert len(fake_execute) == 3
+    assert manifest.Manifest(p2f).summary() == {'done': 3}
+
+    # a sweep that died while writing the output of one job
+    partial = outputs[1].joinpath('TAPE12' if merge_mode == 'total' else 'ODdeflt_002')
+    with open(partial, 'r+b') as f:
+        f.truncate(os.path.getsize(partial) - 10)
+    fake_execute.clear()
+    assert manifest.run_sweep(_runs(tmp_path, merge_mode), p2f, load=False) == outputs
+    assert fake_execute == [runs[1].configuration.environment.run_name]
+
+
+def test_resume_reruns_changed_and_retries_failed(tmp_path, fake_execute, monkeypatch):
+    p2f = tmp_path.joinpath('sweep.json')
+    manifest.run_sweep(_runs(tmp_path), p2f, load=False)
+    runs = _runs(tmp_path)
+    runs[0].configuration.spectral_grid.fmax = 108
+    fake_execute.clear()
+    manifest.run_sweep(runs, p2f, load=False)
+    assert fake_execute == [runs[0].configuration.environment.run_name]
+
+    def fail(self, force_run=False):
+        raise RuntimeError('lblrtm exited with code 1')
+
+    monkeypatch.setattr(tf.Lblrtm, 'execute', fail)
+    runs[2].configuration.spectral_grid.fmax = 108
+    with warnings.catch_warnings(record=True):
+        warnings.simplefilter('always')
+        assert manifest.run_sweep(runs, p2f, load=False, max_attempts=2)[2] is None
+    entry = manifest.Manifest(p2f).get(runs[2].configuration.environment.run_name)
+    assert entry['status'] == 'failed' and entry['attempts'] == 2
+
+
+def test_reused_outputs_keep_their_timings(tmp_path, fake_execute, monkeypatch):
+    from tapefive import scheduling
+    p2f = tmp_path.joinpath('sweep.json')
+    manifest.run_sweep(_runs(tmp_path)[:1], p2f, load=False)
+    key = _runs(tmp_path)[0].configuration.environment.run_name
+    manifest.Manifest(p2f).update(key, status='running')     # e.g. the sweep died after the run
+
+    executed = tf.Lblrtm.execute
+
+    def reuse(self, force_run=False):
+        p2fld = executed(self)
+        self.stage = 'none'     # stages.plan found the outputs of the same configuration
+        self.timings = {'lblrtm': 0.0}
+        return p2fld
+
+    monkeypatch.setattr(tf.Lblrtm, 'execute', reuse)
+    model = scheduling.CostModel()
+    manifest.run_sweep(_runs(tmp_path)[:1], p2f, load=False, cost_model=model)
+    entry = manifest.Manifest(p2f).get(key)
+    assert entry['status'] == 'done' and entry['timings'] == {'lblrtm': 1.0}
+    assert model.n == 0
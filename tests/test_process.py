@@ -0,0 +1,53 @@
+import sys
+import pytest
+from tapefive import process
+
+
+def _python(code):
+    return [sys.executable, '-c', code]
+
+
+def test_child_output_is_unbuffered(tmp_path):
+    code = "import os; print('LAYER = 1'); print(os.environ.get('GFORTRAN_UNBUFFERED_PRECONNECTED')); print('STOP  LBLRTM EXIT')"
+    progress = []
+    result = process.run_streamed(_python(code), cwd=tmp_path, log_path=tmp_path.joinpath('log'), program='lblrtm',
+                                  progress_callback=progress.append)
+    assert result.success
+    assert result.tail[1] == 'y'
+    assert progress[0]['value'] == 1
+
+
+def test_error_pattern_kills_child(tmp_path):
+    code = "import time; print('Fortran runtime error: end of file', flush=True); time.sleep(30)"
+    with pytest.raises(process.ProcessError) as e:
+        process.run_streamed(_python(code), cwd=tmp_path, log_path=tmp_path.joinpath('log'), timeout=20)
+    assert e.value.result.error.startswith('Fortran runtime error')
+    assert e.value.result.elapsed < 10
+
+
+@pytest.mark.parametrize('prlimit', [True, False])
+def test_cpu_timeout(tmp_path, monkeypatch, prlimit):
+    import resource
+    if not prlimit:
+        monkeypatch.delattr(resource, 'prlimit', raising=False)     # the `ulimit -t` wrapper
+    with pytest.raises(process.ProcessError, match='CPU time limit') as e:
+        process.run_streamed(_python('while True: pass'), cwd=tmp_path, log_path=tmp_path.joinpath('log'),
+                             timeout=60, cpu_timeout=1)
+    assert e.value.result.elapsed < 30
+
+
+def test_cpu_limit_is_applied_after_the_start(tmp_path, monkeypatch):
+    # no preexec_fn, it can deadlock the fork while other threads run
+    seen = {}
+    popen = process.sp.Popen
+
+    def spy(*args, **kwargs):
+        seen.update(kwargs)
+        return popen(*args, **kwargs)
+
+    monkeypatch.setattr(process.sp, 'Popen', spy)
+    code = "import time, resource; time.sleep(0.5); print(resource.getrlimit(resource.RLIMIT_CPU)[0])"
+    result = process.run_streamed(_python(code), cwd=tmp_path, log_path=tmp_path.joinpath('log'), cpu_timeout=100,
+                                  success_pattern='.')
+    assert seen.get('preexec_fn') is None
+    assert result.tail[0] == '100'
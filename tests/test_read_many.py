@@ -0,0 +1,30 @@
+import pathlib as pl
+import numpy as np
+import pytest
+from tapefive import fileio
+
+
+@pytest.mark.parametrize('executor', ['thread', 'process'])
+def test_read_many(tape12, executor):
+    paths = [tape12([(100.0, 0.5, np.arange(20) + k), (110.0, 0.5, np.arange(20) + 20 + k)]) for k in range(3)]
+    ds = fileio.read_many(paths, fmin=101, fmax=112, executor=executor, max_workers=2, dtype=np.float64)
+    wn = ds.wavenumber.values
+    assert wn[0] == 101 and wn[-1] == 112
+    for k in range(3):
+        np.testing.assert_array_equal(ds.optical_depth.values[k], (wn - 100) * 2 + k)
+
+
+def test_read_many_process_result_owns_its_memory(tape12):
+    paths = [tape12([(100.0, 1.0, np.arange(10.0))]) for _ in range(2)]
+    out = fileio.read_many(paths, executor='process', max_workers=2).optical_depth.values
+    out[0, 0] = -1      # writable, and no file is left behind
+    assert out[0, 0] == -1
+    assert not list(pl.Path(fileio._shared_block_dir()).glob('tapefive_read_many_*'))
+
+
+def test_read_window(tape12):
+    # the second panel repeats the last sample of the first, as LBLRTM writes them
+    p = tape12([(100.0, 0.5, np.arange(10.0)), (104.5, 0.5, np.arange(9.0, 19.0))])
+    wn, values = fileio._read_window(p, 104, 106)
+    np.testing.assert_array_equal(wn, [104.0, 104.5, 105.0, 105.5, 106.0])
+    np.testing.assert_array_equal(values, [8, 9, 10, 11, 12])
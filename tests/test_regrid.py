@@ -0,0 +1,51 @@
+import numpy as np
+from tapefive import regrid
+
+
+def test_linear_endpoints():
+    grid = regrid.PanelGrid([100.0, 110.0], [1.0, 0.5], [10, 5])
+    wn = grid.coordinate()
+    values = np.arange(wn.size, dtype=float) ** 2
+    out = regrid.Regridder([wn[0], wn[-1]]).apply(grid, values)
+    np.testing.assert_array_equal(out, values[[0, -1]])
+
+
+def test_linear_at_source_samples_and_across_panels():
+    grid = regrid.PanelGrid([100.0, 110.0], [1.0, 0.5], [10, 5])
+    wn = grid.coordinate()
+    values = np.sin(wn)
+    np.testing.assert_allclose(regrid.Regridder(wn).apply(grid, values), values)
+    # halfway between the last sample of the first panel (109) and the first of the second (110)
+    out = regrid.Regridder([109.5]).apply(grid, values)
+    np.testing.assert_allclose(out, [(values[9] + values[10]) / 2])
+
+
+def test_outside_coverage_is_nan():
+    grid = regrid.PanelGrid([100.0], [1.0], [5])
+    out = regrid.Regridder([99.0, 104.5]).apply(grid, np.ones(5))
+    assert np.isnan(out).all()
+
+
+def test_binned_conserves_mean():
+    grid = regrid.PanelGrid([100.0], [0.1], [1001])
+    values = np.full(grid.size, 2.0)
+    out = regrid.Regridder(np.arange(101.0, 200.0, 1.0), mode='binned').apply(grid, values)
+    np.testing.assert_allclose(out, 2.0)
+
+
+def test_values_on_grid():
+    import xarray as xr
+    ds = xr.Dataset({'od': ('wavenumber', np.array([0.0, 1.0, 2.0]))}, coords={'wavenumber': [10.0, 11.0, 12.0]})
+    np.testing.assert_array_equal(regrid.values_on_grid(ds, 'od', np.array([10.0, 11.0, 12.0])), [0, 1, 2])
+    out = regrid.values_on_grid(ds, 'od', np.array([9.0, 10.5, 12.0]))
+    assert np.isnan(out[0]) and out[1] == 0.5 and out[2] == 2.0
+
+
+def test_values_on_shifted_grid_is_interpolated():
+    import xarray as xr
+    wn = 10000.0 + 0.01 * np.arange(1000)
+    ds = xr.Dataset({'od': ('wavenumber', wn - 10000.0)}, coords={'wavenumber': wn})
+    shifted = wn + 0.05
+    out = regrid.values_on_grid(ds, 'od', shifted)
+    np.testing.assert_allclose(out[:-5], shifted[:-5] - 10000.0, atol=1e-9)
+    assert np.isnan(out[-5:]).all()
@@ -0,0 +1,77 @@
+import pytest
+import tapefive.lab as tf
+from tapefive import scheduling
+
+
+class _Run(tf.Lblrtm):
+    """Lblrtm whose execute fails for fail=True instead of running LBLRTM."""
+    def __init__(self, path, fail=False):
+        super().__init__()
+        self.configuration.environment.project_directory = path
+        self.path, self.fail = path, fail
+
+    def execute(self, force_run=False):
+        self.timings = {'lnfl': 0.0, 'lblrtm': 0.01}
+        self._filesystem = {'p2fld_run_lblrtm': self.path}
+        if self.fail:
+            raise RuntimeError('LBLRTM failed')
+        return self.path
+
+
+def test_failed_run_does_not_stop_the_batch(tmp_path):
+    model = scheduling.CostModel(tmp_path.joinpath('model.json'))
+    runs = [_Run(tmp_path), _Run(tmp_path, fail=True), _Run(tmp_path)]
+    progress = []
+    out = scheduling.run_batch(runs, max_workers=1, model=model, load=False, progress_callback=progress.append)
+    assert out[0] == tmp_path and out[2] == tmp_path
+    assert isinstance(out[1], RuntimeError)
+    assert progress[-1]['failed'] == 1 and progress[-1]['done'] == 3
+    assert model.n == 2
+
+
+def test_cost_model_is_thread_safe(monkeypatch):
+    import threading
+    import numpy as np
+    x = np.array([1.0, np.log(800), np.log(0.01), 0.0, 0.0, np.log(3), np.log(18)])
+    monkeypatch.setattr(scheduling, 'features', lambda lblrtm: x)
+    model = scheduling.CostModel()
+    solve = np.linalg.solve
+    locked = []
+
+    def spy(a, b):
+        # update (from the run_batch workers) must not reset the weights while they are fitted
+        locked.append(model._lock.locked())
+        return solve(a, b)
+
+    monkeypatch.setattr(np.linalg, 'solve', spy)
+    errors = []
+
+    def work(i):
+        try:
+            for _ in range(200):
+                if i % 2:
+                    model.update(None, seconds=10.0)
+                else:
+                    assert model.predict(None).seconds > 0
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=work, args=(i,)) for i in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errors
+    assert locked and all(locked)
+    assert model.n == 600
+    assert model.predict(None).seconds == pytest.approx(10.0, rel=0.05)
+
+
+def test_runs_without_lblrtm_are_not_observed(tmp_path):
+    model = scheduling.CostModel()
+    run = _Run(tmp_path)
+    run.execute()
+    for stage, n in (('none', 0), ('downstream', 0), ('full', 1)):
+        run.stage = stage
+        model.observe(run)
+        assert model.n == n
@@ -0,0 +1,91 @@
+import time
+import types
+import threading
+import concurrent.futures
+import numpy as np
+import pytest
+import tapefive.lab as tf
+from tapefive import singleflight
+from conftest import write_tape12
+
+
+def _lblrtm(tmp_path):
+    lblrtm = tf.Lblrtm()
+    lblrtm.configuration.environment.project_directory = tmp_path
+    return lblrtm
+
+
+@pytest.fixture
+def fake_run(monkeypatch, tmp_path):
+    """Lblrtm.run writing a TAPE5 and TAPE12 after the release event is set; returns the calls and the event."""
+    calls = []
+    release = threading.Event()
+
+    def run(self, **kwargs):
+        calls.append(kwargs)
+        release.wait(5)
+        p2fld = tmp_path.joinpath(f'run{len(calls)}')
+        p2fld.mkdir()
+        p2fld.joinpath('TAPE5').write_text(self.tape5.tape5)
+        write_tape12(p2fld.joinpath('TAPE12'), [(100.0, 1.0, np.arange(5.0))])
+        return types.SimpleNamespace(path2result_dir=p2fld, timings={'lblrtm': 1.0})
+
+    monkeypatch.setattr(tf.Lblrtm, 'run', run)
+    return calls, release
+
+
+def test_concurrent_identical_runs_execute_once(tmp_path, fake_run):
+    calls, release = fake_run
+    with concurrent.futures.ThreadPoolExecutor(4) as pool:
+        futures = [pool.submit(singleflight.run, _lblrtm(tmp_path), archive=False) for _ in range(4)]
+        time.sleep(0.2)
+        release.set()
+        results = [f.result() for f in futures]
+    assert calls == [{'archive': False}]
+    assert all(r is results[0] for r in results)
+    assert not singleflight._inflight
+
+
+def test_different_runs_are_not_coalesced(tmp_path, fake_run):
+    calls, release = fake_run
+    release.set()
+    a, b = _lblrtm(tmp_path), _lblrtm(tmp_path)
+    b.configuration.spectral_grid.fmax += 10
+    singleflight.run(a)
+    singleflight.run(b)
+    assert len(calls) == 2
+
+
+def test_failure_reaches_every_caller(tmp_path, monkeypatch):
+    release = threading.Event()
+
+    def run(self, **kwargs):
+        release.wait(5)
+        raise RuntimeError('lblrtm exited with code 1')
+
+    monkeypatch.setattr(tf.Lblrtm, 'run', run)
+    with concurrent.futures.ThreadPoolExecutor(2) as pool:
+        futures = [pool.submit(singleflight.run, _lblrtm(tmp_path)) for _ in range(2)]
+        time.sleep(0.2)
+        release.set()
+        for f in futures:
+            with pytest.raises(RuntimeError):
+                f.result()
+    assert not singleflight._inflight
+
+
+def test_process_that_waited_shares_the_result(tmp_path, fake_run):
+    calls, release = fake_run
+    release.set()
+    lblrtm = _lblrtm(tmp_path)
+    fp = lblrtm.fingerprint
+    since = time.time()
+    first = singleflight._run_exclusive(lblrtm, fp, since)
+    # a process that started waiting before the first one finished gets its output
+    shared = singleflight._run_exclusive(_lblrtm(tmp_path), fp, since)
+    assert len(calls) == 1
+    assert shared.path2result_dir == first.path2result_dir
+    assert shared.timings == {'lblrtm': 1.0}
+    # one that started after it runs again, this is not a cache
+    singleflight._run_exclusive(_lblrtm(tmp_path), fp, time.time())
+    assert len(calls) == 2
@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+from tapefive import slantpath
+
+BOUNDARIES = [0.0, 1.0, 2.0, 5.0, 10.0, 20.0, 50.0, 100.0]
+
+
+def _exact(boundaries, angle, radius=slantpath.EARTH_RADIUS_KM):
+    # distance along a straight path from the bottom boundary to each boundary
+    r = radius + np.asarray(boundaries)
+    t = np.radians(angle)
+    s = np.sqrt(r ** 2 - (r[0] * np.sin(t)) ** 2) - r[0] * np.cos(t)
+    return np.diff(s) / np.diff(boundaries)
+
+
+def test_vertical_is_one():
+    for refraction in (False, True):
+        np.testing.assert_allclose(slantpath.airmass_factors(BOUNDARIES, 0, refraction=refraction), 1)
+
+
+@pytest.mark.parametrize('angle', [30, 60, 85])
+def test_geometric(angle):
+    am = slantpath.airmass_factors(BOUNDARIES, [angle])
+    assert am.shape == (1, len(BOUNDARIES) - 1)
+    np.testing.assert_allclose(am[0], _exact(BOUNDARIES, angle), rtol=1e-9)
+    # spherical shells: below the plane parallel secant, approaching it near the ground
+    assert np.all(am < 1 / np.cos(np.radians(angle)))
+    np.testing.assert_allclose(am[0, 0], 1 / np.cos(np.radians(angle)), rtol=2e-2)
+
+
+def test_horizontal_path_is_finite():
+    for refraction in (False, True):
+        am = slantpath.airmass_factors(BOUNDARIES, [90], refraction=refraction)
+        assert np.all(np.isfinite(am)) and np.all(am > 1)
+
+
+def test_refraction(monkeypatch):
+    angles = [30, 60, 80]
+    geometric = slantpath.airmass_factors(BOUNDARIES, angles)
+    refracted = slantpath.airmass_factors(BOUNDARIES, angles, refraction=True)
+    # n (R + z) sin(theta) is constant and n decreases upward, so the path leans over a little
+    assert np.all(refracted >= geometric)
+    np.testing.assert_allclose(refracted, geometric, rtol=1e-2)
+    # without refractivity the integration gives the straight path
+    monkeypatch.setattr(slantpath, 'SURFACE_REFRACTIVITY', 0.0)
+    np.testing.assert_allclose(slantpath.airmass_factors(BOUNDARIES, angles, refraction=True, substeps=256),
+                               geometric, rtol=1e-4)
+
+
+def test_invalid_angles():
+    with pytest.raises(ValueError):
+        slantpath.airmass_factors(BOUNDARIES, [95])
+    with pytest.raises(ValueError):
+        slantpath.airmass_factors(BOUNDARIES, [-1])
+
+
+def test_spectra_scale_layer_optical_depths(monkeypatch):
+    import xarray as xr
+    slant = slantpath.SlantPathScaling(lblrtm=None)
+    od = np.arange(14.0).reshape(7, 2)
+    slant.layer_optical_depth = xr.Dataset({'optical_depth': (('layer', 'wavenumber'), od)},
+                                           coords={'layer': np.arange(1, 8), 'wavenumber': [1000.0, 1001.0]})
+    slant._boundaries = BOUNDARIES
+    monkeypatch.setattr(slant, 'prepare', lambda: None)
+    ds = slant.spectra([0, 60])
+    np.testing.assert_allclose(ds.optical_depth[0], od.sum(axis=0))
+    np.testing.assert_allclose(ds.optical_depth[1], _exact(BOUNDARIES, 60) @ od)
+    np.testing.assert_allclose(ds.transmittance, np.exp(-ds.optical_depth))
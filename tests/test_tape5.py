@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+import tapefive.lab as tf
+
+
+def _sonde(config, top=30.0):
+    profile = config.atmospheric_profile
+    profile.altitude = np.linspace(0, top, 7)
+    profile.pressure = 1013 * np.exp(-profile.altitude / 8)
+    profile.temperature = np.full(7, 250.0)
+    profile.amounts = {'H2O': np.full(7, 100.0)}
+
+
+def test_boundaries_above_the_profile_are_rejected():
+    run = tf.Lblrtm()
+    _sonde(run.configuration)
+    with pytest.raises(ValueError, match='altitude range'):
+        run.tape5.tape5
+
+
+def test_boundaries_within_the_profile():
+    run = tf.Lblrtm()
+    _sonde(run.configuration)
+    run.configuration.atmospheric_layers.boundaries = [0, 5, 10, 30]
+    lines = run.tape5.tape5.splitlines()
+    record_32 = next(i for i, l in enumerate(lines) if l.startswith(' 0.000E+00 3.000E+01'))
+    assert lines[record_32 + 1].split() == ['0.000E+00', '5.000E+00', '1.000E+01', '3.000E+01']
+
+
+def test_record_13_without_line_by_line():
+    run = tf.Lblrtm()
+    run.configuration.molecular_spectral_lines.lineshape = 'None'
+    lines = run.tape5.tape5.splitlines()
+    assert ' HI=0 ' in lines[1]
+    assert lines[2] == run.tape5.record_13
@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+import xarray as xr
+from tapefive import tools, windows
+
+
+def _boxcar(lo, hi, x=None):
+    x = np.arange(lo - 20.0, hi + 20.5, 1.0) if x is None else x
+    return x, ((x >= lo) & (x <= hi)).astype(float)
+
+
+def test_single_band():
+    (w,) = windows.plan_windows([_boxcar(1000, 1100)])
+    # the samples next to the band are included, the response crosses the threshold between them
+    assert (w.fmin, w.fmax, w.filters) == (999.0, 1101.0, (0,))
+    (w,) = windows.plan_windows(_boxcar(1000, 1100), margin=5)      # a single filter
+    assert (w.fmin, w.fmax) == (994.0, 1106.0)
+
+
+def test_close_windows_are_merged():
+    filters = [_boxcar(1000, 1100), _boxcar(1120, 1200), _boxcar(2000, 2100)]
+    planned = windows.plan_windows(filters)
+    assert [(w.fmin, w.fmax, w.filters) for w in planned] == [(999.0, 1201.0, (0, 1)), (1999.0, 2101.0, (2,))]
+    planned = windows.plan_windows(filters, merge_gap=10)
+    assert len(planned) == 3
+
+
+def test_filter_with_two_bands_and_tolerance():
+    x = np.arange(900.0, 2200.0, 1.0)
+    y = np.where((x >= 1000) & (x <= 1010), 1.0, 0.0) + np.where((x >= 2000) & (x <= 2010), 0.5, 0.0)
+    y += 1e-4       # out of band leakage below the tolerance
+    planned = windows.plan_windows([(x, y)])
+    assert [(w.fmin, w.fmax, w.filters) for w in planned] == [(999.0, 1011.0, (0,)), (1999.0, 2011.0, (0,))]
+
+
+def test_wavelength_filters():
+    nm = np.arange(700.0, 800.0, 0.5)
+    response = np.where((nm >= 750) & (nm <= 760), 1.0, 0.0)
+    (w,) = windows.plan_windows([(nm, response)], units='nm')
+    assert w.fmin == pytest.approx(tools.nm_to_inv_cm(760.5))
+    assert w.fmax == pytest.approx(tools.nm_to_inv_cm(749.5))
+    (da,) = windows.plan_windows([xr.DataArray(response, coords={'wavelength': nm}, dims='wavelength')])
+    assert (da.fmin, da.fmax) == (w.fmin, w.fmax)
+
+
+def test_no_response():
+    with pytest.raises(ValueError):
+        windows.plan_windows([(np.arange(10.0), np.zeros(10))])
@@ -0,0 +1,61 @@
+import sys
+import threading
+import pytest
+import tapefive.lab as tf
+from tapefive import process, workqueue
+
+
+def test_submitted_job_loads_on_worker(tmp_path):
+    config = tf.LblrtmConfig()
+    config.spectral_grid.fmin = 2000
+    config.spectral_grid.fmax = 2100
+    queue = workqueue.WorkQueue(tmp_path.joinpath('queue'))
+    job_id = queue.submit(config)
+    job = queue.claim('test')
+    assert job['id'] == job_id
+    restored = tf.LblrtmConfig.from_dict(job['configuration'])
+    assert (restored.spectral_grid.fmin, restored.spectral_grid.fmax) == (2000, 2100)
+
+
+def test_requeued_job_is_stopped_and_not_completed(tmp_path, monkeypatch):
+    config = tf.LblrtmConfig()
+    config.environment.project_directory = tmp_path
+    queue = workqueue.WorkQueue(tmp_path.joinpath('queue'))
+    job_id = queue.submit(config)
+    cancelled = []
+
+    def execute(self, force_run=False):
+        # the coordinator gives up on the job while it runs
+        assert queue.requeue_stale(stale_timeout=0) == [job_id]
+        cancelled.append(self.cancel.wait(5))
+        raise process.ProcessError('lblrtm was cancelled and killed')
+
+    monkeypatch.setattr(tf.Lblrtm, 'execute', execute)
+    worker = workqueue.Worker(queue, name='w1', heartbeat=0.01)
+    assert worker.run(max_jobs=1) == 1
+    assert cancelled == [True]
+    state, job = queue.job(job_id)
+    assert state == 'pending'
+    assert job['attempts'] == 1 and 'no heartbeat' in job['error']
+
+
+def test_complete_requires_the_claim(tmp_path):
+    queue = workqueue.WorkQueue(tmp_path.joinpath('queue'))
+    job_id = queue.submit(tf.LblrtmConfig())
+    first = queue.claim('w1')
+    queue.requeue_stale(stale_timeout=0)
+    second = queue.claim('w2')
+    assert not queue.complete(first, tmp_path)
+    assert queue.job(job_id)[0] == 'running'
+    assert queue.complete(second, tmp_path)
+    assert queue.job(job_id)[0] == 'done'
+
+
+def test_run_streamed_cancel(tmp_path):
+    cancel = threading.Event()
+    threading.Timer(0.2, cancel.set).start()
+    with pytest.raises(process.ProcessError) as e:
+        process.run_streamed([sys.executable, '-c', 'import time; time.sleep(30)'], cwd=tmp_path,
+                             log_path=tmp_path.joinpath('log'), cancel=cancel)
+    assert e.value.result.cancelled
+    assert e.value.result.elapsed < 10
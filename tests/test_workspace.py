@@ -0,0 +1,84 @@
+import os
+import json
+import socket
+import pytest
+from tapefive import workspace
+
+SIZE = 64 * 1024
+
+
+def _entry(project, name, age):
+    """Directory with SIZE bytes of data, last used age seconds ago."""
+    path = project.joinpath(name)
+    path.mkdir(parents=True)
+    path.joinpath('TAPE12').write_bytes(os.urandom(SIZE))
+    workspace.touch(path)
+    t = path.joinpath(workspace.ACCESS_FILE).stat().st_mtime - age
+    os.utime(path.joinpath(workspace.ACCESS_FILE), (t, t))
+    return path
+
+
+@pytest.fixture
+def project(tmp_path):
+    _entry(tmp_path, 'a/lblrtm', 300)
+    _entry(tmp_path, 'a/lnfl', 200)
+    _entry(tmp_path, 'b/child/lblrtm', 100)
+    _entry(tmp_path, 'c/lblrtm', 0)
+    return tmp_path
+
+
+def test_entries_least_recently_used_first(project):
+    entries = workspace.Workspace(project).entries()
+    assert [e.path.relative_to(project).as_posix() for e in entries] == ['a/lblrtm', 'a/lnfl', 'b/child/lblrtm', 'c/lblrtm']
+    assert [e.kind for e in entries] == ['run', 'tape3', 'run', 'run']
+    assert all(e.size >= SIZE for e in entries)
+
+
+def test_enforce_evicts_lru_and_skips_pinned(project):
+    ws = workspace.Workspace(project)
+    size = ws.entries()[0].size
+    with workspace.pin(project.joinpath('a/lblrtm')):
+        dry = ws.enforce(2 * size + 16 * 1024, dry_run=True)   # room for the pin file
+        assert [e.path for e in dry] == [project.joinpath('a/lnfl'), project.joinpath('b/child/lblrtm')]
+        assert project.joinpath('a/lnfl').exists()
+        evicted = ws.enforce(2 * size + 16 * 1024)
+    assert [e.path for e in evicted] == [e.path for e in dry]
+    assert project.joinpath('a/lblrtm').exists() and project.joinpath('c/lblrtm').exists()
+    # the empty run directory of the child goes with it
+    assert not project.joinpath('b').exists()
+    # no pin left behind
+    assert not workspace.is_pinned(project.joinpath('a/lblrtm'))
+
+
+def test_evict_refuses_pinned(project):
+    ws = workspace.Workspace(project)
+    entry = ws.entries()[0]
+    with workspace.pin(entry.path):
+        with pytest.raises(ValueError):
+            ws.evict(entry)
+
+
+def test_pins_of_dead_processes_are_dropped(project, monkeypatch):
+    path = project.joinpath('a/lblrtm')
+    dead = path.joinpath(f'{workspace.PIN_PREFIX}dead')
+    dead.write_text(json.dumps(dict(host=socket.gethostname(), pid=2 ** 22 + 1)))
+    monkeypatch.setattr(workspace, '_pid_alive', lambda pid: pid == os.getpid())
+    assert not workspace.is_pinned(path)
+    assert not dead.exists()
+    foreign = path.joinpath(f'{workspace.PIN_PREFIX}foreign')
+    foreign.write_text(json.dumps(dict(host='elsewhere', pid=1)))
+    assert workspace.is_pinned(path)
+    t = foreign.stat().st_mtime - workspace.FOREIGN_PIN_LIFETIME - 1
+    os.utime(foreign, (t, t))
+    assert not workspace.is_pinned(path)
+
+
+@pytest.mark.parametrize('text, size', [('500M', 500 * 1024 ** 2), ('2.5 GB', int(2.5 * 1024 ** 3)), ('10k', 10240),
+                                        (1000, 1000), (None, None)])
+def test_parse_size(text, size):
+    assert workspace.parse_size(text) == size
+
+
+def test_parse_size_rejects_nonsense():
+    with pytest.raises(ValueError):
+        workspace.parse_size('lots')
@@ -0,0 +1,32 @@
+import numpy as np
+import xarray as xr
+import pytest
+from tapefive import fileio
+from tapefive.xarray_backend import Tape12BackendEntrypoint
+
+
+@pytest.fixture
+def path(tape12):
+    return tape12([(100.0, 0.5, np.arange(10.0)), (104.5, 0.5, np.arange(9.0, 30.0))], name='TAPE12', endian='>')
+
+
+def test_lazy_dataset_matches_read_tape12(path):
+    ds = xr.open_dataset(path, engine=Tape12BackendEntrypoint)
+    ref = fileio.read_tape12(path, cache=False)
+    np.testing.assert_array_equal(ds.wavenumber, ref.wavenumber)
+    np.testing.assert_array_equal(ds.attrs['panel_n'], ref.attrs['panel_n'])
+    np.testing.assert_array_equal(ds.optical_depth.values, ref.optical_depth.values)
+
+
+@pytest.mark.parametrize('key', [slice(3, 25, 4), slice(None, None, -3), slice(12, 2, -1), 9, -1, [0, 15, 4], slice(5, 5)])
+def test_indexing(path, key):
+    ds = xr.open_dataset(path, engine=Tape12BackendEntrypoint)
+    ref = fileio.read_tape12(path, cache=False)
+    np.testing.assert_array_equal(ds.optical_depth[key].values, ref.optical_depth[key].values)
+
+
+def test_guess_can_open():
+    entrypoint = Tape12BackendEntrypoint()
+    assert entrypoint.guess_can_open('run/lblrtm/TAPE12')
+    assert entrypoint.guess_can_open('ODdeflt_001')
+    assert not entrypoint.guess_can_open('spectrum.nc')